@@ -0,0 +1,207 @@
+"""Build and verify the precompiled answer table read by :mod:`kiosk`.
+
+``build`` ranks the crops for every soil type x state x rainfall slider step
+from the crops table, as the app does for a one-hectare farm (the
+:func:`core.rank_crops` ranking, with the same ranking weights), and writes the
+answers in the binary layout described in :mod:`kiosk`. Steps with the same
+rainfall band share one answer list, and only crops that appear in some
+answer get a record, one per soil type since ``profit_per_hectare`` is the
+profit after that soil's fertilizer. ``check`` runs every query through
+:func:`core.rank_crops` on the live engine and compares ids, figures and
+names in every language against the table.
+
+Answers use catalog prices; live mandi prices need the database. In states
+whose ranking weights make farm size matter, the table is ranked for one
+hectare.
+
+Usage:
+    python answers.py build answers.bin
+    python answers.py build answers.bin --weights weights.json --top-k 20
+    python answers.py check answers.bin
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import db
+import kiosk
+import migrations
+from catalog import LANGUAGES, SOIL_TYPES, STATES, CropCatalog
+from core import RAINFALL_RANGE, TOP_K, rank_crops
+from engine import RecommendationEngine
+from ranking import CropScorer, load_weights
+
+
+def _aligned(data):
+    return data + b'\0' * (-len(data) % kiosk.ALIGNMENT)
+
+
+def _layout(meta, sections):
+    """Header and metadata, with each section's (offset, length) filled in"""
+    # Offsets start after the metadata that lists them, so lay out until its length settles
+    header = b''
+    while True:
+        offset = len(header)
+        meta['sections'] = {}
+        for name, data in sections:
+            meta['sections'][name] = [offset, len(data)]
+            offset += len(_aligned(data))
+        encoded = json.dumps(meta).encode('utf-8')
+        laid_out = _aligned(kiosk.HEADER.pack(kiosk.MAGIC, kiosk.FORMAT_VERSION, len(encoded)) + encoded)
+        if len(laid_out) == len(header):
+            return laid_out
+        header = laid_out
+
+
+def _load(pool, weights):
+    """Catalog version and a scorer (with its engine) over the current crops table"""
+    version = db.fetch_catalog_version(pool)
+    engine = RecommendationEngine(CropCatalog(db.fetch_crops(pool), db.fetch_crop_nutrients(pool)))
+    return version, CropScorer(engine, weights)
+
+
+def _rainfall_steps():
+    low, high, step = RAINFALL_RANGE
+    return range(low, high + 1, step)
+
+
+def rank_all(scorer, top_k=TOP_K):
+    """Soil type, catalog positions of the ranked crops and the match count for every slot, in slot order"""
+    engine = scorer.engine
+    answers = []
+    for soil_type in SOIL_TYPES:
+        for location in STATES:
+            by_band = {}
+            for rainfall in _rainfall_steps():
+                band = engine.rainfall_band(soil_type, location, rainfall)
+                if band not in by_band:
+                    positions = engine.match(soil_type, rainfall, location)
+                    top = scorer.top_k(positions, soil_type, location, 1.0, top_k)
+                    by_band[band] = (soil_type, engine.order[top], len(positions))
+                answers.append(by_band[band])
+    return answers
+
+
+def build(pool, path, weights=None, top_k=TOP_K):
+    """Write the answer table for the current crops table to ``path``; returns its metadata"""
+    version, scorer = _load(pool, weights)
+    catalog = scorer.engine.catalog
+    answers = rank_all(scorer, top_k)
+
+    # Answer lists, each distinct list once, over the (soil, crop) pairs that appear in any of them
+    numbers, lists, index, starts = {}, [], [], {}
+    for soil_type, positions, matches in answers:
+        key = (soil_type, positions.tobytes())
+        if key not in starts:
+            starts[key] = len(lists)
+            lists.extend(numbers.setdefault((soil_type, position), len(numbers)) for position in positions.tolist())
+        index.append((starts[key], len(positions), matches))
+    positions = np.fromiter((position for _, position in numbers), dtype=np.intp, count=len(numbers))
+
+    # Strings of those crops, each stored once
+    strings = {}
+    crops = catalog.take(positions)
+    crops['profit_per_hectare'] = [catalog.net_profit(soil_type)[position] for soil_type, position in numbers]
+    text = {}
+    for col in kiosk.TEXT_FIELDS + tuple(f'name_{lang}' for lang in LANGUAGES):
+        text[col] = [kiosk.NO_STRING if value is None else strings.setdefault(value, len(strings))
+                     for value in crops[col].tolist()]
+    record = kiosk.crop_record(LANGUAGES)
+    fixed = [crops[col].tolist() for col in kiosk.CROP_FIELDS[:5]]
+    crop_data = b''.join(record.pack(*row) for row in zip(*fixed, *text.values()))
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u4')
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+    sections = [
+        ('crops', crop_data),
+        ('string_offsets', offsets.tobytes()),
+        ('string_data', b''.join(encoded)),
+        ('index', b''.join(kiosk.SLOT.pack(*slot) for slot in index)),
+        ('lists', np.asarray(lists, dtype='<u4').tobytes()),
+    ]
+    meta = {
+        'catalog_version': version,
+        'built': datetime.now().isoformat(timespec='seconds'),
+        'soil_types': list(SOIL_TYPES),
+        'states': list(STATES),
+        'languages': list(LANGUAGES),
+        'rainfall': list(RAINFALL_RANGE),
+        'top_k': top_k,
+        'weights': weights,
+        'crops': len(positions),
+        'answers': len(starts),
+    }
+    header = _layout(meta, sections)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(header)
+        for _, data in sections:
+            f.write(_aligned(data))
+    os.replace(path + '.tmp', path)
+    return meta
+
+
+def check(pool, table, weights=None):
+    """Queries whose table answer differs from the live engine's: list of (soil, rainfall, state, lang)"""
+    _, scorer = _load(pool, table.meta['weights'] if weights is None else weights)
+    mismatches = []
+    for soil_type in table.soil_types:
+        for location in table.states:
+            for rainfall in _rainfall_steps():
+                crops, matches = rank_crops(scorer.engine, scorer, soil_type, rainfall, location, k=table.top_k)
+                fixed = list(zip(*(crops[col].tolist() for col in kiosk.CROP_FIELDS)))
+                for lang in table.languages:
+                    expected = [(name, *row) for name, row in zip(crops[f'name_{lang}'].tolist(), fixed)]
+                    answer = table.answer(soil_type, rainfall, location, lang)
+                    if answer.matches != matches or [tuple(crop) for crop in answer.crops] != expected:
+                        mismatches.append((soil_type, rainfall, location, lang))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompile every crop recommendation into a kiosk answer table")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help="write the answer table for the current crops table")
+    build_parser.add_argument('table', help="output answer table (.bin)")
+    build_parser.add_argument('--weights', help="JSON file of per-state ranking weights")
+    build_parser.add_argument('--top-k', type=int, default=TOP_K, help="ranked crops kept per answer")
+    check_parser = commands.add_parser('check', help="compare an answer table with the live engine")
+    check_parser.add_argument('table', help="answer table built with 'build'")
+    check_parser.add_argument('--weights', help="ranking weights to check against (default: the table's)")
+    args = parser.parse_args(argv)
+
+    pool = db.ConnectionPool(args.db)
+    migrations.migrate(pool)
+    try:
+        weights = load_weights(args.weights) if args.weights else None
+        start = time.perf_counter()
+        if args.command == 'build':
+            meta = build(pool, args.table, weights, args.top_k)
+            print(f"Wrote {meta['answers']} answers over {meta['crops']} crops (catalog version "
+                  f"{meta['catalog_version']}) to {args.table}: {os.path.getsize(args.table):,} bytes "
+                  f"in {time.perf_counter() - start:.2f}s")
+            return
+        table = kiosk.AnswerTable(args.table)
+        version = db.fetch_catalog_version(pool)
+        if table.catalog_version != version:
+            print(f"Table was built from catalog version {table.catalog_version}; the database is at {version}")
+        mismatches = check(pool, table, weights)
+        queries = len(table) * len(table.languages)
+        table.close()
+        print(f"Checked {queries} queries in {time.perf_counter() - start:.2f}s: {len(mismatches)} differ")
+        for soil_type, rainfall, location, lang in mismatches[:20]:
+            print(f"  {soil_type} {rainfall} mm {location} ({lang})")
+        if mismatches:
+            sys.exit(1)
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
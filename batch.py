@@ -0,0 +1,340 @@
+"""Batch crop recommendations for many farms at once.
+
+Usage:
+    python batch.py farms.csv -o recommendations.csv --top-n 5
+    python batch.py farms.csv -o rotations.csv --rotation 24 --start-month 6
+    python batch.py farms.csv -o risk.csv --risk-samples 1000000 --seed 42 --workers 8
+    python batch.py farms.csv -o recommendations.csv --climate rainfall_grid.npy
+    python batch.py farms.csv -o recommendations.csv --live-prices
+
+The farms file needs ``soil_type``, ``rainfall``, ``location`` and
+``farm_size`` columns; an optional ``farm_id`` column is carried through to
+the output, otherwise the row number is used. With ``--climate`` a missing
+or empty ``rainfall`` is filled in with the expected rainfall of the farm's
+state (or of its ``district``, when there is such a column). With
+``--live-prices`` recommendations and risk figures use the rolling 7-day
+mandi prices of :mod:`prices` instead of the catalog's (rotations keep
+catalog prices).
+
+Crops are ranked on their profit per hectare after the fertilizer they need
+on the farm's soil type (see :mod:`nutrients`), and each recommendation
+comes with the whole bags of urea, DAP and MOP the farm has to buy, their
+cost, and the total profit left after them.
+"""
+import argparse
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import climate
+import db
+import migrations
+import nutrients
+import prices
+import ranking
+import risk
+from catalog import CropCatalog
+from engine import RecommendationEngine, split_keys
+from rotation import RotationSolver
+
+FARM_COLUMNS = ['soil_type', 'rainfall', 'location', 'farm_size']
+RESULT_COLUMNS = ['farm_id', 'rank', 'crop_id', 'crop', 'soil_type', 'rainfall', 'location',
+                  'farm_size', 'profit_per_hectare', *nutrients.BAG_COLUMNS, 'fertilizer_cost', 'total_profit']
+ROTATION_COLUMNS = ['farm_id', 'step', 'crop_id', 'crop', 'sow_month', 'sow_offset', 'duration_months',
+                    'soil_type', 'rainfall', 'location', 'farm_size', 'profit_per_hectare', 'total_profit']
+
+# Upper bound on farms x crops cells evaluated at once
+CELL_BUDGET = 4_000_000
+
+# Crop-side arrays for one soil type, with the crops in order of their net profit on it
+SoilView = namedtuple('SoilView', 'rank soil states min_rainfall max_rainfall features')
+
+
+def _key_matrix(column, keys):
+    """Boolean matrix (len(keys) + 1, n_crops): row i marks crops accepting keys[i].
+
+    The extra last row is all False so that unknown keys (code -1) match nothing.
+    """
+    position = {key: i for i, key in enumerate(keys)}
+    matrix = np.zeros((len(keys) + 1, len(column)), dtype=bool)
+    for j, value in enumerate(column.tolist()):
+        for key in split_keys(value):
+            matrix[position[key], j] = True
+    return matrix
+
+
+def _codes(values, keys):
+    return pd.Categorical(values.astype(str).str.strip().str.lower(), categories=keys).codes
+
+
+class BatchScorer:
+    """Crop-side matrices for batch scoring, built once and reused across farm chunks.
+
+    ``needs`` are the crops' ``crop_nutrients`` rows; without them no crop
+    has a fertilizer cost.
+    """
+
+    def __init__(self, crops_df, lang='en', weights=None, needs=None):
+        crops = crops_df.sort_values('profit_per_hectare', ascending=False, kind='mergesort')
+        crops = crops.reset_index(drop=True)
+        self.size = len(crops)
+        self.soil_keys = sorted({key for value in crops['soil_types'] for key in split_keys(value)})
+        self.state_keys = sorted({key for value in crops['states'] for key in split_keys(value)})
+        self.soil_matrix = _key_matrix(crops['soil_types'], self.soil_keys)
+        self.state_matrix = _key_matrix(crops['states'], self.state_keys)
+        self.min_rainfall = crops['min_rainfall'].to_numpy()
+        self.max_rainfall = crops['max_rainfall'].to_numpy()
+        self.profit = crops['profit_per_hectare'].to_numpy()
+        self.crop_ids = crops['id'].to_numpy()
+        self.crop_names = crops[f'name_{lang}'].to_numpy()
+
+        # Per soil key: N/P2O5/K2O needs of every crop, and its profit per hectare after buying them
+        arrays = nutrients.need_arrays(self.crop_ids, needs)
+        none = np.zeros((self.size, len(nutrients.NUTRIENT_COLUMNS)), dtype=np.float32)
+        self.needs = np.stack([arrays.get(key, none) for key in self.soil_keys]) if self.soil_keys else None
+        self.net_profit = np.stack([nutrients.net_profit(self.profit, soil_needs) for soil_needs in self.needs]) \
+            if self.soil_keys else None
+
+        # Ranking weights per state key, the default in the extra last row (unknown states)
+        weights = dict(weights or {})
+        default = ranking.weight_vector(weights.pop('default', ranking.DEFAULT_WEIGHTS))
+        regions = {state.strip().lower(): ranking.weight_vector(w) for state, w in weights.items()}
+        self.state_weights = np.array([regions.get(key, default) for key in self.state_keys] + [default])
+        self.profit_only = bool((self.state_weights[:, 0] > 0).all() and not self.state_weights[:, 1:].any())
+        self.features = None
+        if not self.profit_only:
+            self.features = ranking.objectives(
+                self.profit, crops['market_price'].to_numpy(), pd.factorize(crops['pest_risk'])[::-1],
+                pd.factorize(crops['water_requirement'])[::-1], crops['duration_months'].to_numpy())
+        self._views = {}
+
+    def soil_view(self, code):
+        """:class:`SoilView` of a soil key, built on first use"""
+        view = self._views.get(code)
+        if view is None:
+            rank = np.argsort(-self.net_profit[code], kind='stable')
+            features = None
+            if self.features is not None:
+                # Same profit objective as ranking.CropScorer: net profit over the best catalog profit
+                features = self.features[rank]
+                features[:, 0] = self.net_profit[code][rank] / ranking._top(self.profit.astype(np.float64))
+            view = self._views[code] = SoilView(rank, self.soil_matrix[code][rank], self.state_matrix[:, rank],
+                                                self.min_rainfall[rank], self.max_rainfall[rank], features)
+        return view
+
+    def top_positions(self, soil_codes, state_codes, rainfall, top_n, farm_size=None):
+        """(farms x top_n) crop positions, -1 where a farm has fewer matches"""
+        # Farms sharing (soil, state, rainfall) get the same answer, as do farms of the same
+        # size when weighted scores make size matter: score each group once
+        columns = [soil_codes, state_codes, rainfall] + ([] if self.profit_only else [farm_size])
+        groups, inverse = np.unique(np.column_stack(columns), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        top = np.full((len(groups), top_n), -1, dtype=np.intp)
+        chunk_size = max(1, CELL_BUDGET // max(1, self.size))
+        # Groups come sorted by soil; each soil's groups are ranked in that soil's crop order
+        soils = groups[:, 0].astype(np.intp)
+        bounds = np.flatnonzero(np.diff(soils)) + 1
+        for first, last in zip(np.r_[0, bounds], np.r_[bounds, len(groups)]):
+            if soils[first] < 0:
+                # Unknown soil type: no crop lists it
+                continue
+            view = self.soil_view(soils[first])
+            for start in range(first, last, chunk_size):
+                chunk = groups[start:min(start + chunk_size, last)]
+                r = chunk[:, 2:3]
+                mask = (view.soil
+                        & view.states[chunk[:, 1].astype(np.intp)]
+                        & (view.min_rainfall <= r)
+                        & (view.max_rainfall >= r))
+                if self.profit_only:
+                    # Crops are in net profit order, so the first N matches per row are the top N
+                    rank = np.cumsum(mask, axis=1, dtype=np.int32)
+                    rows, cols = np.nonzero(mask & (rank <= top_n))
+                    top[rows + start, rank[rows, cols] - 1] = view.rank[cols]
+                    continue
+                weights = self.state_weights[chunk[:, 1].astype(np.intp)]
+                weights[:, 0] *= chunk[:, 3]
+                scores = np.where(mask, weights @ view.features.T, -np.inf)
+                picked = ranking.top_k(scores, min(top_n, self.size))
+                matched = np.take_along_axis(mask, picked, axis=1)
+                top[start:start + len(chunk), :picked.shape[1]] = np.where(matched, view.rank[picked], -1)
+        return top[inverse]
+
+    def score(self, farms_df, top_n=5):
+        """Top-N crops for every farm in ``farms_df`` as a long-format table"""
+        missing = [col for col in FARM_COLUMNS if col not in farms_df.columns]
+        if missing:
+            raise ValueError(f"farms table is missing columns: {', '.join(missing)}")
+
+        farm_ids = farms_df['farm_id'].to_numpy() if 'farm_id' in farms_df.columns else farms_df.index.to_numpy()
+        soil_codes = _codes(farms_df['soil_type'], self.soil_keys)
+        state_codes = _codes(farms_df['location'], self.state_keys)
+        rainfall = farms_df['rainfall'].to_numpy(dtype=float)
+        farm_size = farms_df['farm_size'].to_numpy(dtype=float)
+
+        farm_top = self.top_positions(soil_codes, state_codes, rainfall, top_n, farm_size)
+        rows, slots = np.nonzero(farm_top >= 0)
+        cols = farm_top[rows, slots]
+        soils = soil_codes[rows].astype(np.intp)
+        profit = self.net_profit[soils, cols] if len(rows) else self.profit[cols]
+        plan = nutrients.farm_plan(nutrients.rates(self.needs[soils, cols]) if len(rows) else np.zeros((0, 3)),
+                                   profit, farm_size[rows])
+        result = pd.DataFrame({
+            'farm_id': farm_ids[rows],
+            'rank': slots + 1,
+            'crop_id': self.crop_ids[cols],
+            'crop': self.crop_names[cols],
+            'soil_type': farms_df['soil_type'].to_numpy()[rows],
+            'rainfall': farms_df['rainfall'].to_numpy()[rows],
+            'location': farms_df['location'].to_numpy()[rows],
+            'farm_size': farms_df['farm_size'].to_numpy()[rows],
+            'profit_per_hectare': profit,
+            **{col: bags for col, bags in zip(nutrients.BAG_COLUMNS, plan.bags.T)},
+            'fertilizer_cost': plan.cost,
+            'total_profit': plan.profit,
+        })
+        return result[RESULT_COLUMNS]
+
+
+def recommend_batch(crops_df, farms_df, top_n=5, lang='en', weights=None, needs=None):
+    """Top-N crops for every farm as a long-format table.
+
+    Eligibility is a soil x state x rainfall mask over the crops computed with
+    NumPy for each distinct (soil, state, rainfall) triple and broadcast back to
+    the farms; there is no Python loop per farm. Crops are ranked by
+    ``profit_per_hectare`` after the fertilizer for ``needs`` (``crop_nutrients``
+    rows) unless per-state ranking ``weights`` are given (see :mod:`ranking`).
+    The bag columns and ``fertilizer_cost`` are what the whole farm buys, and
+    ``total_profit`` is the farm's profit after them.
+    """
+    return BatchScorer(crops_df, lang, weights, needs).score(farms_df, top_n)
+
+
+def iter_recommend_batch(crops_df, farm_chunks, top_n=5, lang='en', weights=None, needs=None):
+    """Like :func:`recommend_batch` over an iterable of farm DataFrames, yielding one result per chunk"""
+    scorer = BatchScorer(crops_df, lang, weights, needs)
+    for farms_df in farm_chunks:
+        yield scorer.score(farms_df, top_n)
+
+
+def add_profit_risk(result, crops_df, samples=risk.SAMPLES, seed=None, workers=1):
+    """``result`` with P10/P50/P90 whole-farm profit and the chance of a loss per row.
+
+    Each distinct recommended crop and profit after fertilizer is simulated
+    once, spread over ``workers`` processes (see :func:`risk.risk_table`),
+    however many farms it is recommended to. Whole-farm figures carry the
+    same bag rounding as ``total_profit``.
+    """
+    keys = ['crop_id', 'profit_per_hectare']
+    pairs = result[keys].drop_duplicates()
+    crops = pairs.merge(crops_df.drop(columns='profit_per_hectare'), left_on='crop_id', right_on='id')
+    table = risk.risk_table(crops, samples, seed, workers).drop(columns='id')
+    per_hectare = result[keys].merge(pd.concat([crops[keys], table], axis=1), on=keys, how='left')
+    farm_size = result['farm_size'].to_numpy(dtype=float)
+    rounding = result['total_profit'].to_numpy(dtype=float) - result['profit_per_hectare'].to_numpy() * farm_size
+    result = result.copy()
+    for quantile in ('profit_p10', 'profit_p50', 'profit_p90'):
+        result[quantile] = per_hectare[quantile].to_numpy() * farm_size + rounding
+    result['loss_chance'] = per_hectare['loss_chance'].to_numpy()
+    return result
+
+
+def rotate_batch(crops_df, farms_df, horizon=12, start_month=6, lang='en', needs=None):
+    """Most profitable crop rotation for every farm as a long-format table, one row per planting.
+
+    Plans are solved per hectare and memoized on (soil, state, rainfall band),
+    so farms that differ only in size or in rainfall within a band share a
+    solve. ``sow_month`` is the calendar month and ``sow_offset`` the months
+    from the start of the plan. Profits are after the fertilizer for ``needs``.
+    """
+    missing = [col for col in FARM_COLUMNS if col not in farms_df.columns]
+    if missing:
+        raise ValueError(f"farms table is missing columns: {', '.join(missing)}")
+    solver = RotationSolver(RecommendationEngine(CropCatalog(crops_df, needs)))
+    catalog = solver.engine.catalog
+
+    farm_ids = farms_df['farm_id'].to_numpy() if 'farm_id' in farms_df.columns else farms_df.index.to_numpy()
+    soils = farms_df['soil_type'].astype(str).str.strip().str.lower().to_numpy()
+    locations = farms_df['location'].astype(str).str.strip().str.lower().to_numpy()
+    rainfall = farms_df['rainfall'].to_numpy(dtype=float)
+    farm_size = farms_df['farm_size'].to_numpy(dtype=float)
+
+    plans = {}
+    rows, positions, sow = [], [], []
+    for i, query in enumerate(zip(soils, rainfall, locations)):
+        key = solver.key(*query, horizon, start_month)
+        plan = plans.get(key)
+        if plan is None:
+            plan = plans[key] = solver.solve(*query, horizon, start_month)
+        rows.extend([i] * len(plan.positions))
+        positions.extend(plan.positions.tolist())
+        sow.extend(plan.sow.tolist())
+    rows, positions, sow = np.array(rows, dtype=np.intp), np.array(positions, dtype=np.intp), np.array(sow)
+    step = np.arange(len(rows)) - np.searchsorted(rows, rows) + 1
+    profit = np.zeros(len(positions), dtype=np.int64)
+    for soil_type in np.unique(soils[rows]):
+        planted_on = soils[rows] == soil_type
+        profit[planted_on] = catalog.net_profit(soil_type)[positions[planted_on]]
+    planted, inverse = np.unique(positions, return_inverse=True)
+    result = pd.DataFrame({
+        'farm_id': farm_ids[rows],
+        'step': step,
+        'crop_id': catalog['id'][positions],
+        'crop': catalog.take(planted)[f'name_{lang}'].to_numpy()[inverse],
+        'sow_month': (start_month - 1 + sow) % 12 + 1,
+        'sow_offset': sow,
+        'duration_months': catalog['duration_months'][positions],
+        'soil_type': farms_df['soil_type'].to_numpy()[rows],
+        'rainfall': farms_df['rainfall'].to_numpy()[rows],
+        'location': farms_df['location'].to_numpy()[rows],
+        'farm_size': farms_df['farm_size'].to_numpy()[rows],
+        'profit_per_hectare': profit,
+        'total_profit': profit * farm_size[rows],
+    })
+    return result[ROTATION_COLUMNS]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a whole district of farms in one go")
+    parser.add_argument('farms', help="CSV with soil_type, rainfall, location, farm_size columns")
+    parser.add_argument('-o', '--output', default='recommendations.csv', help="output CSV path")
+    parser.add_argument('--top-n', type=int, default=5, help="crops to keep per farm")
+    parser.add_argument('--lang', default='en', help="language for crop names")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database")
+    parser.add_argument('--weights', help="JSON file of per-state ranking weights")
+    parser.add_argument('--rotation', type=int, metavar='MONTHS',
+                        help="plan a crop rotation over this many months (12-36) instead of ranking crops")
+    parser.add_argument('--start-month', type=int, default=6, help="calendar month the rotation starts in")
+    parser.add_argument('--risk-samples', type=int, metavar='N',
+                        help="add P10/P50/P90 profit from N simulated seasons per crop")
+    parser.add_argument('--seed', type=int, help="seed for reproducible risk figures")
+    parser.add_argument('--workers', type=int, default=0, help="processes for the risk simulation (default: one per CPU)")
+    parser.add_argument('--climate', help="rainfall grid (.npy from climate.py) to fill in missing rainfall")
+    parser.add_argument('--live-prices', action='store_true', help="rank on current mandi prices from price_ticks")
+    args = parser.parse_args(argv)
+
+    pool = db.ConnectionPool(args.db)
+    migrations.migrate(pool)
+    crops_df = db.fetch_crops(pool)
+    needs = db.fetch_crop_nutrients(pool)
+    live_df = prices.current_crops(pool) if args.live_prices and not args.rotation else crops_df
+    pool.close()
+    farms_df = pd.read_csv(args.farms)
+    if args.climate:
+        farms_df = climate.fill_rainfall(farms_df, climate.Climatology(args.climate))
+    if args.rotation:
+        result = rotate_batch(crops_df, farms_df, args.rotation, args.start_month, lang=args.lang, needs=needs)
+        result.to_csv(args.output, index=False)
+        print(f"Planned {len(farms_df)} farms -> {len(result)} plantings in {args.output}")
+        return
+    weights = ranking.load_weights(args.weights) if args.weights else None
+    result = recommend_batch(live_df, farms_df, top_n=args.top_n, lang=args.lang, weights=weights, needs=needs)
+    if args.risk_samples:
+        result = add_profit_risk(result, live_df, args.risk_samples, args.seed, args.workers)
+    result.to_csv(args.output, index=False)
+    print(f"Scored {len(farms_df)} farms -> {len(result)} recommendations in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Memory per session: pandas DataFrame via st.cache_data vs shared CropCatalog.
+
+st.cache_data pickles the cached DataFrame and unpickles a fresh copy for
+every caller, so each session holds its own copy of the crops table. The
+CropCatalog is held with st.cache_resource and shared by reference; a
+session only holds the rows its query returned.
+
+Usage:
+    python -m benchmarks.bench_catalog_memory --rows 50000 --sessions 20
+"""
+import argparse
+import gc
+import json
+import pickle
+import tracemalloc
+
+from benchmarks.synthetic import make_crops
+from catalog import CropCatalog
+from engine import RecommendationEngine
+
+
+def _allocated(build):
+    """Bytes still allocated after ``build()`` returns, and its result"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, result
+
+
+def run(rows, sessions):
+    df = make_crops(rows)
+    pickled = pickle.dumps(df)
+
+    # Before: one unpickled DataFrame copy per session
+    before, _ = _allocated(lambda: [pickle.loads(pickled) for _ in range(sessions)])
+
+    # After: one shared catalog and engine, plus each session's query result
+    shared, (catalog, engine) = _allocated(
+        lambda: (lambda c: (c, RecommendationEngine(c)))(CropCatalog(df)))
+    per_query, _ = _allocated(lambda: [engine.recommend('loamy', 1200, 'karnataka') for _ in range(sessions)])
+
+    return {
+        'rows': rows,
+        'sessions': sessions,
+        'dataframe_bytes': int(df.memory_usage(deep=True).sum()),
+        'catalog_bytes': catalog.nbytes,
+        'before_bytes_per_session': before // sessions,
+        'after_shared_bytes': shared,
+        'after_bytes_per_session': per_query // sessions,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50_000, help="crop varieties in the catalog")
+    parser.add_argument('--sessions', type=int, default=20, help="concurrent sessions to simulate")
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.rows, args.sessions), indent=2))
+
+
+if __name__ == "__main__":
+    main()
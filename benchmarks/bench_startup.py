@@ -0,0 +1,132 @@
+"""Startup time and resident memory of the app, and what translations cost.
+
+Each run starts a fresh interpreter that imports the app's modules, runs
+app.py once headless with Streamlit's AppTest and reports the first-run
+time and peak resident memory; the medians over ``--runs`` are printed.
+Translations are measured in this process: loading one language's bundle
+cold and cached, and the memory held by one language against all of them
+(what the old inline dictionary kept for every process). So is what the
+old ``init_db`` repeated on every rerun before migrations ran once per
+process: connect, create the tables and count the crops.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import db
+import i18n
+import migrations
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _start_once():
+    import logging
+    import resource
+
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    logging.disable(logging.WARNING)
+    imported = time.perf_counter()
+    app = AppTest.from_file(os.path.join(ROOT, 'app.py'), default_timeout=120).run()
+    done = time.perf_counter()
+    if app.exception:
+        raise SystemExit(f"app.py failed: {app.exception[0].message}")
+    print(json.dumps({
+        'import_ms': (imported - start) * 1000,
+        'first_run_ms': (done - imported) * 1000,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+
+def _held(build):
+    """Bytes still allocated after ``build()`` returns"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def translation_costs(lang='kn'):
+    i18n._bundles.clear()
+    start = time.perf_counter()
+    i18n.translations(lang)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(10_000):
+        i18n.translations(lang)
+    cached = (time.perf_counter() - start) / 10_000
+    i18n._bundles.clear()
+    one = _held(lambda: i18n._load(lang))
+    every = _held(lambda: [i18n._load(code) for code in i18n.languages()])
+    return {
+        'bundle_load_cold_us': round(cold * 1e6, 1),
+        'bundle_lookup_cached_us': round(cached * 1e6, 3),
+        'one_language_bytes': one,
+        'all_languages_bytes': every,
+    }
+
+
+def legacy_init_cost(runs=20):
+    """Median ms of the old per-rerun init_db against a migrated database (migrations.LEGACY_INIT_SECONDS)"""
+    directory = tempfile.mkdtemp(prefix='bench_startup_')
+    try:
+        path = os.path.join(directory, 'agriculture.db')
+        pool = db.ConnectionPool(path)
+        migrations.migrate(pool)
+        pool.close()
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            conn = sqlite3.connect(path)
+            # Rolled back: search_history no longer lives in this file
+            conn.execute('BEGIN')
+            migrations.legacy_init_db(conn)
+            conn.rollback()
+            conn.close()
+            times.append(time.perf_counter() - start)
+        return round(statistics.median(times) * 1000, 3)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app startup time and resident memory")
+    parser.add_argument('--runs', type=int, default=5, help="fresh processes to start")
+    parser.add_argument('--once', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.once:
+        _start_once()
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--once'], cwd=ROOT,
+                             check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    results = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+    results['runs'] = args.runs
+    results['translations'] = translation_costs()
+    results['legacy_init_db_ms'] = legacy_init_cost()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Load test for the HTTP recommendation service.
+
+Opens ``--connections`` keep-alive connections and sends ``--requests``
+random queries across them, then prints throughput and latency percentiles
+as JSON. With ``--spawn`` a local service is started on ``--port`` for the
+duration of the run.
+
+Usage:
+    python -m benchmarks.loadtest --spawn --requests 20000 --connections 64
+    python -m benchmarks.loadtest --host 127.0.0.1 --port 8080 --batch 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.synthetic import SOILS, STATES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _query(rng):
+    return {'soil_type': rng.choice(SOILS), 'location': rng.choice(STATES),
+            'rainfall': rng.randrange(200, 3001, 50), 'farm_size': round(rng.uniform(0.5, 10), 1),
+            'lang': 'en', 'top_n': 4}
+
+
+def _request(path, payload):
+    body = json.dumps(payload).encode('utf-8')
+    return (f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode('latin-1') + body
+
+
+async def _client(host, port, count, batch, seed, latencies, errors):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(count):
+            if batch > 1:
+                request = _request('/recommend/batch', {'queries': [_query(rng) for _ in range(batch)]})
+            else:
+                request = _request('/recommend', _query(rng))
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = 0
+            for line in head.decode('latin-1').split('\r\n')[1:]:
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if not head.startswith(b'HTTP/1.1 200'):
+                errors.append(head.split(b'\r\n', 1)[0].decode('latin-1'))
+    finally:
+        writer.close()
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run(host, port, requests, connections, batch):
+    latencies, errors = [], []
+    per_client = [requests // connections + (i < requests % connections) for i in range(connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, count, batch, seed, latencies, errors)
+                           for seed, count in enumerate(per_client) if count))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'queries': len(latencies) * batch,
+        'connections': connections,
+        'batch': batch,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'queries_per_second': round(len(latencies) * batch / elapsed, 1),
+        'latency_ms': {f'p{int(q * 100)}': round(_percentile(latencies, q) * 1000, 3)
+                       for q in (0.5, 0.95, 0.99)},
+        'errors': len(errors),
+    }
+
+
+async def _wait_ready(host, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the HTTP recommendation service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--requests', type=int, default=10_000)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--batch', type=int, default=1, help="queries per request (uses /recommend/batch when > 1)")
+    parser.add_argument('--spawn', action='store_true', help="start a local service for the run")
+    parser.add_argument('--workers', type=int, default=8, help="service worker threads with --spawn")
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'service.py'), '--host', args.host, '--port', str(args.port),
+             '--workers', str(args.workers), '--no-history'], cwd=ROOT)
+    try:
+        asyncio.run(_wait_ready(args.host, args.port))
+        result = asyncio.run(run(args.host, args.port, args.requests, args.connections, args.batch))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Rerun cost of a slider move: whole page vs the recommendation fragment.
+
+Drives app.py headless with Streamlit's AppTest, moving the rainfall slider
+``--moves`` times after a search, and reads the stage timings: ``rerun`` is
+what every interaction cost when the whole script reran, and
+``fragment.recommendation`` is what an input change costs now that it only
+reruns that fragment. Prints both and the difference as JSON.
+
+Usage:
+    python -m benchmarks.reruns --moves 50
+"""
+import argparse
+import json
+import logging
+import os
+
+import perf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the rerun time saved by fragments")
+    parser.add_argument('--moves', type=int, default=30, help="slider moves to time")
+    args = parser.parse_args(argv)
+
+    from streamlit.testing.v1 import AppTest
+
+    logging.disable(logging.WARNING)
+    perf.enable()
+    app = AppTest.from_file(os.path.join(ROOT, 'app.py'), default_timeout=120).run()
+    app.slider[0].set_value(1500).run()
+    app.button[0].click().run()
+    perf.reset()
+    for i in range(args.moves):
+        app.slider[0].set_value(200 + 50 * (i % 57)).run()
+
+    stages = perf.snapshot()['stages']
+    page, section = stages['rerun'], stages['fragment.recommendation']
+    print(json.dumps({
+        'moves': args.moves,
+        'full_rerun_ms': {key: page[key] for key in ('p50_ms', 'p95_ms')},
+        'fragment_rerun_ms': {key: section[key] for key in ('p50_ms', 'p95_ms')},
+        'saved_per_move_ms': round(page['p50_ms'] - section['p50_ms'], 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
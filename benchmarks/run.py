@@ -0,0 +1,317 @@
+"""Benchmark suite for the recommendation, persistence and export hot paths.
+
+For each catalog size a throwaway database is built with the real schema
+(via migrations), filled with synthetic crops and search history, and the
+hot paths are timed headless:
+
+- load_crops: read the crops table, build the CropCatalog and the engine
+- recommend_crops: first query per (soil, state), warm queries, and top-k
+  by profit vs by a weighted multi-objective score
+- nutrients: profit after fertilizer for the whole catalog on one soil,
+  whole-bag plans for 10^6 crop x farm rows, and batch scoring 10^6 farms
+  with their fertilizer plans
+- rotation: a 36-month crop rotation plan for one field
+- risk: 10^6 Monte Carlo seasons for one crop
+- climate: building a rainfall grid from CSV, and expected rainfall for a
+  district from it, first lookup and memoized
+- save_to_history: one record per transaction, and batched
+- history query: first and deep keyset pages (the deep one in an older
+  month's partition), top crops per soil summed over the monthly rollups,
+  and archiving one month to Parquet
+- csv export: per-query report and a streamed batch report
+- answers: precompiling every slider answer into the kiosk table, opening
+  it and answering from it (first decode and memoized)
+- ingest: bulk CSV load of the catalog as new crops, as stored but not yet
+  fingerprinted, with a tenth of the prices changed, and unchanged (rows
+  per second for each)
+- prices: appending 90 days of mandi ticks (up to 500 crops x 20 markets)
+  from CSV, the first poll of the rolling prices and a one-day poll after
+  it, and live prices for a top-k list
+
+Results are printed (or written with ``--output``) as JSON. Pass
+``--compare`` with an earlier result file to flag slowdowns.
+
+Usage:
+    python -m benchmarks.run --sizes 10 1000 100000 --output bench.json
+    python -m benchmarks.run --sizes 1000000 --history 1000000 --compare bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import answers
+import climate
+import db
+import export
+import history_store
+import kiosk
+import migrations
+import nutrients
+import prices
+from batch import BatchScorer
+from benchmarks.synthetic import (SOILS, STATES, make_crops, make_farms, make_history, make_needs,
+                                 make_rainfall, make_ticks)
+from catalog import LANGUAGES, CropCatalog
+from core import TOP_K, build_recommendation, rank_crops, recommend_crops
+from engine import RecommendationEngine
+from ingest import CROP_COLUMNS, ingest, read_chunks
+from ranking import CropScorer
+from risk import profit_risk
+from rotation import RotationSolver
+
+# Multi-objective weights for the ranked top-k timings
+WEIGHTS = {'default': {'profit': 1.0, 'market_price': 0.3, 'pest_risk': 0.2, 'water': 0.2, 'duration': 0.1}}
+
+
+def timeit(func, repeat=5, number=1):
+    """Per-call timings of ``func`` in milliseconds: median, min and max over ``repeat`` runs"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        runs.append((time.perf_counter() - start) * 1000 / number)
+    return {'median_ms': round(statistics.median(runs), 4), 'min_ms': round(min(runs), 4),
+            'max_ms': round(max(runs), 4), 'calls': repeat * number}
+
+
+def _queries(count, seed=0):
+    rng = random.Random(seed)
+    return [(rng.choice(SOILS), rng.randrange(200, 3001, 50), rng.choice(STATES)) for _ in range(count)]
+
+
+def _populate(pool, store, crops_df, needs, history):
+    with pool.transaction() as conn:
+        conn.execute('DELETE FROM crop_nutrients')
+        conn.execute('DELETE FROM crops')
+        conn.executemany(f"INSERT INTO crops ({', '.join(CROP_COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(CROP_COLUMNS))})",
+                         crops_df[CROP_COLUMNS].itertuples(index=False, name=None))
+        for lang in LANGUAGES:
+            conn.executemany(f"INSERT INTO crop_names VALUES (?, '{lang}', ?)",
+                             crops_df[['id', f'name_{lang}']].itertuples(index=False, name=None))
+        conn.executemany("INSERT INTO crop_nutrients VALUES (?, ?, ?, ?, ?)",
+                         needs[nutrients.NEED_COLUMNS].itertuples(index=False, name=None))
+    for start in range(0, len(history), 50_000):
+        store.insert_many(history[start:start + 50_000])
+
+
+def bench_size(rows, history_rows, workdir):
+    path = os.path.join(workdir, f'bench_{rows}.db')
+    pool = db.ConnectionPool(path)
+    migrations.migrate(pool)
+    store = history_store.HistoryStore(path)
+    crops_df = make_crops(rows)
+    needs = make_needs(crops_df)
+    history = make_history(history_rows, crops_df)
+    setup_start = time.perf_counter()
+    _populate(pool, store, crops_df, needs, history)
+    results = {'rows': rows, 'history_rows': history_rows,
+               'setup_s': round(time.perf_counter() - setup_start, 3)}
+
+    repeat = 3 if rows >= 100_000 else 5
+    results['load_crops.fetch'] = timeit(lambda: db.fetch_crops(pool), repeat=repeat)
+    fetched = db.fetch_crops(pool)
+    fetched_needs = db.fetch_crop_nutrients(pool)
+    results['load_crops.catalog'] = timeit(lambda: CropCatalog(fetched, fetched_needs), repeat=repeat)
+    catalog = CropCatalog(fetched, fetched_needs)
+    results['load_crops.engine'] = timeit(lambda: RecommendationEngine(catalog), repeat=repeat)
+
+    queries = _queries(200)
+
+    def cold():
+        engine = RecommendationEngine(catalog)
+        for soil_type, rainfall, location in queries[:20]:
+            recommend_crops(engine, soil_type, rainfall, location)
+
+    results['recommend_crops.cold_20'] = timeit(cold, repeat=repeat)
+    engine = RecommendationEngine(catalog)
+    for soil_type in SOILS:
+        for location in STATES:
+            engine.breakpoints(soil_type, location)
+    results['recommend_crops.match'] = timeit(
+        lambda: [engine.match(*query) for query in queries], number=1)
+    results['recommend_crops.match']['per_query_us'] = round(
+        results['recommend_crops.match']['median_ms'] * 1000 / len(queries), 3)
+    results['recommend_crops.frame'] = timeit(
+        lambda: recommend_crops(engine, 'loamy', 1200, 'karnataka'), number=10)
+    scorer = CropScorer(engine)
+    weighted = CropScorer(engine, WEIGHTS)
+    results['recommend_crops.top_k_profit'] = timeit(
+        lambda: rank_crops(engine, scorer, 'loamy', 1200, 'karnataka', 2.0, TOP_K), number=10)
+    results['recommend_crops.top_k_weighted'] = timeit(
+        lambda: rank_crops(engine, weighted, 'loamy', 1200, 'karnataka', 2.0, TOP_K), number=10)
+    solver = RotationSolver(engine)
+    results['rotation.solve_36_months'] = timeit(
+        lambda: solver.solve('loamy', 1200, 'karnataka', 36, 6), number=5)
+    results['nutrients.net_profit_catalog'] = timeit(
+        lambda: nutrients.net_profit(catalog['profit_per_hectare'], catalog.nutrient_needs('loamy')), repeat=repeat)
+    plans = np.random.default_rng(5).integers(0, 300, (1_000_000, 3))
+    plan_profit = nutrients.net_profit(np.full(len(plans), 150_000), plans)
+    plan_size = make_farms(len(plans))['farm_size'].to_numpy()
+    results['nutrients.farm_plan_1m'] = timeit(
+        lambda: nutrients.farm_plan(nutrients.rates(plans), plan_profit, plan_size), repeat=3)
+    results['risk.simulate_1m_samples'] = timeit(
+        lambda: profit_risk(35.0, 25.0, 180000, 'high', 1_000_000, seed=0), repeat=repeat)
+
+    rainfall_csv, grid_path = os.path.join(workdir, 'rainfall.csv'), os.path.join(workdir, 'rainfall_grid.npy')
+    make_rainfall().to_csv(rainfall_csv, index=False)
+    results['climate.build_grid'] = timeit(lambda: climate.build(rainfall_csv, grid_path), repeat=1)
+    climatology = climate.Climatology(grid_path)
+    results['climate.outlook_cold'] = timeit(
+        lambda: (climatology._outlooks.clear(), climatology.outlook('karnataka', 'district-3')), number=100)
+    results['climate.outlook_warm'] = timeit(lambda: climatology.outlook('karnataka', 'district-3'), number=1000)
+    del climatology
+
+    records = make_history(1000, crops_df, seed=7)
+    single = iter(records)
+    results['save_to_history.single'] = timeit(lambda: store.insert_many([next(single)]), repeat=5, number=20)
+    results['save_to_history.batch_500'] = timeit(lambda: store.insert_many(records[:500]), repeat=1)
+
+    months = store.months()
+    deep_id = None
+    if months:
+        middle = months[len(months) // 2]
+        with store.pool(middle).connection() as conn:
+            deep_id = history_store.global_id(middle, conn.execute('SELECT MAX(id) FROM search_history').fetchone()[0])
+    results['history.first_page'] = timeit(lambda: store.fetch_page(limit=10), number=10)
+    results['history.deep_page'] = timeit(lambda: store.fetch_page(before_id=deep_id, limit=10), number=10)
+    results['history.top_crops'] = timeit(lambda: store.fetch_top_crops(pool, 'loamy', limit=5), number=10)
+    if months:
+        results['history.archive_month'] = timeit(lambda: store.archive_month(months[0]), repeat=1)
+
+    results['export.csv_query'] = timeit(
+        lambda: build_recommendation(engine, scorer, 'loamy', 1200, 'karnataka', 'en'), number=10)
+    batch = BatchScorer(fetched, needs=fetched_needs)
+    million = make_farms(1_000_000)
+    results['nutrients.batch_1m_farms'] = timeit(lambda: batch.score(million, top_n=1), repeat=1)
+    del million
+    farms = make_farms(100_000)
+    results['export.csv_batch_100k_farms'] = timeit(
+        lambda: export.write_csv((batch.score(chunk) for chunk in export.iter_frame(farms, 20_000)),
+                                 io.BytesIO()), repeat=1)
+
+    table_path = os.path.join(workdir, 'answers.bin')
+    results['answers.build'] = timeit(lambda: answers.build(pool, table_path), repeat=1)
+    results['answers.build']['bytes'] = os.path.getsize(table_path)
+    results['kiosk.open'] = timeit(lambda: kiosk.AnswerTable(table_path).close(), number=100)
+    table = kiosk.AnswerTable(table_path)
+    results['kiosk.answer_cold'] = timeit(
+        lambda: (table._crops.clear(), table.answer('loamy', 1200, 'karnataka', 'kn', 10)), number=100)
+    results['kiosk.answer_warm'] = timeit(lambda: table.answer('loamy', 1200, 'karnataka', 'kn', 10), number=10_000)
+    table.close()
+    os.remove(table_path)
+
+    # The catalog as a file four ways: all crops new (ids past the catalog), as stored but never
+    # loaded before (no fingerprints yet), a tenth of the prices changed, and nothing changed
+    csv_path = os.path.join(workdir, f'crops_{rows}.csv')
+    crops_df.assign(id=crops_df['id'] + rows).to_csv(csv_path, index=False)
+    results['ingest.csv_new_crops'] = timeit(lambda: ingest(pool, read_chunks(csv_path)), repeat=1)
+    crops_df.to_csv(csv_path, index=False)
+    results['ingest.csv_first_check'] = timeit(lambda: ingest(pool, read_chunks(csv_path)), repeat=1)
+    updated = crops_df.copy()
+    updated.loc[updated.index % 10 == 0, 'market_price'] += 1
+    updated.to_csv(csv_path, index=False)
+    results['ingest.csv_price_update'] = timeit(lambda: ingest(pool, read_chunks(csv_path)), repeat=1)
+    results['ingest.csv_unchanged'] = timeit(lambda: ingest(pool, read_chunks(csv_path)), repeat=3)
+    for name in ('ingest.csv_new_crops', 'ingest.csv_first_check', 'ingest.csv_price_update',
+                 'ingest.csv_unchanged'):
+        results[name]['rows_per_second'] = round(rows * 1000 / results[name]['median_ms'])
+    with pool.transaction() as conn:
+        conn.execute('DELETE FROM crops WHERE id > ?', (rows,))
+    os.remove(csv_path)
+
+    priced = crops_df.head(500)
+    ticks_path = os.path.join(workdir, 'ticks.csv')
+    make_ticks(priced).to_csv(ticks_path, index=False)
+    stats = prices.ingest_ticks(pool, read_chunks(ticks_path, 500_000))
+    results['prices.ingest_ticks'] = {'median_ms': round(stats.seconds * 1000, 4), 'rows': stats.rows,
+                                      'rows_per_second': round(stats.rows / stats.seconds)}
+    os.remove(ticks_path)
+    results['prices.poll_cold'] = timeit(lambda: prices.PriceFeed(pool).poll(), repeat=3)
+    feed = prices.PriceFeed(pool)
+    feed.poll()
+    prices.ingest_ticks(pool, [make_ticks(priced, days=1, start='2024-03-31')])
+    results['prices.poll_one_day'] = timeit(feed.poll, repeat=1)
+    results['prices.poll_unchanged'] = timeit(feed.poll, number=100)
+    results['prices.live_crops_top_k'] = timeit(lambda: prices.live_crops(priced.head(TOP_K), feed.prices),
+                                                number=10)
+
+    store.close()
+    pool.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.rmtree(store.directory, ignore_errors=True)
+    return results
+
+
+def compare(current, baseline, threshold):
+    """Benchmarks whose median got slower than ``threshold`` times the baseline"""
+    old = {run['rows']: run for run in baseline['runs']}
+    regressions = []
+    for run in current['runs']:
+        before = old.get(run['rows'])
+        if before is None:
+            continue
+        for name, stats in run.items():
+            if not isinstance(stats, dict) or name not in before:
+                continue
+            ratio = stats['median_ms'] / max(before[name]['median_ms'], 1e-9)
+            if ratio > threshold:
+                regressions.append({'rows': run['rows'], 'benchmark': name, 'ratio': round(ratio, 2),
+                                    'baseline_ms': before[name]['median_ms'], 'current_ms': stats['median_ms']})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the crop planner hot paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100_000], help="catalog sizes")
+    parser.add_argument('--history', type=int, default=100_000, help="search history rows per database")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    parser.add_argument('--compare', help="earlier JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.sizes:
+            print(f"benchmarking {rows} crops ...", file=sys.stderr)
+            report['runs'].append(bench_size(rows, args.history, workdir))
+
+    if args.compare:
+        with open(args.compare) as f:
+            report['regressions'] = compare(report, json.load(f), args.threshold)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if report.get('regressions'):
+        print(f"{len(report['regressions'])} regression(s) over {args.threshold}x", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
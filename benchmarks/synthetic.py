@@ -0,0 +1,122 @@
+"""Synthetic data matching the crops / search_history schema, for benchmarks."""
+import numpy as np
+import pandas as pd
+
+from catalog import COLUMNS, LANGUAGES
+from db import HistoryRecord
+
+SOILS = ['clay', 'sandy', 'loamy', 'black', 'red', 'alluvial']
+STATES = ['karnataka', 'tamilnadu', 'andhra', 'telangana', 'kerala', 'maharashtra', 'punjab']
+SEASONS = ['Kharif', 'Rabi', 'Winter', 'Monsoon', 'Year-round']
+FERTILIZERS = ['Urea', 'DAP', 'NPK', 'Potash', 'Organic Compost']
+WATER = ['Low', 'Medium', 'High', 'Very High']
+RISKS = ['low', 'medium', 'high']
+
+
+def _key_lists(rng, keys, n, low, high):
+    counts = rng.integers(low, high + 1, n)
+    return [','.join(rng.choice(keys, count, replace=False)) for count in counts]
+
+
+def make_crops(n, seed=0):
+    """``n`` crop varieties shaped like the crops table"""
+    rng = np.random.default_rng(seed)
+    min_rainfall = rng.integers(4, 40, n) * 50
+    data = {'id': np.arange(1, n + 1)}
+    for lang in LANGUAGES:
+        data[f'name_{lang}'] = [f'{lang}-variety-{i}' for i in range(n)]
+    data['soil_types'] = _key_lists(rng, SOILS, n, 1, 4)
+    data['min_rainfall'] = min_rainfall
+    data['max_rainfall'] = min_rainfall + rng.integers(4, 30, n) * 50
+    data['states'] = _key_lists(rng, STATES, n, 2, 5)
+    data['yield_per_hectare'] = rng.uniform(1, 70, n).round(1)
+    data['profit_per_hectare'] = rng.integers(20, 300, n) * 1000
+    data['pest_risk'] = rng.choice(RISKS, n)
+    data['fertilizer'] = rng.choice(FERTILIZERS, n)
+    data['market_price'] = rng.uniform(3, 120, n).round(1)
+    data['season'] = rng.choice(SEASONS, n)
+    data['water_requirement'] = rng.choice(WATER, n)
+    data['duration_months'] = rng.integers(3, 13, n)
+    return pd.DataFrame(data, columns=COLUMNS)
+
+
+def make_needs(crops_df, seed=4):
+    """N/P2O5/K2O kg per hectare shaped like crop_nutrients, for every soil type each crop lists"""
+    rng = np.random.default_rng(seed)
+    soils = crops_df['soil_types'].str.split(',')
+    crop_id = np.repeat(crops_df['id'].to_numpy(), soils.str.len().to_numpy())
+    n = len(crop_id)
+    return pd.DataFrame({
+        'crop_id': crop_id,
+        'soil_type': [soil for listed in soils for soil in listed],
+        'n': rng.integers(0, 60, n) * 5,
+        'p': rng.integers(0, 25, n) * 5,
+        'k': rng.integers(0, 40, n) * 5,
+    })
+
+
+def make_farms(n, seed=1):
+    """``n`` farms with slider-quantized rainfall, as taken by the batch API"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'soil_type': rng.choice(SOILS, n),
+        'rainfall': rng.integers(4, 61, n) * 50,
+        'location': rng.choice(STATES, n),
+        'farm_size': rng.uniform(0.5, 10, n).round(1),
+    })
+
+
+def make_history(n, crops_df, seed=2, days=365):
+    """``n`` search history records (db.HistoryRecord) recommending crops from ``crops_df``"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2025-01-01').value // 10**9
+    stamps = pd.to_datetime(start + np.sort(rng.integers(0, days * 86400, n)), unit='s')
+    stamps = stamps.strftime('%Y-%m-%d %H:%M:%S').tolist()
+    soils = rng.choice(SOILS, n).tolist()
+    states = rng.choice(STATES, n).tolist()
+    rainfall = (rng.integers(4, 61, n) * 50).tolist()
+    farm_size = rng.uniform(0.5, 10, n).round(1).tolist()
+    ids = crops_df['id'].to_numpy()
+    names = crops_df['name_en'].to_numpy()
+    picks = rng.integers(0, len(ids), (n, 4))
+    return [HistoryRecord(stamps[i], soils[i], rainfall[i], states[i], farm_size[i],
+                          names[picks[i]].tolist(), ids[picks[i]].tolist())
+            for i in range(n)]
+
+
+def make_rainfall(districts=20, cells=4, years=30, seed=3):
+    """Monthly gridded rainfall in the long format ``climate.py build`` reads"""
+    rng = np.random.default_rng(seed)
+    # A monsoon-shaped year scaled per state, cell and year
+    shape = np.array([5, 5, 10, 30, 60, 180, 280, 240, 160, 90, 40, 10], dtype=np.float64)
+    state = np.repeat(np.arange(len(STATES)), districts * cells * years * 12)
+    n = len(state)
+    scale = rng.uniform(0.5, 2.5, len(STATES))[state] * rng.lognormal(0, 0.2, n // 12).repeat(12)
+    month = np.tile(np.arange(1, 13), n // 12)
+    return pd.DataFrame({
+        'state': np.array(STATES)[state],
+        'district': np.tile(np.repeat([f'district-{i}' for i in range(districts)], cells * years * 12), len(STATES)),
+        'cell': np.tile(np.repeat(np.arange(cells), years * 12), len(STATES) * districts),
+        'year': np.tile(np.repeat(np.arange(1991, 1991 + years), 12), len(STATES) * districts * cells),
+        'month': month,
+        'rainfall_mm': (shape[month - 1] * scale * rng.lognormal(0, 0.3, n)).round(1),
+    })
+
+
+def make_ticks(crops_df, days=90, markets=20, seed=4, start='2024-01-01'):
+    """Daily mandi price ticks: every crop in every market on every day, in date order"""
+    rng = np.random.default_rng(seed)
+    ids = crops_df['id'].to_numpy()
+    base = crops_df['market_price'].to_numpy(dtype=np.float64)
+    per_day = len(ids) * markets
+    crop = np.tile(np.repeat(np.arange(len(ids)), markets), days)
+    # A random walk per crop around its catalog price, plus market noise
+    walk = np.exp(np.cumsum(rng.normal(0, 0.01, (days, len(ids))), axis=0)).reshape(-1)
+    price = base[crop] * walk.repeat(markets) * rng.lognormal(0, 0.05, days * per_day)
+    dates = pd.date_range(start, periods=days, freq='D').strftime('%Y-%m-%d').to_numpy()
+    return pd.DataFrame({
+        'crop_id': ids[crop],
+        'market': np.tile([f'mandi-{i}' for i in range(markets)], days * len(ids)),
+        'date': dates.repeat(per_day),
+        'price': price.round(2),
+    })
@@ -0,0 +1,89 @@
+"""Bounded LRU cache for per-query results.
+
+Entries are sized with a caller-supplied ``sizeof`` and the least recently
+used ones are evicted once the total passes ``max_bytes``. The cache is tied
+to a catalog version: calling :meth:`ResultCache.check_version` with a new
+value drops every entry; :meth:`ResultCache.retain` moves to a new version
+keeping the entries a catalog update did not touch.
+"""
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Thread-safe LRU cache bounded by approximate memory use"""
+
+    def __init__(self, sizeof, max_bytes=64 * 1024 * 1024):
+        self.sizeof = sizeof
+        self.max_bytes = max_bytes
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def check_version(self, version):
+        """Drop all entries if the catalog version has changed"""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self._bytes = 0
+                self.version = version
+
+    def retain(self, version, keep):
+        """Move to ``version``, dropping only the entries whose key fails ``keep(key)``"""
+        with self._lock:
+            for key in [key for key in self._entries if not keep(key)]:
+                self._bytes -= self._entries.pop(key)[1]
+            self.version = version
+
+    def get_or_compute(self, key, compute, version=None):
+        """Cached value for ``key``, calling ``compute()`` on a miss.
+
+        With ``version`` (the catalog version ``compute`` reads) the cache is
+        only used while it is at that version: a value built from another
+        catalog is neither served from nor stored in it.
+        """
+        with self._lock:
+            stale = version is not None and version != self.version
+            entry = None if stale else self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # Compute outside the lock; a concurrent miss on the same key just computes twice
+        value = compute()
+        if stale:
+            return value
+        size = self.sizeof(value)
+        with self._lock:
+            if version is not None and version != self.version:
+                return value
+            if key not in self._entries and size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= evicted
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,224 @@
+"""Compact columnar crop catalog.
+
+The crops table is held as NumPy arrays instead of a DataFrame of Python
+objects: soil types and states become per-crop bitmasks over small key
+vocabularies, the low-cardinality text fields become integer codes, and
+every crop name in every language (and every soil/state list) is interned
+once in a shared UTF-8 string table that the text columns index into. One
+catalog is built per process and shared by reference; only the handful of
+rows a query returns are turned back into a DataFrame. After a catalog
+update, :meth:`CropCatalog.updated` builds the next catalog from the current
+one plus the changed rows instead of re-reading the whole table. Each
+crop's N/P2O5/K2O needs per soil type (see :mod:`nutrients`) are kept
+alongside, so profits net of fertilizer come from the catalog alone.
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+import nutrients
+from engine import split_keys
+
+LANGUAGES = ('en', 'kn', 'ta', 'te', 'ml', 'hi')
+# Vocabularies accepted in the crops table
+SOIL_TYPES = ('clay', 'sandy', 'loamy', 'black', 'red', 'alluvial')
+STATES = ('karnataka', 'tamilnadu', 'andhra', 'telangana', 'kerala', 'maharashtra', 'punjab')
+PEST_RISKS = ('low', 'medium', 'high')
+CATEGORICAL_COLUMNS = ('pest_risk', 'fertilizer', 'season', 'water_requirement')
+NUMERIC_COLUMNS = {
+    'id': np.int64,
+    'min_rainfall': np.int32,
+    'max_rainfall': np.int32,
+    'yield_per_hectare': np.float64,
+    'profit_per_hectare': np.int64,
+    'market_price': np.float64,
+    'duration_months': np.int16,
+}
+# Column order of the crops_named view, used when rows are turned back into a DataFrame
+COLUMNS = ['id'] + [f'name_{lang}' for lang in LANGUAGES] + [
+    'soil_types', 'min_rainfall', 'max_rainfall', 'states', 'yield_per_hectare',
+    'profit_per_hectare', 'pest_risk', 'fertilizer', 'market_price', 'season',
+    'water_requirement', 'duration_months']
+
+
+def _key_bits(column):
+    """Vocabulary of keys and a per-row bitmask of the keys each row lists"""
+    values = [split_keys(value) for value in column.tolist()]
+    keys = sorted({key for row in values for key in row})
+    if len(keys) > 64:
+        raise ValueError(f"too many distinct keys for a bitmask column: {len(keys)}")
+    bit = {key: 1 << i for i, key in enumerate(keys)}
+    dtype = np.uint8 if len(keys) <= 8 else np.uint16 if len(keys) <= 16 else np.uint64
+    masks = np.fromiter((sum(bit[key] for key in row) for row in values), dtype=dtype, count=len(values))
+    return keys, masks
+
+
+def _remap_bits(keys, bits, union, dtype):
+    """Bitmasks over ``keys`` re-expressed over the ``union`` vocabulary"""
+    out = np.zeros(len(bits), dtype=dtype)
+    for i, key in enumerate(keys):
+        out |= ((bits >> bits.dtype.type(i)) & 1).astype(dtype) << dtype(union.index(key))
+    return out
+
+
+def _merge_bits(keys, bits, other_keys, other_bits):
+    union = sorted(set(keys) | set(other_keys))
+    if len(union) > 64:
+        raise ValueError(f"too many distinct keys for a bitmask column: {len(union)}")
+    dtype = np.uint8 if len(union) <= 8 else np.uint16 if len(union) <= 16 else np.uint64
+    return union, np.concatenate([_remap_bits(keys, bits, union, dtype),
+                                  _remap_bits(other_keys, other_bits, union, dtype)])
+
+
+class CropCatalog:
+    """Read-only, columnar view of the crops table.
+
+    ``needs`` are the ``crop_nutrients`` rows of these crops; without them
+    no crop has a fertilizer cost.
+    """
+
+    def __init__(self, df, needs=None):
+        self.size = len(df)
+        self.numeric = {col: df[col].to_numpy(dtype=dtype) for col, dtype in NUMERIC_COLUMNS.items()}
+        # Soil type -> (crops x 3) N/P2O5/K2O kg per hectare
+        self.needs = nutrients.need_arrays(self.numeric['id'], needs)
+
+        self.soil_keys, self.soil_bits = _key_bits(df['soil_types'])
+        self.state_keys, self.state_bits = _key_bits(df['states'])
+
+        self.categories = {}
+        self.codes = {}
+        for col in CATEGORICAL_COLUMNS:
+            codes, categories = pd.factorize(df[col], use_na_sentinel=True)
+            self.categories[col] = np.asarray(categories, dtype=object)
+            self.codes[col] = codes.astype(np.int16)
+
+        # Every distinct string stored once; name and key-list columns are indexes into it
+        strings = {}
+        self.text = {}
+        for col in [f'name_{lang}' for lang in LANGUAGES] + ['soil_types', 'states']:
+            self.text[col] = np.fromiter(
+                (strings.setdefault(str(value), len(strings)) for value in df[col].tolist()),
+                dtype=np.int32, count=self.size)
+        encoded = [value.encode('utf-8') for value in strings]
+        self.string_data = b''.join(encoded)
+        self.string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=self.string_offsets[1:])
+
+    def _strings(self, index):
+        """Decode entries of the shared string table"""
+        data, offsets = self.string_data, self.string_offsets
+        return np.array([data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in index.tolist()],
+                        dtype=object)
+
+    def updated(self, rows, removed=(), needs=None):
+        """New catalog with ``rows`` (a crops DataFrame) upserted by id and ``removed`` ids dropped.
+
+        ``needs`` are the current ``crop_nutrients`` rows of the upserted crops.
+
+        Rows keep the table's id order, so results match a full reload. Only
+        the changed rows are decoded and interned; their strings are appended
+        to the shared table, and replaced ones stay there until the next full
+        reload.
+        """
+        patch = CropCatalog(rows, needs)
+        dropped = np.concatenate([patch.numeric['id'], np.asarray(list(removed), dtype=np.int64)])
+        keep = np.flatnonzero(~np.isin(self.numeric['id'], dropped))
+        ids = np.concatenate([self.numeric['id'][keep], patch.numeric['id']])
+        order = np.argsort(ids, kind='stable')
+
+        new = object.__new__(CropCatalog)
+        new.size = len(ids)
+        new.numeric = {col: np.concatenate([values[keep], patch.numeric[col]])[order]
+                       for col, values in self.numeric.items()}
+        new.soil_keys, soil_bits = _merge_bits(self.soil_keys, self.soil_bits[keep],
+                                               patch.soil_keys, patch.soil_bits)
+        new.state_keys, state_bits = _merge_bits(self.state_keys, self.state_bits[keep],
+                                                 patch.state_keys, patch.state_bits)
+        new.soil_bits, new.state_bits = soil_bits[order], state_bits[order]
+        new.needs = {}
+        for soil_type in self.needs.keys() | patch.needs.keys():
+            old = self.nutrient_needs(soil_type)[keep]
+            new.needs[soil_type] = np.concatenate([old, patch.nutrient_needs(soil_type)])[order]
+
+        new.categories = {}
+        new.codes = {}
+        for col in CATEGORICAL_COLUMNS:
+            categories = list(self.categories[col])
+            lookup = {value: i for i, value in enumerate(categories)}
+            mapping = np.array([lookup.setdefault(value, len(lookup)) for value in patch.categories[col]] + [-1],
+                               dtype=np.int16)
+            categories += list(lookup)[len(categories):]
+            new.categories[col] = np.asarray(categories, dtype=object)
+            new.codes[col] = np.concatenate([self.codes[col][keep], mapping[patch.codes[col]]])[order]
+
+        base = len(self.string_offsets) - 1
+        new.text = {col: np.concatenate([index[keep], patch.text[col] + base])[order]
+                    for col, index in self.text.items()}
+        new.string_data = self.string_data + patch.string_data
+        new.string_offsets = np.concatenate([self.string_offsets, patch.string_offsets[1:] + self.string_offsets[-1]])
+        return new
+
+    def key_pairs(self, ids):
+        """(soil type, state) pairs listed by the crops with these ids"""
+        positions = np.flatnonzero(np.isin(self.numeric['id'], np.asarray(list(ids), dtype=np.int64)))
+        pairs = set()
+        for soil_mask, state_mask in set(zip(self.soil_bits[positions].tolist(),
+                                             self.state_bits[positions].tolist())):
+            soils = [key for i, key in enumerate(self.soil_keys) if soil_mask >> i & 1]
+            states = [key for i, key in enumerate(self.state_keys) if state_mask >> i & 1]
+            pairs.update((soil, state) for soil in soils for state in states)
+        return pairs
+
+    def __getitem__(self, col):
+        return self.numeric[col]
+
+    def has_key(self, column, key):
+        """Boolean mask of crops whose ``soil_types`` / ``states`` list ``key``"""
+        keys, bits = (self.soil_keys, self.soil_bits) if column == 'soil_types' else (self.state_keys, self.state_bits)
+        if key not in keys:
+            return np.zeros(self.size, dtype=bool)
+        return (bits & bits.dtype.type(1 << keys.index(key))) != 0
+
+    def nutrient_needs(self, soil_type, positions=None):
+        """(crops x 3) N/P2O5/K2O kg per hectare on ``soil_type`` of the crops at ``positions`` (default all)"""
+        needs = self.needs.get(soil_type)
+        if needs is None:
+            return np.zeros((self.size if positions is None else len(positions), len(nutrients.NUTRIENT_COLUMNS)),
+                            dtype=np.float32)
+        return needs if positions is None else needs[positions]
+
+    def net_profit(self, soil_type):
+        """Profit per hectare of every crop after the fertilizer it needs on ``soil_type``"""
+        profit = self.numeric['profit_per_hectare']
+        if soil_type not in self.needs:
+            return profit
+        return nutrients.net_profit(profit, self.needs[soil_type])
+
+    def name(self, position, lang):
+        return self._strings(self.text[f'name_{lang}'][[position]])[0]
+
+    def take(self, positions):
+        """Rows at ``positions`` as a DataFrame shaped like the crops table"""
+        positions = np.asarray(positions, dtype=np.intp)
+        data = {col: values[positions] for col, values in self.numeric.items()}
+        for col, index in self.text.items():
+            data[col] = self._strings(index[positions])
+        for col in CATEGORICAL_COLUMNS:
+            codes = self.codes[col][positions]
+            data[col] = np.where(codes >= 0, self.categories[col][np.maximum(codes, 0)], None)
+        return pd.DataFrame(data, index=positions, columns=COLUMNS)
+
+    def to_frame(self):
+        """Whole catalog as a DataFrame"""
+        return self.take(np.arange(self.size))
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the catalog, including the interned strings"""
+        arrays = [*self.numeric.values(), *self.codes.values(), *self.text.values(), *self.needs.values(),
+                  self.soil_bits, self.state_bits, self.string_offsets]
+        total = sum(array.nbytes for array in arrays) + len(self.string_data)
+        total += sum(sys.getsizeof(v) for cats in self.categories.values() for v in cats)
+        return total
@@ -0,0 +1,101 @@
+"""Recommendation charts, built only when asked for.
+
+The results page shows one chart at a time: the Plotly figure for the
+selected chart is built on first view and cached per (query band, chart,
+language) together with the size of its JSON payload, so switching back to a
+chart, or another session asking the same question, costs no rebuild. The
+``quick`` view needs no Plotly at all: a text sparkline per metric, for slow
+connections.
+"""
+import plotly.express as px
+
+import perf
+from cache import ResultCache
+
+TOP_N = 5
+# chart -> (column, title key, axis label key, colour scale)
+BAR_CHARTS = {
+    'profit': ('profit_per_hectare', 'profit', 'profit', 'viridis'),
+    'yield': ('yield_per_hectare', 'expected_yield', 'expected_yield', 'greens'),
+    'price': ('market_price', 'market_prices', 'price', 'blues'),
+}
+CHARTS = list(BAR_CHARTS) + ['pest_risk', 'quick']
+RISK_COLORS = ['#10b981', '#f59e0b', '#ef4444']
+SPARK_BARS = '▁▂▃▄▅▆▇█'
+
+
+def bar_figure(crops, chart, lang, t):
+    column, title, label, scale = BAR_CHARTS[chart]
+    name = f'name_{lang}'
+    fig = px.bar(
+        crops.head(TOP_N),
+        x=name,
+        y=column,
+        title=f"{t[title]} - Top {TOP_N} Crops",
+        labels={name: t['crop'], column: t[label]},
+        color=column,
+        color_continuous_scale=scale
+    )
+    fig.update_layout(showlegend=False, height=400)
+    return fig
+
+
+def pie_figure(crops, t):
+    risk_counts = crops['pest_risk'].value_counts()
+    return px.pie(
+        values=risk_counts.values,
+        names=[t[risk] for risk in risk_counts.index],
+        title=t['pest_risk'],
+        color_discrete_sequence=RISK_COLORS
+    )
+
+
+def build_figure(crops, chart, lang, t):
+    """Plotly figure for one chart of the recommended crops"""
+    if chart == 'pest_risk':
+        return pie_figure(crops, t)
+    return bar_figure(crops, chart, lang, t)
+
+
+def sparkline(values):
+    """Values as a row of block characters scaled to the largest"""
+    values = [float(v) for v in values]
+    top = max(values, default=0.0)
+    if top <= 0:
+        return SPARK_BARS[0] * len(values)
+    return ''.join(SPARK_BARS[min(len(SPARK_BARS) - 1, int(v / top * (len(SPARK_BARS) - 1) + 0.5))]
+                   for v in values)
+
+
+def quick_view(crops, lang, t):
+    """Markdown lines summarising the charts without Plotly"""
+    top = crops.head(TOP_N)
+    lines = [f"{t['crop']}: " + " · ".join(top[f'name_{lang}'].tolist())]
+    for column, title, _, _ in BAR_CHARTS.values():
+        lines.append(f"**{t[title]}** `{sparkline(top[column])}`")
+    risks = crops['pest_risk'].value_counts()
+    lines.append(f"**{t['pest_risk']}**: " + ", ".join(f"{t[risk]} {count}" for risk, count in risks.items()))
+    return lines
+
+
+class ChartCache:
+    """Figures and their payload size per (result key, chart).
+
+    Bring it to the current catalog with ``planner.refresh_cache(cache.figures)``.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        # Figure objects hold about as much as their JSON, so size them by it
+        self.figures = ResultCache(lambda entry: entry[1], max_bytes=max_bytes)
+
+    def get(self, key, chart, crops, lang, t, version=None):
+        """``(figure, payload bytes)`` for ``chart`` of the result cached under ``key`` (at catalog ``version``)"""
+
+        def build():
+            with perf.span(f'chart.{chart}'):
+                fig = build_figure(crops, chart, lang, t)
+            return fig, len(fig.to_json())
+
+        fig, size = self.figures.get_or_compute(key + (chart,), build, version)
+        perf.count(f'chart_bytes.{chart}', size)
+        return fig, size
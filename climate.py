@@ -0,0 +1,247 @@
+"""Rainfall climatology from gridded historical rainfall.
+
+Farmers pick annual rainfall on a slider; this turns a state (or a district
+in it) into the rainfall it can expect, from historical monthly grids.
+
+``python climate.py build`` converts a long-format CSV with ``state``,
+``district``, ``year``, ``month`` (1-12) and ``rainfall_mm`` columns, plus
+``cell`` or ``lat``/``lon`` when there are several grid cells per district,
+into ``<grid>.npy`` and a ``<grid>.json`` index. The ``.npy`` file is a
+float32 array of (rows, years, 12 months), NaN where there is no data: one
+row per grid cell, grouped by state and district, followed by one
+area-averaged row per district and per state. Rows for states the catalog
+does not know are skipped. The CSV is read in chunks and written straight
+into the memory-mapped file, so neither the build nor a lookup needs the
+grid in RAM.
+
+:class:`Climatology` opens the file memory-mapped. A lookup reads only the
+region's averaged row (years x 12 values), sums the months of each
+complete year and takes the mean and percentiles over the years; results
+are memoized, so repeated lookups cost a dict access.
+
+Usage:
+    python climate.py build rainfall.csv rainfall_grid.npy
+    python climate.py lookup rainfall_grid.npy karnataka --district mysuru
+"""
+import argparse
+import json
+import os
+import warnings
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from catalog import STATES
+
+QUANTILES = (10, 50, 90)
+# Spellings of states used by rainfall datasets, keyed without spaces
+STATE_ALIASES = {'andhrapradesh': 'andhra'}
+
+# Expected annual (or seasonal) rainfall in mm over the years on record
+RainfallOutlook = namedtuple('RainfallOutlook', 'mean p10 p50 p90 years')
+
+
+def state_key(value):
+    """Catalog state key for a state name as datasets spell it (``Tamil Nadu`` -> ``tamilnadu``)"""
+    key = ''.join(str(value).lower().split())
+    return STATE_ALIASES.get(key, key)
+
+
+def district_key(value):
+    return ' '.join(str(value).lower().split())
+
+
+def index_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def _cell_columns(columns):
+    if 'cell' in columns:
+        return ['cell']
+    if 'lat' in columns and 'lon' in columns:
+        return ['lat', 'lon']
+    return []
+
+
+def _keys(chunk, cell_columns):
+    """Distinct (state, district, cell) keys of a CSV chunk (None for unknown states) and each row's code"""
+    # Normalize each distinct spelling once rather than every row
+    codes, raw = pd.factorize(pd.MultiIndex.from_frame(chunk[['state', 'district'] + cell_columns].astype(str)))
+    keys = []
+    for state, district, *cell in raw:
+        state, district = state_key(state), district_key(district)
+        keys.append((state, district, ','.join(cell) or district) if state in STATES else None)
+    return keys, codes
+
+
+def build(csv_path, grid_path, chunk_size=500_000):
+    """Convert a rainfall CSV into ``grid_path`` and its index; returns (cells, years, skipped rows)"""
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    missing = [col for col in ('state', 'district', 'year', 'month', 'rainfall_mm') if col not in columns]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    cell_columns = _cell_columns(columns)
+
+    # First pass: the cells and years on record
+    cells, years, skipped = set(), set(), 0
+    for chunk in pd.read_csv(csv_path, usecols=['state', 'district', 'year'] + cell_columns, chunksize=chunk_size):
+        keys, codes = _keys(chunk, cell_columns)
+        known = np.array([key is not None for key in keys] + [False])[codes]
+        cells.update(key for key in keys if key is not None)
+        years.update(chunk['year'][known].astype(int).unique().tolist())
+        skipped += int((~known).sum())
+    if not cells:
+        raise ValueError("no rainfall rows for any known state")
+    cells = sorted(cells)
+    years = list(range(min(years), max(years) + 1))
+    row_of = {key: i for i, key in enumerate(cells)}
+
+    # District and state rows follow the cells; cells are sorted, so each region is a contiguous range
+    regions = {}
+    for i, (state, district, _) in enumerate(cells):
+        for name in (state, f'{state}/{district}'):
+            start, _ = regions.get(name, (i, i))
+            regions[name] = (start, i + 1)
+    names = sorted(regions)
+
+    shape = (len(cells) + len(names), len(years), 12)
+    grid = np.lib.format.open_memmap(grid_path + '.tmp', mode='w+', dtype=np.float32, shape=shape)
+    # Rows per cell-month so far, to average repeats across chunks; a scratch file next to the grid
+    counts = np.lib.format.open_memmap(grid_path + '.counts.tmp', mode='w+', dtype=np.uint16,
+                                       shape=(len(cells),) + shape[1:])
+    for start in range(0, len(cells), 1024):
+        grid[start:start + 1024] = np.nan
+    flat_grid, flat_counts = grid.reshape(-1), counts.reshape(-1)
+
+    # Second pass: monthly values into the cell rows
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        keys, codes = _keys(chunk, cell_columns)
+        rows = np.array([-1 if key is None else row_of[key] for key in keys] + [-1], dtype=np.intp)[codes]
+        month = chunk['month'].astype(int).to_numpy() - 1
+        value = pd.to_numeric(chunk['rainfall_mm'], errors='coerce').to_numpy(dtype=np.float64)
+        ok = (rows >= 0) & (month >= 0) & (month < 12) & ~np.isnan(value)
+        flat = np.ravel_multi_index((rows[ok], chunk['year'].astype(int).to_numpy()[ok] - years[0], month[ok]),
+                                    shape)
+        index, inverse = np.unique(flat, return_inverse=True)
+        added, sums = np.bincount(inverse), np.bincount(inverse, weights=value[ok])
+        before = flat_counts[index].astype(np.float64)
+        previous = np.where(before > 0, flat_grid[index], 0.0)
+        flat_grid[index] = (previous * before + sums) / (before + added)
+        flat_counts[index] = before + added
+    del counts, flat_counts
+    os.remove(grid_path + '.counts.tmp')
+
+    # Region rows: mean over the region's cells, one region at a time
+    for r, name in enumerate(names):
+        start, stop = regions[name]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            grid[len(cells) + r] = np.nanmean(grid[start:stop], axis=0)
+    grid.flush()
+    del grid, flat_grid
+    os.replace(grid_path + '.tmp', grid_path)
+    index = {'years': [years[0], years[-1]], 'cells': len(cells),
+             'regions': {name: len(cells) + r for r, name in enumerate(names)}}
+    with open(index_path(grid_path), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    return len(cells), len(years), skipped
+
+
+class Climatology:
+    """Memory-mapped rainfall grid built by :func:`build`"""
+
+    def __init__(self, path):
+        self.path = path
+        self.grid = np.load(path, mmap_mode='r')
+        with open(index_path(path), encoding='utf-8') as f:
+            index = json.load(f)
+        first, last = index['years']
+        self.years = (first, last)
+        self.regions = index['regions']
+        self.states = sorted(name for name in self.regions if '/' not in name)
+        self._outlooks = {}
+
+    def outlook(self, state, district=None, months=None):
+        """:class:`RainfallOutlook` for a state, or a district in it, over ``months`` (default the year)"""
+        key = (state, district, tuple(months) if months else None)
+        outlook = self._outlooks.get(key)
+        if outlook is None:
+            outlook = self._outlooks[key] = self._summarize(*key)
+        return outlook
+
+    def _summarize(self, state, district, months):
+        name = state_key(state) + (f'/{district_key(district)}' if district else '')
+        if name not in self.regions:
+            raise KeyError(f"no rainfall on record for {name!r}")
+        series = np.asarray(self.grid[self.regions[name]], dtype=np.float64)
+        if months:
+            series = series[:, [month - 1 for month in months]]
+        # Only years with every month on record
+        totals = series.sum(axis=1)
+        totals = totals[~np.isnan(totals)]
+        if not len(totals):
+            raise KeyError(f"no complete year of rainfall on record for {name!r}")
+        # np.percentile's linear interpolation, without its per-call overhead
+        totals.sort()
+        p10, p50, p90 = np.interp(np.array(QUANTILES) / 100 * (len(totals) - 1), np.arange(len(totals)), totals)
+        return RainfallOutlook(float(totals.mean()), float(p10), float(p50), float(p90), len(totals))
+
+    def expected(self, state, district=None):
+        """Mean annual rainfall in mm"""
+        return self.outlook(state, district).mean
+
+
+def fill_rainfall(farms, climatology):
+    """Copy of ``farms`` with missing ``rainfall`` set to the expected rainfall of the farm's state.
+
+    Farms with a ``district`` column use that district's record. Farms in a
+    region with no record keep no rainfall (and so match no crops).
+    """
+    farms = farms.copy()
+    if 'rainfall' not in farms.columns:
+        farms['rainfall'] = np.nan
+    rainfall = pd.to_numeric(farms['rainfall'], errors='coerce')
+    missing = rainfall.isna().to_numpy()
+    if missing.any():
+        states = farms['location'].astype(str)[missing]
+        districts = (farms['district'].fillna('').astype(str)[missing] if 'district' in farms.columns
+                     else pd.Series('', index=states.index))
+        codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([states, districts]))
+        expected = []
+        for state, district in pairs:
+            try:
+                expected.append(round(climatology.expected(state, district or None)))
+            except KeyError:
+                expected.append(np.nan)
+        rainfall[missing] = np.asarray(expected, dtype=np.float64)[codes]
+    farms['rainfall'] = rainfall
+    return farms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the rainfall climatology grid")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help="convert a rainfall CSV into a memory-mapped grid")
+    build_parser.add_argument('csv', help="CSV with state, district, year, month, rainfall_mm columns")
+    build_parser.add_argument('grid', help="output .npy grid (an index .json is written next to it)")
+    build_parser.add_argument('--chunk-size', type=int, default=500_000, help="CSV rows read at a time")
+    lookup_parser = commands.add_parser('lookup', help="expected rainfall for a state or district")
+    lookup_parser.add_argument('grid', help=".npy grid built with 'build'")
+    lookup_parser.add_argument('state')
+    lookup_parser.add_argument('--district')
+    lookup_parser.add_argument('--months', type=int, nargs='+', metavar='MONTH', help="calendar months (1-12)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        cells, years, skipped = build(args.csv, args.grid, args.chunk_size)
+        note = f", skipped {skipped} rows for unknown states" if skipped else ""
+        print(f"Wrote {cells} cells x {years} years to {args.grid}{note}")
+        return
+    outlook = Climatology(args.grid).outlook(args.state, args.district, args.months)
+    print(f"mean {outlook.mean:.0f} mm, P10 {outlook.p10:.0f}, P50 {outlook.p50:.0f}, "
+          f"P90 {outlook.p90:.0f} over {outlook.years} years")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""Headless crop planner core.
+
+Everything a front end needs to answer a query, with no Streamlit import:
+the pooled database, the once-per-process migration, the shared crop
+catalog and its recommendation engine (rebuilt when the catalog version
+changes), the memoized results and the month-partitioned search history
+with its background writer. The
+Streamlit app and the HTTP service each hold one :class:`CropPlanner`.
+"""
+import threading
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import datetime
+
+import db
+import export
+import migrations
+import nutrients
+import perf
+import prices
+import risk
+from cache import ResultCache
+from catalog import LANGUAGES, CropCatalog
+from engine import RecommendationEngine
+from history import HistoryWriter
+from history_store import HistoryStore
+from ranking import CropScorer
+from rotation import RotationSolver
+
+# Slider range and step of the rainfall input
+RAINFALL_RANGE = (200, 3000, 50)
+EXPORT_COLUMNS = ['yield_per_hectare', 'profit_per_hectare', nutrients.COST_COLUMN, 'pest_risk', 'fertilizer',
+                  'market_price']
+# Ranked crops kept per query; cards, charts, the export and the API all read theirs from this list
+TOP_K = 50
+EXPORT_ROWS = 10
+
+# Fixed seed for on-screen risk figures, so they do not move between reruns
+RISK_SEED = 0
+
+# Above this share of changed crops a catalog update re-reads the whole table
+FULL_RELOAD_FRACTION = 0.1
+# Catalog updates remembered for bringing caches forward
+CHANGE_LOG_SIZE = 64
+
+# Top-ranked crops, how many crops matched in all, and the CSV export built from them
+Recommendation = namedtuple('Recommendation', 'crops matches export csv')
+# What one catalog load built, taken together so a query never mixes two versions
+CatalogSnapshot = namedtuple('CatalogSnapshot', 'version engine scorer solver')
+# Rotation crops in sowing order (with ``sow_offset`` and calendar ``sow_month``) and profit per hectare
+RotationPlan = namedtuple('RotationPlan', 'crops profit')
+
+
+def recommend_crops(engine, soil_type, rainfall, location):
+    """Filter and recommend crops based on farmer inputs"""
+    with perf.span('recommend_crops'):
+        return engine.recommend(soil_type, rainfall, location)
+
+
+def rank_crops(engine, scorer, soil_type, rainfall, location, farm_size=1.0, k=TOP_K, live_prices=None):
+    """Best ``k`` matching crops by the state's weighted score, and the number of matches.
+
+    Crops carry their fertilizer per hectare on this soil type and its cost,
+    and ``profit_per_hectare`` is net of it (see :func:`nutrients.with_fertilizer`).
+    With ``live_prices`` every match is scored at live prices before the top
+    ``k`` are taken, as a catalog rebuilt at those prices would rank them.
+    """
+    with perf.span('recommend_crops'):
+        positions = engine.match(soil_type, rainfall, location)
+        profit = market_price = None
+        if live_prices is not None and len(live_prices):
+            catalog = engine.catalog
+
+            def live(rows):
+                return prices.live_profit_change(live_prices, catalog['id'][rows], catalog['market_price'][rows],
+                                                 catalog['yield_per_hectare'][rows])
+
+            def catalog_wide():
+                market_price, change = live(slice(None))
+                return catalog['profit_per_hectare'] + change, market_price
+
+            # Scores are scaled to the whole catalog at these prices, once per price update
+            scorer = scorer.rescaled((id(live_prices), live_prices.version), catalog_wide)
+            market_price, change = live(engine.order[positions])
+            profit = engine.net_profit(soil_type)[positions] + change
+        top = engine.order[scorer.top_k(positions, soil_type, location, farm_size, k, profit, market_price)]
+        crops = nutrients.with_fertilizer(engine.catalog.take(top), engine.catalog.nutrient_needs(soil_type, top))
+        return crops, len(positions)
+
+
+def build_recommendation(engine, scorer, soil_type, rainfall, location, lang, farm_size=1.0, live_prices=None):
+    """Run the recommendation and build its export report.
+
+    With ``live_prices`` (a :class:`prices.RollingPrices`) all matching crops
+    are ranked on current mandi prices and the profits they give, and the
+    ranked crops carry them.
+    """
+    recommended, matches = rank_crops(engine, scorer, soil_type, rainfall, location, farm_size,
+                                      live_prices=live_prices)
+    if live_prices is not None and len(live_prices):
+        with perf.span('live_prices'):
+            recommended = prices.live_crops(recommended, live_prices)
+    export_df = recommended[[f'name_{lang}'] + EXPORT_COLUMNS].head(EXPORT_ROWS)
+    with perf.span('export.csv'):
+        csv = export.report_bytes(export_df, 'csv')
+    return Recommendation(recommended, matches, export_df, csv)
+
+
+def build_rotation(solver, soil_type, rainfall, location, horizon, start_month):
+    """Solve the rotation and look up its crops (with profits net of fertilizer)"""
+    with perf.span('rotation'):
+        rotation = solver.solve(soil_type, rainfall, location, horizon, start_month)
+        catalog = solver.engine.catalog
+        crops = nutrients.with_fertilizer(catalog.take(rotation.positions),
+                                          catalog.nutrient_needs(soil_type, rotation.positions))
+        crops['sow_offset'] = rotation.sow
+        crops['sow_month'] = (start_month - 1 + rotation.sow) % 12 + 1
+    return RotationPlan(crops, rotation.profit)
+
+
+def _recommendation_size(result):
+    frames = result.crops.memory_usage(deep=True).sum() + result.export.memory_usage(deep=True).sum()
+    return int(frames) + len(result.csv)
+
+
+class CropPlanner:
+    """One process's view of the crop database.
+
+    ``version_check_interval`` bounds how often the crops version counter is
+    read; in between, queries use the engine they already have. When it has
+    moved, only the crops logged as changed are re-read and patched into the
+    catalog, and cached results are dropped only for the (soil, state) pairs
+    those crops belong to, before or after the change.
+
+    ``weights`` are the per-state ranking weights (see :mod:`ranking`);
+    ``climate`` is a :class:`climate.Climatology` that fills in the rainfall
+    of queries that leave it out.
+
+    With ``live_prices`` recommendations use the rolling mandi prices of
+    :mod:`prices`; new ticks are polled on the same interval as the catalog
+    version, and the price version is part of every result key.
+
+    Search history lives in monthly partition files next to the database
+    (see :mod:`history_store`); with ``history_retention`` months older than
+    that many are archived to Parquet at startup.
+    """
+
+    def __init__(self, db_path=db.DB_PATH, sync_history=False, cache_bytes=64 * 1024 * 1024,
+                 version_check_interval=1.0, weights=None, climate=None, live_prices=True,
+                 history_retention=None):
+        self.pool = db.ConnectionPool(db_path)
+        with perf.span('init_db'):
+            migrations.migrate(self.pool)
+        self.history_store = HistoryStore(db_path)
+        if history_retention:
+            self.history_store.archive(history_retention)
+        self.history = HistoryWriter(self.history_store, synchronous=sync_history)
+        self.results = ResultCache(_recommendation_size, max_bytes=cache_bytes)
+        self.rotations = ResultCache(lambda plan: int(plan.crops.memory_usage(deep=True).sum()),
+                                     max_bytes=cache_bytes // 8)
+        # ProfitRisk per (crop id, the crop's inputs, samples, seed): survives catalog updates
+        self.risks = ResultCache(lambda _: 256, max_bytes=4 * 1024 * 1024)
+        self.version_check_interval = version_check_interval
+        self.weights = weights
+        self.climate = climate
+        self.price_feed = prices.PriceFeed(self.pool) if live_prices else None
+        self._lock = threading.Lock()
+        self._price_lock = threading.Lock()
+        self._snapshot = CatalogSnapshot(None, None, None, None)
+        self._checked_at = 0.0
+        self._precomputed = None
+        # (from version, to version, changed (soil, state) pairs or None for all)
+        self._changes = []
+
+    def catalog_version(self):
+        """Current crops version, re-read at most every ``version_check_interval`` seconds"""
+        now = time.monotonic()
+        if self._snapshot.version is None or now - self._checked_at >= self.version_check_interval:
+            self._checked_at = now
+            version = db.fetch_catalog_version(self.pool)
+            if version != self._snapshot.version:
+                self._load(version)
+            self.poll_prices()
+        return self._snapshot.version
+
+    def poll_prices(self):
+        """Fold newly appended price ticks into the rolling prices"""
+        if self.price_feed is None:
+            return
+        with self._price_lock, perf.span('poll_prices'):
+            self.price_feed.poll()
+
+    @property
+    def live_prices(self):
+        """:class:`prices.RollingPrices` behind recommendations, None when live prices are off"""
+        return None if self.price_feed is None else self.price_feed.prices
+
+    def prices_held(self):
+        """Context holding the live prices at one version (nothing to hold when they are off).
+
+        A result key and the result built under it then see the same prices.
+        Take the :meth:`snapshot` first: polling inside would move them on.
+        """
+        live_prices = self.live_prices
+        return nullcontext() if live_prices is None else live_prices.lock
+
+    def _load(self, version):
+        with self._lock:
+            old = self._snapshot
+            if version == old.version:
+                return
+            with perf.span('load_crops'):
+                catalog, pairs = self._read_catalog()
+                engine = RecommendationEngine(catalog)
+                scorer = CropScorer(engine, self.weights)
+                solver = RotationSolver(engine)
+            if pairs is not None and not scorer.same_scales(old.scorer):
+                # A new best profit or price rescales every weighted ranking, not just the changed pairs'
+                perf.count('catalog.rescaled')
+                pairs = None
+            if old.version is not None:
+                self._changes = self._changes[-CHANGE_LOG_SIZE + 1:] + [(old.version, version, pairs)]
+            self._snapshot = CatalogSnapshot(version, engine, scorer, solver)
+            self.refresh_cache(self.results)
+            self.refresh_cache(self.rotations)
+
+    def _read_catalog(self):
+        """Catalog at the current version, and the (soil, state) pairs it changed (None: all)"""
+        if self._snapshot.engine is None:
+            return CropCatalog(db.fetch_crops(self.pool), db.fetch_crop_nutrients(self.pool)), None
+        old = self._snapshot.engine.catalog
+        ids, rows, needs = db.fetch_crop_changes(self.pool, self._snapshot.version)
+        strings = len(old.string_offsets) - 1
+        if len(ids) > FULL_RELOAD_FRACTION * old.size or strings > 2 * len(old.text) * max(old.size, 1):
+            perf.count('catalog.full_reload')
+            return CropCatalog(db.fetch_crops(self.pool), db.fetch_crop_nutrients(self.pool)), None
+        removed = set(ids) - set(rows['id'].tolist())
+        catalog = old.updated(rows, removed, needs)
+        perf.count('catalog.incremental_reload')
+        return catalog, old.key_pairs(ids) | catalog.key_pairs(ids)
+
+    def _changed_pairs(self, since):
+        """Pairs changed between catalog version ``since`` and now, or None if unknown"""
+        pairs = set()
+        for start, end, changed in reversed(self._changes):
+            if changed is None:
+                return None
+            pairs |= changed
+            if start == since:
+                return pairs
+        return None
+
+    def refresh_cache(self, cache):
+        """Bring a cache keyed by ``(soil_type, rainfall band, location, ...)`` to the current version"""
+        version = self._snapshot.version
+        if cache.version == version:
+            return
+        pairs = self._changed_pairs(cache.version)
+        if pairs is None:
+            cache.check_version(version)
+        else:
+            cache.retain(version, lambda key: (key[0], key[2]) not in pairs)
+
+    def snapshot(self):
+        """:class:`CatalogSnapshot` of the current catalog"""
+        self.catalog_version()
+        return self._snapshot
+
+    @property
+    def engine(self):
+        """Recommendation engine for the current crop catalog"""
+        return self.snapshot().engine
+
+    @property
+    def scorer(self):
+        """Crop scorer for the current catalog; ``scorer.engine`` is the engine it ranks for"""
+        return self.snapshot().scorer
+
+    @property
+    def solver(self):
+        """Rotation solver for the current catalog"""
+        return self.snapshot().solver
+
+    @property
+    def catalog(self):
+        return self.engine.catalog
+
+    def result_key(self, soil_type, rainfall, location, lang='en', farm_size=1.0, snapshot=None):
+        """Key shared by every query with the same recommendation (from ``snapshot``, default the current one)"""
+        scorer = (snapshot or self.snapshot()).scorer
+        live_prices = self.live_prices
+        return (soil_type, scorer.engine.rainfall_band(soil_type, location, rainfall), location, lang,
+                scorer.farm_size_key(location, farm_size), live_prices.version if live_prices else None)
+
+    def rainfall_outlook(self, location, district=None):
+        """:class:`climate.RainfallOutlook` for a state (or a district in it), None when there is no record"""
+        if self.climate is None:
+            return None
+        try:
+            return self.climate.outlook(location, district)
+        except KeyError:
+            return None
+
+    def expected_rainfall(self, location, district=None):
+        """Mean annual rainfall on record, on the rainfall slider's scale"""
+        outlook = self.rainfall_outlook(location, district)
+        if outlook is None:
+            raise ValueError(f"no rainfall given and none on record for {location!r}")
+        low, high, step = RAINFALL_RANGE
+        return int(min(max(round(outlook.mean / step) * step, low), high))
+
+    def recommend(self, soil_type, rainfall, location, lang='en', farm_size=1.0, snapshot=None):
+        """Cached :class:`Recommendation`, rebuilt when the crop catalog changes.
+
+        A ``rainfall`` of None uses the state's :meth:`expected_rainfall`.
+        The key and the result come from one :class:`CatalogSnapshot`
+        (``snapshot``, default the current one) and one live price version;
+        a result built while the catalog moved on is returned but not cached.
+        """
+        perf.count('queries')
+        if rainfall is None:
+            rainfall = self.expected_rainfall(location)
+        snapshot = snapshot or self.snapshot()
+        live_prices = self.live_prices
+        with self.prices_held():
+            return self.results.get_or_compute(
+                self.result_key(soil_type, rainfall, location, lang, farm_size, snapshot),
+                lambda: build_recommendation(snapshot.engine, snapshot.scorer, soil_type, rainfall, location, lang,
+                                             farm_size, live_prices),
+                snapshot.version)
+
+    def rotation(self, soil_type, rainfall, location, horizon=12, start_month=6):
+        """Cached most profitable :class:`RotationPlan`, shared by every farm with these inputs.
+
+        Rotations are planned on catalog prices: a season ahead, today's
+        mandi rate is no better a guess.
+        """
+        if rainfall is None:
+            rainfall = self.expected_rainfall(location)
+        snapshot = self.snapshot()
+        solver = snapshot.solver
+        return self.rotations.get_or_compute(
+            solver.key(soil_type, rainfall, location, horizon, start_month),
+            lambda: build_rotation(solver, soil_type, rainfall, location, horizon, start_month),
+            snapshot.version)
+
+    def profit_risk(self, crops, samples=risk.SAMPLES, seed=RISK_SEED):
+        """Cached :class:`risk.ProfitRisk` per hectare for each row of ``crops``"""
+        results = []
+        with perf.span('profit_risk'):
+            for row in zip(*(crops[col].tolist() for col in
+                             ('id', 'yield_per_hectare', 'market_price', 'profit_per_hectare', 'pest_risk'))):
+                crop_id, *inputs = row
+                results.append(self.risks.get_or_compute(
+                    (*row, samples, seed),
+                    lambda inputs=inputs, crop_id=crop_id: risk.profit_risk(*inputs, samples, seed, crop_id)))
+        return results
+
+    def save_history(self, soil_type, rainfall, location, farm_size, crops, crop_ids):
+        """Queue search parameters for the history table"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with perf.span('save_to_history'):
+            self.history.submit(
+                db.HistoryRecord(timestamp, soil_type, rainfall, location, farm_size, list(crops), list(crop_ids)))
+
+    def precompute(self, languages=LANGUAGES):
+        """Fill the result cache for every slider position on a background thread (once per version)"""
+        snapshot = self.snapshot()
+        version = snapshot.version
+        if self._precomputed is not None and self._precomputed[0] == version:
+            return self._precomputed[1]
+        engine = snapshot.engine
+        low, high, step = RAINFALL_RANGE
+
+        def warm():
+            for soil_type in engine.soil_index:
+                for location in engine.state_index:
+                    for rainfall in range(low, high + 1, step):
+                        for lang in languages:
+                            self.recommend(soil_type, rainfall, location, lang, snapshot=snapshot)
+
+        thread = threading.Thread(target=warm, name='precompute-results', daemon=True)
+        thread.start()
+        self._precomputed = (version, thread)
+        return thread
+
+    def close(self):
+        """Flush pending history and release the database"""
+        self.history.close()
+        self.history_store.close()
+        self.pool.close()
@@ -0,0 +1,279 @@
+"""Shared SQLite data access for the crop planner.
+
+All reads and writes go through a :class:`ConnectionPool`, which hands out
+long-lived connections opened in WAL mode so that history inserts from one
+session do not block catalog reads from another. The SQL used on hot paths
+is kept in module constants; ``sqlite3`` caches compiled statements per
+connection keyed on the SQL text, so reusing the same string means each
+statement is prepared once per connection rather than once per call.
+"""
+import json
+import queue
+import sqlite3
+import threading
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+import pandas as pd
+
+DB_PATH = 'agriculture.db'
+
+# Applied to every new connection
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA foreign_keys=ON',
+)
+
+# One search as queued by the app: crop_names are for display, crop_ids are stored normalized
+HistoryRecord = namedtuple('HistoryRecord', 'timestamp soil_type rainfall location farm_size crop_names crop_ids')
+
+SELECT_CROPS = 'SELECT * FROM crops_named'
+SELECT_CATALOG_VERSION = "SELECT value FROM catalog_meta WHERE key = 'crops_version'"
+SELECT_CHANGED_CROP_IDS = 'SELECT crop_id FROM crops_changes WHERE version > ?'
+# Changed crops are read from the base tables: joined to the grouped crops_named view, the
+# whole catalog would be grouped first
+SELECT_CHANGED_CROPS = '''SELECT c.* FROM crops c JOIN crops_changes ch ON ch.crop_id = c.id
+                          WHERE ch.version > ? ORDER BY c.id'''
+SELECT_CHANGED_NAMES = '''SELECT n.crop_id AS id, 'name_' || n.lang AS lang, n.name FROM crop_names n
+                          JOIN crops_changes ch ON ch.crop_id = n.crop_id WHERE ch.version > ?'''
+SELECT_NAMED_COLUMNS = 'SELECT * FROM crops_named WHERE 0'
+SELECT_CROP_NUTRIENTS = 'SELECT crop_id, soil_type, n, p, k FROM crop_nutrients'
+SELECT_CHANGED_NUTRIENTS = '''SELECT n.crop_id, n.soil_type, n.n, n.p, n.k FROM crop_nutrients n
+                              JOIN crops_changes ch ON ch.crop_id = n.crop_id WHERE ch.version > ?'''
+UPSERT_CROP_NUTRIENTS = '''INSERT INTO crop_nutrients (crop_id, soil_type, n, p, k) VALUES (?, ?, ?, ?, ?)
+                           ON CONFLICT (crop_id, soil_type) DO UPDATE SET n = excluded.n, p = excluded.p, k = excluded.k
+                           WHERE (n, p, k) IS NOT (excluded.n, excluded.p, excluded.k)'''
+INSERT_HISTORY = '''INSERT INTO search_history (timestamp, soil_type, rainfall, location, farm_size, recommended_crops)
+                    VALUES (?, ?, ?, ?, ?, ?)'''
+INSERT_HISTORY_CROP = 'INSERT INTO search_history_crops (history_id, rank, crop_id) VALUES (?, ?, ?)'
+UPSERT_DAILY_STATE = '''INSERT INTO history_daily_state (day, location, searches) VALUES (?, ?, ?)
+                        ON CONFLICT (day, location) DO UPDATE SET searches = searches + excluded.searches'''
+UPSERT_SOIL_CROP = '''INSERT INTO history_soil_crop (soil_type, crop_id, recommendations) VALUES (?, ?, ?)
+                      ON CONFLICT (soil_type, crop_id) DO UPDATE
+                      SET recommendations = recommendations + excluded.recommendations'''
+SELECT_HISTORY_PAGE = '''SELECT id, timestamp, soil_type, rainfall, location, farm_size, recommended_crops
+                         FROM search_history WHERE id < ? ORDER BY id DESC LIMIT ?'''
+SELECT_DAILY_SEARCHES = '''SELECT day, location, searches FROM history_daily_state
+                           WHERE day >= ? ORDER BY day, location'''
+SELECT_SOIL_CROP_COUNTS = 'SELECT crop_id, recommendations FROM history_soil_crop WHERE soil_type = ?'
+SELECT_NAMED_CROPS = '''SELECT c.*, n.name FROM crops c
+                        LEFT JOIN crop_names n ON n.crop_id = c.id AND n.lang = ?
+                        WHERE c.id IN (SELECT value FROM json_each(?))'''
+# Every search of a partition with its crop ids in rank order, for archiving
+SELECT_ARCHIVE_HISTORY = '''SELECT h.id, h.timestamp, h.soil_type, h.rainfall, h.location, h.farm_size,
+                                  h.recommended_crops,
+                                  (SELECT group_concat(crop_id) FROM
+                                      (SELECT crop_id FROM search_history_crops
+                                       WHERE history_id = h.id ORDER BY rank)) AS crop_ids
+                            FROM search_history h ORDER BY h.id'''
+
+SELECT_LAST_TICK_ID = 'SELECT max(id) FROM price_ticks'
+SELECT_LAST_TICK_DATE = 'SELECT max(date) FROM price_ticks'
+# Ticks summed per crop and day, for ticks after one id up to another
+SELECT_TICK_DAYS = '''SELECT crop_id, date, sum(price) AS price_sum, count(*) AS ticks FROM price_ticks
+                      WHERE id > ? AND id <= ? AND date >= ? GROUP BY crop_id, date'''
+INSERT_TICK = 'INSERT INTO price_ticks (crop_id, market, date, price) VALUES (?, ?, ?, ?)'
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections to a single database file.
+
+    Connections are created lazily up to ``max_size``; when all of them are
+    checked out, callers wait up to ``timeout`` seconds for one to be returned.
+    """
+
+    def __init__(self, path=DB_PATH, max_size=8, timeout=30.0):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.max_size:
+                conn = self._connect()
+                self._created += 1
+                return conn
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"no free database connection after {self.timeout}s") from None
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of the ``with`` block"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and commit on success, roll back on error"""
+        with self.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close(self):
+        """Close idle connections; busy ones are closed when returned"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def fetch_crops(pool):
+    """Whole crop catalog as a DataFrame"""
+    with pool.connection() as conn:
+        return pd.read_sql_query(SELECT_CROPS, conn)
+
+
+def fetch_catalog_version(pool):
+    """Counter that changes whenever the crops table changes"""
+    with pool.connection() as conn:
+        return conn.execute(SELECT_CATALOG_VERSION).fetchone()[0]
+
+
+def fetch_crop_nutrients(pool):
+    """Every crop's N/P2O5/K2O needs per soil type (kg per hectare)"""
+    with pool.connection() as conn:
+        return pd.read_sql_query(SELECT_CROP_NUTRIENTS, conn)
+
+
+def upsert_crop_nutrients(pool, rows):
+    """Insert or update (crop_id, soil_type, n, p, k) rows in one transaction"""
+    with pool.transaction() as conn:
+        conn.executemany(UPSERT_CROP_NUTRIENTS, rows)
+
+
+def fetch_crop_changes(pool, since_version):
+    """Ids of crops changed after ``since_version``, the current rows of those still present, and their needs.
+
+    All come from one read snapshot; ids without a row were deleted.
+    """
+    with pool.connection() as conn:
+        conn.execute('BEGIN')
+        try:
+            ids = [row[0] for row in conn.execute(SELECT_CHANGED_CROP_IDS, (since_version,))]
+            rows = pd.read_sql_query(SELECT_CHANGED_CROPS, conn, params=(since_version,))
+            names = pd.read_sql_query(SELECT_CHANGED_NAMES, conn, params=(since_version,))
+            columns = [column[0] for column in conn.execute(SELECT_NAMED_COLUMNS).description]
+            needs = pd.read_sql_query(SELECT_CHANGED_NUTRIENTS, conn, params=(since_version,))
+        finally:
+            conn.rollback()
+    # Back to the crops_named shape: one name column per language, in the view's order
+    rows = rows.join(names.pivot(index='id', columns='lang', values='name'), on='id').reindex(columns=columns)
+    return ids, rows, needs
+
+
+def insert_history(pool, record):
+    """Insert one :class:`HistoryRecord`"""
+    insert_history_many(pool, [record])
+
+
+def insert_history_many(pool, records):
+    """Insert many history records in a single transaction.
+
+    Each search gets one child row per recommended crop, and the daily
+    per-state and per-soil crop rollups are bumped by the batch's counts, so
+    analytics never need to scan the history tables.
+    """
+    daily = Counter()
+    soil_crops = Counter()
+    with pool.transaction() as conn:
+        for record in records:
+            cursor = conn.execute(INSERT_HISTORY, (
+                record.timestamp, record.soil_type, record.rainfall, record.location,
+                record.farm_size, ", ".join(record.crop_names)))
+            history_id = cursor.lastrowid
+            conn.executemany(INSERT_HISTORY_CROP, [
+                (history_id, rank, crop_id) for rank, crop_id in enumerate(record.crop_ids, start=1)])
+            daily[(record.timestamp[:10], record.location)] += 1
+            for crop_id in record.crop_ids:
+                soil_crops[(record.soil_type, crop_id)] += 1
+        conn.executemany(UPSERT_DAILY_STATE, [(*key, count) for key, count in daily.items()])
+        conn.executemany(UPSERT_SOIL_CROP, [(*key, count) for key, count in soil_crops.items()])
+
+
+def fetch_history_page(pool, before_id=None, limit=10):
+    """One page of searches, newest first, starting below ``before_id``.
+
+    Keyset pagination on the primary key: pass the smallest ``id`` of the
+    previous page to get the next (older) one.
+    """
+    with pool.connection() as conn:
+        return pd.read_sql_query(SELECT_HISTORY_PAGE, conn,
+                                 params=(int(before_id) if before_id is not None else 2 ** 63 - 1, limit))
+
+
+def fetch_recent_history(pool, limit=10):
+    """Most recent searches, newest first"""
+    return fetch_history_page(pool, limit=limit)
+
+
+def fetch_daily_searches(pool, since):
+    """Searches per state per day from ``since`` (YYYY-MM-DD) onwards"""
+    with pool.connection() as conn:
+        return pd.read_sql_query(SELECT_DAILY_SEARCHES, conn, params=(since,))
+
+
+def fetch_last_tick(pool):
+    """(id, date) of the newest price tick, or (0, None) when there are none"""
+    with pool.connection() as conn:
+        last_id = conn.execute(SELECT_LAST_TICK_ID).fetchone()[0]
+        last_date = conn.execute(SELECT_LAST_TICK_DATE).fetchone()[0]
+    return last_id or 0, last_date
+
+
+def fetch_tick_days(pool, after_id, upto_id, since):
+    """Per (crop_id, date) price sum and tick count of ticks ``after_id < id <= upto_id`` dated ``since`` on"""
+    with pool.connection() as conn:
+        return pd.read_sql_query(SELECT_TICK_DAYS, conn, params=(after_id, upto_id, since))
+
+
+def fetch_soil_crop_counts(pool, soil_type):
+    """{crop_id: recommendations} for a soil type from one history partition's rollup"""
+    with pool.connection() as conn:
+        return dict(conn.execute(SELECT_SOIL_CROP_COUNTS, (soil_type,)).fetchall())
+
+
+def fetch_named_crops(pool, ids, lang='en'):
+    """Crops with these ids, with their ``lang`` name in a ``name`` column"""
+    with pool.connection() as conn:
+        return pd.read_sql_query(SELECT_NAMED_CROPS, conn, params=(lang, json.dumps([int(i) for i in ids])))
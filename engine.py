@@ -0,0 +1,160 @@
+from bisect import bisect_left
+
+import numpy as np
+
+
+# Split a comma-joined column value into its set of keys
+def split_keys(value):
+    if not isinstance(value, str):
+        return ()
+    return tuple(key.strip() for key in value.split(',') if key.strip())
+
+
+# Pack a boolean row mask into an integer bitmap (bit i set for row i)
+def _pack(mask):
+    return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+
+# Positions of the set bits in a bitmap, lowest bit first
+def _bit_positions(bitmap):
+    data = np.frombuffer(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(data, bitorder='little'))
+
+
+class RainfallBreakpoints:
+    """Ranked crop lists for one (soil, state) pair, precomputed per rainfall interval.
+
+    The eligible set only changes at the distinct ``min_rainfall`` /
+    ``max_rainfall`` values of the candidates. With those breakpoints sorted
+    as ``p0 < p1 < ...`` the rainfall axis splits into segments
+    ``(-inf, p0), [p0], (p0, p1), [p1], ...``; segment ``2*i + 1`` is the
+    point ``p_i`` and segment ``2*i`` the open interval below it. Each segment
+    stores a packed bitmask over the pair's candidates, which are already in
+    rank order, so a lookup is one bisect and one unpack.
+    """
+
+    def __init__(self, positions, min_rainfall, max_rainfall):
+        positions = np.asarray(positions, dtype=np.intp)
+        self.positions = positions.astype(np.int32)
+        lows = min_rainfall[positions]
+        highs = max_rainfall[positions]
+        self.points = np.unique(np.concatenate([lows, highs])).tolist()
+
+        # One representative rainfall value per segment
+        reps = []
+        previous = None
+        for point in self.points:
+            reps.append(point - 1 if previous is None else (previous + point) / 2)
+            reps.append(point)
+            previous = point
+        reps.append(previous + 1 if previous is not None else 0)
+        reps = np.asarray(reps, dtype=float)[:, None]
+        eligible = (lows <= reps) & (highs >= reps)
+        self.segments = np.packbits(eligible, axis=1)
+
+    def _unpack(self, packed):
+        return self.positions[np.unpackbits(packed, count=len(self.positions)).view(bool)]
+
+    def segment(self, rainfall):
+        """Index of the segment containing ``rainfall``"""
+        i = bisect_left(self.points, rainfall)
+        if i < len(self.points) and self.points[i] == rainfall:
+            return 2 * i + 1
+        return 2 * i
+
+    def lookup(self, rainfall):
+        """Rank positions of the eligible crops, most profitable first"""
+        return self._unpack(self.segments[self.segment(rainfall)])
+
+    def ranges(self, low, high):
+        """Split the integer range [low, high] where the eligible crops change.
+
+        Yields ``(start, end, positions)`` with inclusive integer bounds,
+        merging neighbouring segments that hold the same crops.
+        """
+        bounds = []
+        previous = None
+        for point in self.points:
+            bounds.append((low if previous is None else previous + 1, point - 1))
+            bounds.append((point, point))
+            previous = point
+        bounds.append((low if previous is None else previous + 1, high))
+
+        current = None
+        for (start, end), packed in zip(bounds, self.segments):
+            start, end = max(start, low), min(end, high)
+            if start > end:
+                continue
+            if current is not None and np.array_equal(current[2], packed):
+                current = (current[0], end, packed)
+                continue
+            if current is not None:
+                yield current[0], current[1], self._unpack(current[2])
+            current = (start, end, packed)
+        if current is not None:
+            yield current[0], current[1], self._unpack(current[2])
+
+
+class RecommendationEngine:
+    """Inverted index over the crop catalog for fast recommendation queries.
+
+    Crops are ranked once by profit, so bit ``i`` of the soil and state
+    bitmaps refers to the ``i``-th most profitable crop. The first query for a
+    (soil, state) pair ANDs the two bitmaps and builds that pair's
+    :class:`RainfallBreakpoints` over the candidates re-ranked by their profit
+    after fertilizer on that soil; every query after that is a single bisect,
+    and the matching rows come back already ordered by net profit.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.size = catalog.size
+        # Rank -> catalog position, most profitable first (stable for ties)
+        self.order = np.argsort(-catalog['profit_per_hectare'], kind='stable')
+
+        # Bitmap per soil type and per state
+        self.soil_index = {key: _pack(catalog.has_key('soil_types', key)[self.order])
+                           for key in catalog.soil_keys}
+        self.state_index = {key: _pack(catalog.has_key('states', key)[self.order])
+                            for key in catalog.state_keys}
+
+        self.min_rainfall = catalog['min_rainfall'][self.order]
+        self.max_rainfall = catalog['max_rainfall'][self.order]
+        self._breakpoints = {}
+        self._net_profit = {}
+
+    def net_profit(self, soil_type):
+        """Profit per hectare after fertilizer on ``soil_type``, in rank order"""
+        profit = self._net_profit.get(soil_type)
+        if profit is None:
+            profit = self._net_profit[soil_type] = self.catalog.net_profit(soil_type)[self.order]
+        return profit
+
+    def breakpoints(self, soil_type, location):
+        """Rainfall breakpoint table for a (soil, state) pair, built on first use"""
+        table = self._breakpoints.get((soil_type, location))
+        if table is None:
+            bitmap = self.soil_index.get(soil_type, 0) & self.state_index.get(location, 0)
+            positions = _bit_positions(bitmap)
+            if soil_type in self.catalog.needs:
+                positions = positions[np.argsort(-self.net_profit(soil_type)[positions], kind='stable')]
+            table = RainfallBreakpoints(positions, self.min_rainfall, self.max_rainfall)
+            self._breakpoints[(soil_type, location)] = table
+        return table
+
+    def rainfall_band(self, soil_type, location, rainfall):
+        """Key shared by every rainfall value with the same eligible crops for this soil and state"""
+        return self.breakpoints(soil_type, location).segment(rainfall)
+
+    def match(self, soil_type, rainfall, location):
+        """Rank positions of the matching crops, most profitable after fertilizer first"""
+        return self.breakpoints(soil_type, location).lookup(rainfall)
+
+    def recommend(self, soil_type, rainfall, location):
+        """Matching crop rows sorted by net profit, same shape as the crops table (catalog figures)"""
+        return self.catalog.take(self.order[self.match(soil_type, rainfall, location)])
+
+    def sensitivity(self, soil_type, location, low=200, high=3000):
+        """Rainfall ranges in [low, high] and the ranked crops recommended in each"""
+        return [(start, end, self.catalog.take(self.order[positions]))
+                for start, end, positions in self.breakpoints(soil_type, location).ranges(low, high)]
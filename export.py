@@ -0,0 +1,150 @@
+"""Streaming report export to CSV, Excel and Parquet.
+
+Every writer takes an iterable of DataFrame chunks and writes them one at a
+time, so memory use depends on the chunk size rather than the report size.
+
+Usage:
+    python export.py farms.csv district_report.xlsx --top-n 5
+"""
+import argparse
+import io
+import os
+
+import pandas as pd
+
+import db
+import migrations
+import prices
+from batch import iter_recommend_batch
+from climate import Climatology, fill_rainfall
+from ranking import load_weights
+
+FORMATS = ('csv', 'xlsx', 'parquet')
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Excel's row limit per sheet, minus the header row
+XLSX_MAX_ROWS = 1_048_575
+
+
+def iter_frame(df, chunk_size=50_000):
+    """Split an in-memory DataFrame into chunks for the writers"""
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+def write_csv(chunks, out):
+    """Write chunks to a binary file object as UTF-8 CSV; returns rows written"""
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        out.write(chunk.to_csv(index=False, header=(i == 0)).encode('utf-8'))
+        rows += len(chunk)
+    return rows
+
+
+def write_xlsx(chunks, out):
+    """Write chunks with openpyxl's write-only workbook, starting a new sheet every XLSX_MAX_ROWS"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = 0
+    rows = 0
+    for chunk in chunks:
+        columns = [str(col) for col in chunk.columns]
+        for record in chunk.itertuples(index=False, name=None):
+            if sheet is None or sheet_rows == XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Report {len(workbook.worksheets) + 1}")
+                sheet.append(columns)
+                sheet_rows = 0
+            sheet.append([value.item() if hasattr(value, 'item') else value for value in record])
+            sheet_rows += 1
+            rows += 1
+    if sheet is None:
+        workbook.create_sheet("Report 1")
+    workbook.save(out)
+    return rows
+
+
+def write_parquet(chunks, out):
+    """Write chunks as row groups of a single Parquet file (needs pyarrow)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export needs pyarrow: pip install pyarrow") from None
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out, table.schema)
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx, 'parquet': write_parquet}
+
+
+def write_report(chunks, target, fmt=None):
+    """Write chunks to a path or binary file object; ``fmt`` defaults to the path's extension"""
+    if fmt is None:
+        fmt = os.path.splitext(target)[1].lstrip('.').lower()
+    if fmt not in WRITERS:
+        raise ValueError(f"unsupported export format {fmt!r}; choose one of {', '.join(FORMATS)}")
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, 'wb') as out:
+            return WRITERS[fmt](chunks, out)
+    return WRITERS[fmt](chunks, target)
+
+
+def report_bytes(df, fmt):
+    """Whole report as bytes, for small in-app downloads"""
+    out = io.BytesIO()
+    write_report(iter_frame(df), out, fmt)
+    return out.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export district-level crop recommendation reports")
+    parser.add_argument('farms', help="CSV with soil_type, rainfall, location, farm_size columns")
+    parser.add_argument('output', help="report path (.csv, .xlsx or .parquet)")
+    parser.add_argument('--format', choices=FORMATS, help="override the format implied by the extension")
+    parser.add_argument('--top-n', type=int, default=5, help="crops to keep per farm")
+    parser.add_argument('--lang', default='en', help="language for crop names")
+    parser.add_argument('--chunk-size', type=int, default=100_000, help="farms scored per chunk")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database")
+    parser.add_argument('--weights', help="JSON file of per-state ranking weights")
+    parser.add_argument('--climate', help="rainfall grid (.npy from climate.py) to fill in missing rainfall")
+    parser.add_argument('--live-prices', action='store_true', help="rank on current mandi prices from price_ticks")
+    args = parser.parse_args(argv)
+
+    pool = db.ConnectionPool(args.db)
+    migrations.migrate(pool)
+    crops_df = prices.current_crops(pool) if args.live_prices else db.fetch_crops(pool)
+    needs = db.fetch_crop_nutrients(pool)
+    pool.close()
+
+    farm_chunks = pd.read_csv(args.farms, chunksize=args.chunk_size)
+    if args.climate:
+        climatology = Climatology(args.climate)
+        farm_chunks = (fill_rainfall(chunk, climatology) for chunk in farm_chunks)
+    weights = load_weights(args.weights) if args.weights else None
+    results = iter_recommend_batch(crops_df, farm_chunks, top_n=args.top_n, lang=args.lang, weights=weights,
+                                   needs=needs)
+    rows = write_report(results, args.output, args.format)
+    print(f"Wrote {rows} recommendations to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
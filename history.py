@@ -0,0 +1,124 @@
+"""Background writer for search history.
+
+The click handler only enqueues a record; a daemon thread groups queued
+records into one ``executemany`` transaction per batch, flushing when
+``batch_size`` records are waiting or ``flush_interval`` seconds have passed
+since the first one arrived, and hands the batch to the
+:class:`history_store.HistoryStore` (one transaction per month it spans).
+``close()`` drains whatever is left. If the thread ever dies, ``submit``
+and ``flush`` write what it left queued themselves and carry on
+synchronously.
+"""
+import logging
+import queue
+import threading
+import time
+
+import perf
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """Batched, asynchronous ``search_history`` inserts.
+
+    With ``synchronous=True`` every record is written before ``submit``
+    returns, which is the old behaviour. When the queue is full the record is
+    also written synchronously rather than dropped.
+    """
+
+    def __init__(self, store, batch_size=200, flush_interval=0.5, max_queue=10_000, synchronous=False):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.synchronous = synchronous
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        if not synchronous:
+            self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, record):
+        """Queue one :class:`db.HistoryRecord`"""
+        if self._thread is not None:
+            if self._thread.is_alive():
+                try:
+                    self._queue.put_nowait(record)
+                    return
+                except queue.Full:
+                    pass
+            else:
+                self._drain()
+        self.store.insert_many([record])
+
+    def flush(self):
+        """Block until every record queued so far has been written"""
+        if self._thread is None:
+            return
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks and self._thread.is_alive():
+                self._queue.all_tasks_done.wait(0.1)
+        if not self._thread.is_alive():
+            self._drain()
+
+    def close(self):
+        """Write out the remaining records and stop the writer thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if self._thread is not None:
+            self._drain()
+
+    def _drain(self):
+        """Write whatever a dead writer thread left in the queue, in this thread"""
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.task_done()
+            else:
+                batch.append(item)
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with perf.span('history.write'):
+                self.store.insert_many(batch)
+            perf.count('history.records', len(batch))
+        except Exception:
+            logger.exception("failed to write %d search history records", len(batch))
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    self._queue.task_done()
+                    return
+                if item is not None:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                    pending, batch = batch, []
+                    deadline = None
+                    self._write(pending)
+        finally:
+            # Also on the way out of an unexpected error, so flush() never waits on these
+            if batch:
+                self._write(batch)
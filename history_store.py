@@ -0,0 +1,356 @@
+"""Search history partitioned by month, with Parquet archives for expired months.
+
+Searches are kept out of the catalog's database file: each calendar month
+is its own SQLite file in a directory next to it (``agriculture.db`` ->
+``agriculture-history/2026-10.db``) holding that month's
+``search_history``, ``search_history_crops`` and rollup tables. History
+writes, their WAL checkpoints and retention never touch ``agriculture.db``,
+and dropping a month is deleting a file rather than DELETE plus VACUUM.
+
+A search's id is ``YYYYMM << 32 | row id in its month's file``: ids still
+grow with time, keyset paging works as before, and an id names the
+partition it lives in. Reads are routed to the partitions they need:
+
+- a history page starts in the partition ``before_id`` names and walks
+  older months only until the page is full, continuing into the archives;
+- daily searches read only the months from ``since`` on;
+- top crops add up the per-month soil/crop rollups of the last
+  :data:`KEEP_MONTHS` months.
+
+Partition files are opened on first use, without writing to them unless
+they are new or from an older :data:`PARTITION_VERSION`, and at most
+:data:`MAX_OPEN` are kept open. :meth:`HistoryStore.archive` applies the retention policy: every month
+older than ``keep_months`` is written to ``archive/YYYY-MM.parquet`` (one row
+per search, with its crop ids in rank order) and its file is removed.
+
+Usage:
+    python history_store.py list
+    python history_store.py archive --keep-months 12
+"""
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+import pandas as pd
+
+import db
+
+logger = logging.getLogger(__name__)
+
+KEEP_MONTHS = 12
+# Partition files kept open at once (least recently used are dropped); top crops reads
+# KEEP_MONTHS of them, whatever the retention policy leaves live
+MAX_OPEN = 16
+ID_BITS = 32
+# Month key of searches without a usable timestamp; sorts before every real month
+UNDATED = 0
+PARTITION_VERSION = 2
+PAGE_COLUMNS = ['id', 'timestamp', 'soil_type', 'rainfall', 'location', 'farm_size', 'recommended_crops']
+
+_MONTH_FILE = re.compile(r'^(\d{4})-(\d{2})\.(db|parquet)$')
+
+
+def history_dir(db_path):
+    """Directory holding the history partitions of the database at ``db_path``"""
+    return os.path.splitext(db_path)[0] + '-history'
+
+
+def month_of(timestamp):
+    """Month key (``YYYYMM``) of a ``YYYY-MM-DD ...`` timestamp, :data:`UNDATED` if it has none"""
+    match = re.match(r'(\d{4})-(\d{2})', timestamp or '')
+    return int(match[1]) * 100 + int(match[2]) if match else UNDATED
+
+
+def month_name(month):
+    return f'{month // 100:04d}-{month % 100:02d}'
+
+
+def _month_number(month):
+    """Months since year 0 of a month key, for month arithmetic"""
+    return (month // 100) * 12 + month % 100 - 1
+
+
+def _oldest_kept(keep_months, now=None):
+    """Month number of the oldest of the last ``keep_months`` months, counting the current one"""
+    now = now or datetime.now()
+    return now.year * 12 + now.month - 1 - keep_months + 1
+
+
+def global_id(month, row_id):
+    return month << ID_BITS | row_id
+
+
+def split_id(history_id):
+    """(month key, row id in that month's file) of a search id"""
+    return history_id >> ID_BITS, history_id & ((1 << ID_BITS) - 1)
+
+
+def create_partition(conn):
+    """Create the history tables and indexes of a partition file if it does not have them yet"""
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= PARTITION_VERSION:
+        return
+    conn.execute('''CREATE TABLE IF NOT EXISTS search_history
+                    (id INTEGER PRIMARY KEY,
+                     timestamp TEXT, soil_type TEXT, rainfall INTEGER, location TEXT,
+                     farm_size REAL, recommended_crops TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS search_history_crops
+                    (history_id INTEGER NOT NULL REFERENCES search_history (id) ON DELETE CASCADE,
+                     rank INTEGER NOT NULL, crop_id INTEGER NOT NULL,
+                     PRIMARY KEY (history_id, rank)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS history_daily_state
+                    (day TEXT NOT NULL, location TEXT NOT NULL, searches INTEGER NOT NULL,
+                     PRIMARY KEY (day, location)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS history_soil_crop
+                    (soil_type TEXT NOT NULL, crop_id INTEGER NOT NULL, recommendations INTEGER NOT NULL,
+                     PRIMARY KEY (soil_type, crop_id)) WITHOUT ROWID''')
+    # The single-file history's indexes; version 1 partitions were created without them
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_crops_crop ON search_history_crops (crop_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_timestamp ON search_history (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_location ON search_history (location, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_soil ON search_history (soil_type, timestamp)')
+    conn.execute(f'PRAGMA user_version = {PARTITION_VERSION}')
+
+
+def import_partition(directory, month, history, crops):
+    """Copy rows of the old single-table history into a month's partition (safe to repeat).
+
+    ``history`` and ``crops`` are iterables of ``search_history`` and
+    ``search_history_crops`` rows; rows keep their ids within the month's
+    file, and the month's rollups are rebuilt from its rows.
+    """
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(directory, f'{month_name(month)}.db'))
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        create_partition(conn)
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO search_history VALUES (?, ?, ?, ?, ?, ?, ?)', history)
+            conn.executemany('INSERT OR IGNORE INTO search_history_crops VALUES (?, ?, ?)', crops)
+            conn.execute('DELETE FROM history_daily_state')
+            conn.execute('''INSERT INTO history_daily_state
+                            SELECT substr(timestamp, 1, 10), location, COUNT(*) FROM search_history
+                            WHERE timestamp IS NOT NULL AND location IS NOT NULL
+                            GROUP BY 1, 2''')
+            conn.execute('DELETE FROM history_soil_crop')
+            conn.execute('''INSERT INTO history_soil_crop
+                            SELECT h.soil_type, c.crop_id, COUNT(*)
+                            FROM search_history_crops c JOIN search_history h ON h.id = c.history_id
+                            WHERE h.soil_type IS NOT NULL
+                            GROUP BY 1, 2''')
+    finally:
+        conn.close()
+
+
+class HistoryStore:
+    """Month-partitioned search history next to the database at ``db_path``"""
+
+    def __init__(self, db_path=db.DB_PATH, max_open=MAX_OPEN):
+        self.directory = history_dir(db_path)
+        self.archive_directory = os.path.join(self.directory, 'archive')
+        self.max_open = max_open
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _months(self, directory, suffix):
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(match[1]) * 100 + int(match[2]) for match in map(_MONTH_FILE.match, names)
+                      if match and match[3] == suffix)
+
+    def months(self):
+        """Month keys with a live partition, oldest first"""
+        return self._months(self.directory, 'db')
+
+    def archived_months(self):
+        """Month keys archived to Parquet, oldest first"""
+        return self._months(self.archive_directory, 'parquet')
+
+    def _path(self, month):
+        return os.path.join(self.directory, f'{month_name(month)}.db')
+
+    def _archive_path(self, month):
+        return os.path.join(self.archive_directory, f'{month_name(month)}.parquet')
+
+    def pool(self, month, create=False):
+        """Connection pool of a month's partition; None if it has none (and ``create`` is false)"""
+        with self._lock:
+            pool = self._pools.get(month)
+            if pool is not None:
+                self._pools.move_to_end(month)
+                return pool
+            if not create and not os.path.exists(self._path(month)):
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            pool = db.ConnectionPool(self._path(month), max_size=2)
+            if create or self._outdated(pool):
+                with pool.transaction() as conn:
+                    create_partition(conn)
+            self._pools[month] = pool
+            # Dropped rather than closed: another thread may still be using it, and its
+            # connections close once it is garbage collected
+            while len(self._pools) > self.max_open:
+                self._pools.popitem(last=False)
+            return pool
+
+    @staticmethod
+    def _outdated(pool):
+        with pool.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0] < PARTITION_VERSION
+
+    def _forget(self, month):
+        with self._lock:
+            pool = self._pools.pop(month, None)
+        if pool is not None:
+            pool.close()
+
+    def insert_many(self, records):
+        """Write :class:`db.HistoryRecord` s, one transaction per month they fall in"""
+        by_month = {}
+        for record in records:
+            by_month.setdefault(month_of(record.timestamp), []).append(record)
+        for month, batch in by_month.items():
+            db.insert_history_many(self.pool(month, create=True), batch)
+
+    def fetch_page(self, before_id=None, limit=10):
+        """One page of searches, newest first, starting below ``before_id`` (keyset paging).
+
+        Pass the smallest ``id`` of the previous page to get the next (older)
+        one. Only the partitions from the one ``before_id`` names back to
+        where the page fills up are read.
+        """
+        start, row_id = split_id(before_id) if before_id is not None else (None, None)
+        pages, wanted = [], limit
+        for month in reversed(self.months()):
+            if start is not None and month > start:
+                continue
+            page = db.fetch_history_page(self.pool(month), row_id if month == start else None, wanted)
+            page['id'] = global_id(month, page['id'])
+            pages.append(page)
+            wanted -= len(page)
+            if wanted <= 0:
+                break
+        if wanted > 0:
+            pages += self._archived_page(before_id, wanted)
+        pages = [page for page in pages if len(page)]
+        if not pages:
+            return pd.DataFrame(columns=PAGE_COLUMNS)
+        return pd.concat(pages, ignore_index=True).head(limit)
+
+    def _archived_page(self, before_id, limit):
+        pages = []
+        for month in reversed(self.archived_months()):
+            if before_id is not None and global_id(month, 0) >= before_id:
+                continue
+            filters = [('id', '<', before_id)] if before_id is not None else None
+            page = pd.read_parquet(self._archive_path(month), columns=PAGE_COLUMNS, filters=filters)
+            page = page.sort_values('id', ascending=False).head(limit).reset_index(drop=True)
+            pages.append(page)
+            limit -= len(page)
+            if limit <= 0:
+                break
+        return pages
+
+    def fetch_daily_searches(self, since):
+        """Searches per state per day from ``since`` (YYYY-MM-DD) onwards, from those months only"""
+        first = month_of(since)
+        days = [db.fetch_daily_searches(self.pool(month), since) for month in self.months() if month >= first]
+        days = [frame for frame in days if len(frame)]
+        if not days:
+            return pd.DataFrame(columns=['day', 'location', 'searches'])
+        return pd.concat(days, ignore_index=True).sort_values(['day', 'location'], ignore_index=True)
+
+    def fetch_top_crops(self, pool, soil_type, limit=5, lang='en', keep_months=KEEP_MONTHS, now=None):
+        """Crops most often recommended for a soil type in the last ``keep_months`` months, names from ``pool``"""
+        oldest = _oldest_kept(keep_months, now)
+        counts = Counter()
+        for month in self.months():
+            if month == UNDATED or _month_number(month) < oldest:
+                continue
+            counts.update(db.fetch_soil_crop_counts(self.pool(month), soil_type))
+        top = counts.most_common(limit)
+        crops = db.fetch_named_crops(pool, [crop_id for crop_id, _ in top], lang)
+        crops['recommendations'] = crops['id'].map(dict(top))
+        return crops.sort_values('recommendations', ascending=False, kind='stable', ignore_index=True)
+
+    def archive(self, keep_months=KEEP_MONTHS, now=None):
+        """Move every month older than the last ``keep_months`` to Parquet; returns the archived months"""
+        if keep_months < 1:
+            raise ValueError("keep_months must be at least 1: the current month is always live")
+        oldest = _oldest_kept(keep_months, now)
+        archived = []
+        for month in self.months():
+            if month != UNDATED and _month_number(month) >= oldest:
+                continue
+            self.archive_month(month)
+            archived.append(month)
+        return archived
+
+    def archive_month(self, month):
+        """Write one month to ``archive/YYYY-MM.parquet`` and remove its partition file"""
+        pool = self.pool(month)
+        if pool is None:
+            return
+        with pool.connection() as conn:
+            history = pd.read_sql_query(db.SELECT_ARCHIVE_HISTORY, conn)
+        history['id'] = global_id(month, history['id'])
+        history['crop_ids'] = [[int(crop_id) for crop_id in ids.split(',')] if ids else []
+                               for ids in history['crop_ids'].tolist()]
+        path = self._archive_path(month)
+        os.makedirs(self.archive_directory, exist_ok=True)
+        if os.path.exists(path):
+            # Searches logged for the month after it was archived
+            history = pd.concat([pd.read_parquet(path), history], ignore_index=True)
+        history.to_parquet(path + '.tmp', index=False, engine='pyarrow')
+        os.replace(path + '.tmp', path)
+        self._forget(month)
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self._path(month) + suffix)
+            except FileNotFoundError:
+                pass
+        logger.info("archived %d searches from %s to %s", len(history), month_name(month), path)
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), OrderedDict()
+        for pool in pools:
+            pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List and archive the monthly search history partitions")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database the history belongs to")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="live and archived months")
+    archive_parser = commands.add_parser('archive', help="move expired months to Parquet")
+    archive_parser.add_argument('--keep-months', type=int, default=KEEP_MONTHS,
+                                help="months kept live, the current one included")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    store = HistoryStore(args.db)
+    try:
+        if args.command == 'archive':
+            archived = store.archive(args.keep_months)
+            print(f"Archived {len(archived)} months" + (f": {', '.join(map(month_name, archived))}" if archived else ""))
+            return
+        for month in store.months():
+            with store.pool(month).connection() as conn:
+                searches = conn.execute('SELECT COUNT(*) FROM search_history').fetchone()[0]
+            print(f"{month_name(month)}  live      {searches:>10,} searches  "
+                  f"{os.path.getsize(store._path(month)):>12,} bytes")
+        for month in store.archived_months():
+            print(f"{month_name(month)}  archived  {os.path.getsize(store._archive_path(month)):>33,} bytes")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""UI strings per language, compiled into bundles and loaded lazily.
+
+Strings are edited in ``locales/<lang>.json``. Each language compiles to
+``locales/<lang>.bundle``, a ``marshal`` dump of its keys and values with
+any key it lacks filled in from English. A process reads a language's
+bundle the first time that language is asked for and keeps it; languages
+nobody picks are never read. A bundle older than its JSON source is
+recompiled when it is loaded, so editing the JSON is enough.
+``python i18n.py`` compiles every bundle ahead of time and lists missing
+keys.
+
+Usage:
+    python i18n.py
+"""
+import argparse
+import json
+import logging
+import marshal
+import os
+import threading
+import types
+
+logger = logging.getLogger(__name__)
+
+LOCALE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+FALLBACK = 'en'
+
+_bundles = {}
+_lock = threading.Lock()
+
+
+def _source_path(lang):
+    return os.path.join(LOCALE_DIR, f'{lang}.json')
+
+
+def _bundle_path(lang):
+    return os.path.join(LOCALE_DIR, f'{lang}.bundle')
+
+
+def languages():
+    """Languages that have a JSON source"""
+    return sorted(name[:-len('.json')] for name in os.listdir(LOCALE_DIR) if name.endswith('.json'))
+
+
+def _read_source(lang):
+    try:
+        with open(_source_path(lang), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise KeyError(f"no translations for {lang!r}") from None
+
+
+def _compile(lang):
+    """(keys, values, missing keys) for ``lang``, English filling the gaps"""
+    strings = _read_source(lang)
+    fallback = strings if lang == FALLBACK else _read_source(FALLBACK)
+    keys = tuple(fallback) + tuple(key for key in strings if key not in fallback)
+    missing = [key for key in keys if key not in strings]
+    return keys, tuple(strings.get(key, fallback.get(key)) for key in keys), missing
+
+
+def compile_bundle(lang):
+    """Write ``lang``'s bundle; returns the keys it took from English"""
+    keys, values, missing = _compile(lang)
+    path = _bundle_path(lang)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(marshal.dumps((keys, values)))
+    os.replace(path + '.tmp', path)
+    return missing
+
+
+def _is_fresh(lang):
+    try:
+        built = os.stat(_bundle_path(lang)).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    sources = {lang, FALLBACK}
+    return all(os.stat(_source_path(source)).st_mtime_ns <= built for source in sources)
+
+
+def _load(lang):
+    if not _is_fresh(lang):
+        try:
+            compile_bundle(lang)
+        except OSError as exc:
+            # Read-only install: use the sources directly
+            logger.warning("cannot write the %s translation bundle (%s); loading it from JSON", lang, exc)
+            keys, values, _ = _compile(lang)
+            return types.MappingProxyType(dict(zip(keys, values)))
+    with open(_bundle_path(lang), 'rb') as f:
+        keys, values = marshal.load(f)
+    return types.MappingProxyType(dict(zip(keys, values)))
+
+
+def translations(lang):
+    """Read-only UI strings for ``lang``, loaded on first use and kept for the process"""
+    bundle = _bundles.get(lang)
+    if bundle is None:
+        with _lock:
+            bundle = _bundles.get(lang)
+            if bundle is None:
+                bundle = _bundles[lang] = _load(lang)
+    return bundle
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the per-language translation bundles")
+    parser.parse_args(argv)
+    for lang in languages():
+        missing = compile_bundle(lang)
+        note = f" (from {FALLBACK}: {', '.join(missing)})" if missing else ""
+        print(f"{lang}: {_bundle_path(lang)}{note}")
+
+
+if __name__ == "__main__":
+    main()
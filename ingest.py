@@ -0,0 +1,340 @@
+"""Bulk crop catalog ingestion from CSV, Excel or Parquet.
+
+The file is read in chunks. Each chunk is validated against the crops
+schema (soil and state vocabularies, rainfall ranges, translated names,
+numeric fields) and its valid rows are upserted by ``id`` in one
+transaction, names into ``crop_names``. Rows whose fingerprint (a hash of
+the validated row) matches the one stored at their last load, with no
+change logged since, are skipped outright. The rest are staged in a
+temporary table and merged set-wise: only rows that differ from what is
+stored are written and logged in ``crops_changes``, with one catalog
+version bump per chunk. Running planners then re-read just those crops and
+drop only the cached results they affect.
+
+Invalid rows are skipped and, with ``--rejects``, written to a CSV with the
+reason.
+
+Usage:
+    python ingest.py crops.csv --rejects rejected.csv
+    python ingest.py prices.parquet --chunk-size 200000
+    python ingest.py catalog.xlsx --dry-run
+"""
+import argparse
+import itertools
+import logging
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import db
+import migrations
+from catalog import CATEGORICAL_COLUMNS, COLUMNS, LANGUAGES, NUMERIC_COLUMNS, PEST_RISKS, SOIL_TYPES, STATES
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'xlsx', 'parquet')
+MAX_RAINFALL = 10_000
+MAX_DURATION_MONTHS = 60
+INTEGER_COLUMNS = [col for col, dtype in NUMERIC_COLUMNS.items() if np.issubdtype(dtype, np.integer)]
+NAME_COLUMNS = [f'name_{lang}' for lang in LANGUAGES]
+TEXT_COLUMNS = NAME_COLUMNS + list(CATEGORICAL_COLUMNS)
+# Columns of the crops table itself; names live in crop_names
+CROP_COLUMNS = [col for col in COLUMNS if col not in NAME_COLUMNS]
+
+# Totals for one ingestion run
+IngestStats = namedtuple('IngestStats', 'rows loaded changed rejected seconds')
+
+_column_list = ', '.join(COLUMNS)
+_crop_column_list = ', '.join(CROP_COLUMNS)
+
+
+def _differs(old, new, columns=COLUMNS):
+    return ' OR '.join(f'{old}.{col} IS NOT {new}.{col}' for col in columns[1:])
+
+
+# Staged rows have the crops_named shape (crop columns plus one name column per language)
+# and the row's fingerprint
+CREATE_STAGING = 'CREATE TEMP TABLE IF NOT EXISTS crops_staging AS SELECT *, 0 AS fingerprint FROM crops_named WHERE 0'
+# Rows staged per INSERT statement: far fewer statement steps than one row each
+STAGING_BATCH = 100
+_staged_row = f"({', '.join('?' * (len(COLUMNS) + 1))})"
+INSERT_STAGING = f"INSERT INTO crops_staging ({_column_list}, fingerprint) VALUES {_staged_row}"
+INSERT_STAGING_BATCH = (f"INSERT INTO crops_staging ({_column_list}, fingerprint) "
+                        f"VALUES {', '.join([_staged_row] * STAGING_BATCH)}")
+_staged_name = 'CASE n.lang ' + ' '.join(f"WHEN '{lang}' THEN s.name_{lang}" for lang in LANGUAGES) + ' END'
+# Staged crops that are new or differ from the base tables: a crops column, or fewer
+# than all of its names stored as staged (one range scan of crop_names per crop)
+LOG_STAGED_CHANGES = f'''INSERT INTO crops_changes (crop_id, version)
+                         SELECT s.id, ?1 FROM crops_staging s LEFT JOIN crops c ON c.id = s.id
+                         WHERE c.id IS NULL OR {_differs('c', 's', CROP_COLUMNS)}
+                            OR (SELECT count(*) FROM crop_names n
+                                WHERE n.crop_id = s.id AND n.name = {_staged_name}) < {len(LANGUAGES)}
+                         ON CONFLICT (crop_id) DO UPDATE SET version = excluded.version'''
+_changed_ids = 'SELECT crop_id FROM crops_changes WHERE version = ?1'
+# Only the crops logged as changed in this chunk are written
+UPSERT_STAGED = f'''INSERT INTO crops ({_crop_column_list}) SELECT {_crop_column_list} FROM crops_staging
+                    WHERE id IN ({_changed_ids})
+                    ON CONFLICT (id) DO UPDATE SET {', '.join(f'{col} = excluded.{col}' for col in CROP_COLUMNS[1:])}
+                    WHERE {_differs('crops', 'excluded', CROP_COLUMNS)}'''
+# Names of those crops unpivoted to crop_names rows, in key order
+UPSERT_STAGED_NAMES = f'''INSERT INTO crop_names (crop_id, lang, name)
+                          SELECT s.id, n.lang, {_staged_name} FROM crops_staging s
+                          CROSS JOIN ({' UNION ALL '.join(f"SELECT '{lang}' AS lang" for lang in LANGUAGES)}) n
+                          WHERE s.id IN ({_changed_ids})
+                          ON CONFLICT (crop_id, lang) DO UPDATE SET name = excluded.name
+                          WHERE name IS NOT excluded.name'''
+# Stands the per-row change-log triggers down inside a chunk's transaction; the chunk logs its changes itself
+SET_BULK_LOAD = "UPDATE catalog_meta SET value = ? WHERE key = 'bulk_load'"
+BUMP_CATALOG_VERSION = "UPDATE catalog_meta SET value = ? WHERE key = 'crops_version'"
+# Fingerprints still current: no change logged for the crop since it was checked
+SELECT_FINGERPRINTS = '''SELECT f.crop_id, f.fingerprint FROM crops_fingerprints f
+                         LEFT JOIN crops_changes c ON c.crop_id = f.crop_id
+                         WHERE f.crop_id BETWEEN ? AND ? AND (c.version IS NULL OR c.version <= f.version)'''
+UPSERT_FINGERPRINTS = '''INSERT INTO crops_fingerprints (crop_id, fingerprint, version)
+                         SELECT id, fingerprint, ? FROM crops_staging WHERE true
+                         ON CONFLICT (crop_id) DO UPDATE SET fingerprint = excluded.fingerprint,
+                                                             version = excluded.version'''
+
+
+def read_chunks(path, chunk_size=100_000, fmt=None):
+    """DataFrame chunks of a CSV, Excel (first sheet) or Parquet file"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt == 'csv':
+        yield from _read_csv(path, chunk_size)
+    elif fmt == 'xlsx':
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(col).strip() for col in next(rows, ())]
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+                yield pd.DataFrame(chunk, columns=header)
+        finally:
+            workbook.close()
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"unsupported format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+
+def _read_csv(path, chunk_size):
+    """CSV chunks with every column as text; parsed with pyarrow when it is installed"""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+        return
+    header = pa_csv.open_csv(path).schema.names
+    reader = pa_csv.open_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types={col: pa.string() for col in header}, strings_can_be_null=False))
+    batches, rows = [], 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunk_size:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, rows = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+
+def _numbers(column):
+    if getattr(column.dtype, 'storage', None) == 'pyarrow':
+        # Arrow-backed text (pyarrow CSV, Parquet) parses in Arrow, without a Python float per value
+        try:
+            return pd.Series(column.astype('float64[pyarrow]').to_numpy(np.float64, na_value=np.nan),
+                             index=column.index)
+        except (TypeError, ValueError):
+            pass
+    try:
+        return column.astype(np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(column, errors='coerce')
+
+
+def _normalize_keys(column, vocabulary):
+    """Lower-cased, de-duplicated comma lists and a mask of the rows using only known keys"""
+    # A catalog repeats a few hundred distinct lists at most, so work on those
+    codes, uniques = pd.factorize(column.fillna('').astype(str))
+    lists = [[key.strip().lower() for key in value.split(',') if key.strip()] for value in uniques]
+    valid = np.array([bool(keys) and all(key in vocabulary for key in keys) for keys in lists] + [False])
+    joined = np.array([','.join(dict.fromkeys(keys)) for keys in lists] + [''], dtype=object)
+    return joined[codes], valid[codes]
+
+
+def validate(chunk, first_row=1):
+    """Split a chunk into rows ready for the crops table and rejected rows.
+
+    Returns ``(valid, rejected)``: ``valid`` has the crops columns with
+    normalized values; ``rejected`` has the 1-based ``row`` number (counted
+    from ``first_row``), the ``id`` as given and the ``reason``.
+    """
+    missing = [col for col in COLUMNS if col not in chunk.columns]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    chunk = chunk.reset_index(drop=True)
+    out = {}
+    checks = []
+
+    for col in NUMERIC_COLUMNS:
+        values = _numbers(chunk[col])
+        checks.append((values.isna().to_numpy(), f"{col} is not a number"))
+        if col in INTEGER_COLUMNS:
+            checks.append(((values % 1 != 0).to_numpy(), f"{col} is not a whole number"))
+        out[col] = values
+    checks += [
+        ((out['id'] <= 0).to_numpy(), "id must be positive"),
+        ((out['min_rainfall'] < 0).to_numpy(), "min_rainfall is negative"),
+        ((out['max_rainfall'] < out['min_rainfall']).to_numpy(), "max_rainfall is below min_rainfall"),
+        ((out['max_rainfall'] > MAX_RAINFALL).to_numpy(), f"max_rainfall is above {MAX_RAINFALL}"),
+        ((out['yield_per_hectare'] < 0).to_numpy(), "yield_per_hectare is negative"),
+        ((out['market_price'] < 0).to_numpy(), "market_price is negative"),
+        (~out['duration_months'].between(1, MAX_DURATION_MONTHS).to_numpy(),
+         f"duration_months is outside 1-{MAX_DURATION_MONTHS}"),
+    ]
+
+    for col in TEXT_COLUMNS:
+        values = chunk[col].fillna('').astype(str).str.strip()
+        checks.append(((values == '').to_numpy(), f"{col} is empty"))
+        out[col] = values
+    out['pest_risk'] = out['pest_risk'].str.lower()
+    checks.append((~out['pest_risk'].isin(PEST_RISKS).to_numpy(), f"pest_risk is not one of {', '.join(PEST_RISKS)}"))
+
+    out['soil_types'], soils_ok = _normalize_keys(chunk['soil_types'], SOIL_TYPES)
+    checks.append((~soils_ok, "soil_types lists an unknown soil type"))
+    out['states'], states_ok = _normalize_keys(chunk['states'], STATES)
+    checks.append((~states_ok, "states lists an unknown state"))
+
+    # First failing check per row, in the order above
+    reasons = np.select([mask for mask, _ in checks], [reason for _, reason in checks], default='')
+    bad = reasons != ''
+    rejected = pd.DataFrame({'row': np.flatnonzero(bad) + first_row, 'id': chunk['id'][bad].to_numpy(),
+                             'reason': reasons[bad]})
+    valid = pd.DataFrame({col: out[col] for col in COLUMNS})[~bad]
+    for col in INTEGER_COLUMNS:
+        valid[col] = valid[col].astype(np.int64)
+    # A later row for the same id wins, as it would across chunks
+    return valid.drop_duplicates('id', keep='last'), rejected
+
+
+def _stage(conn, columns):
+    """Insert column lists into the staging table, :data:`STAGING_BATCH` rows per statement"""
+    full = len(columns[0]) - len(columns[0]) % STAGING_BATCH
+    values = itertools.chain.from_iterable(zip(*(col[:full] for col in columns)))
+    size = STAGING_BATCH * len(columns)
+    conn.executemany(INSERT_STAGING_BATCH, iter(lambda: tuple(itertools.islice(values, size)), ()))
+    conn.executemany(INSERT_STAGING, zip(*(col[full:] for col in columns)))
+
+
+def _fingerprints(valid):
+    """64-bit hash of each validated row, as SQLite integers"""
+    return pd.util.hash_pandas_object(valid[COLUMNS], index=False, categorize=False).to_numpy().view(np.int64)
+
+
+def load_chunk(conn, valid):
+    """Upsert validated rows in one transaction; returns how many crops actually changed.
+
+    Rows whose fingerprint matches the one stored when they were last loaded are
+    skipped without staging; the rest are diffed against the stored crops.
+    """
+    ids = valid['id'].to_numpy()
+    fingerprints = _fingerprints(valid)
+    conn.execute(CREATE_STAGING)
+    # Names are only written for crops upserted in the same transaction, so there is no
+    # parent to look up per name; the pragma has no effect inside a transaction
+    conn.execute('PRAGMA foreign_keys=OFF')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = conn.execute(db.SELECT_CATALOG_VERSION).fetchone()[0] + 1
+        stored = np.array(conn.execute(SELECT_FINGERPRINTS, (int(ids.min()), int(ids.max()))).fetchall(),
+                          dtype=np.int64).reshape(-1, 2)
+        at = pd.Index(stored[:, 0]).get_indexer(ids)
+        stale = at < 0
+        stale[~stale] = stored[at[~stale], 1] != fingerprints[~stale]
+        changed = 0
+        if stale.any():
+            # Set and cleared in this transaction, so other connections never see it set
+            conn.execute(SET_BULK_LOAD, (1,))
+            conn.execute('DELETE FROM crops_staging')
+            _stage(conn, [valid[col][stale].tolist() for col in COLUMNS] + [fingerprints[stale].tolist()])
+            changed = conn.execute(LOG_STAGED_CHANGES, (version,)).rowcount
+            if changed:
+                conn.execute(UPSERT_STAGED, (version,))
+                conn.execute(UPSERT_STAGED_NAMES, (version,))
+                conn.execute(BUMP_CATALOG_VERSION, (version,))
+            # Checked at the version now current; a later change logs a newer one
+            checked = version if changed else version - 1
+            conn.execute(UPSERT_FINGERPRINTS, (checked,))
+            conn.execute(SET_BULK_LOAD, (0,))
+            conn.execute('DELETE FROM crops_staging')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute('PRAGMA foreign_keys=ON')
+    return changed
+
+
+def ingest(pool, chunks, rejects=None, dry_run=False):
+    """Validate and upsert every chunk; returns :class:`IngestStats`.
+
+    Rejected rows are appended to the binary file object ``rejects`` as CSV
+    when given. With ``dry_run`` nothing is written to the database.
+    """
+    start = time.perf_counter()
+    rows = loaded = changed = rejected = 0
+    with pool.connection() as conn:
+        for chunk in chunks:
+            valid, bad = validate(chunk, first_row=rows + 1)
+            rows += len(chunk)
+            if len(bad):
+                rejected += len(bad)
+                if rejects is not None:
+                    rejects.write(bad.to_csv(index=False, header=(rejected == len(bad))).encode('utf-8'))
+            if len(valid) and not dry_run:
+                changed += load_chunk(conn, valid)
+            loaded += len(valid)
+    return IngestStats(rows, loaded, changed, rejected, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load crops into the catalog")
+    parser.add_argument('path', help="crops file (.csv, .xlsx or .parquet) with the crops table columns")
+    parser.add_argument('--format', choices=FORMATS, help="override the format implied by the extension")
+    parser.add_argument('--chunk-size', type=int, default=100_000, help="rows validated and upserted per transaction")
+    parser.add_argument('--rejects', help="write rejected rows and reasons to this CSV")
+    parser.add_argument('--dry-run', action='store_true', help="validate only, write nothing")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    pool = db.ConnectionPool(args.db)
+    migrations.migrate(pool)
+    chunks = read_chunks(args.path, args.chunk_size, args.format)
+    try:
+        if args.rejects:
+            with open(args.rejects, 'wb') as rejects:
+                stats = ingest(pool, chunks, rejects, dry_run=args.dry_run)
+        else:
+            stats = ingest(pool, chunks, dry_run=args.dry_run)
+    finally:
+        pool.close()
+    rate = stats.rows / stats.seconds if stats.seconds else 0.0
+    print(f"Read {stats.rows} rows in {stats.seconds:.2f}s ({rate:,.0f} rows/s): "
+          f"{stats.loaded} valid, {stats.changed} changed, {stats.rejected} rejected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Offline crop recommendations from a precompiled answer table.
+
+Field kiosks have no network and little CPU, and the app's inputs are a
+small finite grid: every soil type x state x rainfall slider step. ``python
+answers.py build`` precomputes the ranked crops for each of them into one
+binary file; this module answers queries from that file and imports nothing
+outside the standard library (no NumPy, pandas or Streamlit), so it starts in
+milliseconds.
+
+File layout (little-endian; every section starts on an 8-byte boundary):
+
+- header: magic ``CROPANS\\0``, format version, length of the metadata
+- metadata: UTF-8 JSON with the catalog version the table was built from,
+  the soil, state and language vocabularies, the rainfall grid, top-k, the
+  ranking weights and each section's (offset, length)
+- ``crops``: one fixed-width record per soil type and crop that appears in
+  an answer for it (:data:`CROP_FIELDS` then one name per language), with the
+  profit per hectare after that soil's fertilizer; text fields are indexes
+  into the string table (:data:`NO_STRING` when missing)
+- ``string_offsets`` / ``string_data``: uint32 offsets into UTF-8 bytes,
+  every distinct string stored once
+- ``index``: one (first, count, matches) slot per soil x state x rainfall
+  step, in that order; ``count`` ranked crops start at ``first`` in ``lists``
+  and ``matches`` is how many crops matched in all
+- ``lists``: uint32 crop record numbers; answers shared by several rainfall
+  steps are stored once
+
+Answers for a language are the same crop records with that language's names,
+so languages cost one name column rather than a copy of every answer.
+The file is memory-mapped; a query reads one index slot and its list, and
+decoded crops are memoized.
+
+Usage:
+    python kiosk.py answers.bin loamy 1500 karnataka --lang kn --top-n 5
+"""
+import argparse
+import json
+import mmap
+import struct
+from collections import namedtuple
+
+MAGIC = b'CROPANS\0'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sII')
+SLOT = struct.Struct('<III')
+# Fixed part of a crop record; text fields are string table indexes
+CROP_FIELDS = ('id', 'profit_per_hectare', 'yield_per_hectare', 'market_price', 'duration_months',
+               'pest_risk', 'fertilizer', 'season', 'water_requirement')
+TEXT_FIELDS = CROP_FIELDS[5:]
+ALIGNMENT = 8
+# String index of a missing text value
+NO_STRING = 0xFFFFFFFF
+
+# One recommended crop, with its name in the language asked for
+KioskCrop = namedtuple('KioskCrop', ('name',) + CROP_FIELDS)
+# How many crops matched, and the best ones in rank order
+Answer = namedtuple('Answer', 'matches crops')
+
+
+def crop_record(languages):
+    """Struct of one crop record for a table with these languages"""
+    return struct.Struct('<qqddh2x' + 'I' * (len(TEXT_FIELDS) + len(languages)))
+
+
+class AnswerTable:
+    """Read-only, memory-mapped answer table written by ``answers.py build``"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_length = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a crop answer table")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has table format {version}; this reader reads format {FORMAT_VERSION}")
+        meta = json.loads(self._map[HEADER.size:HEADER.size + meta_length].decode('utf-8'))
+        self.meta = meta
+        self.catalog_version = meta['catalog_version']
+        self.soil_types = tuple(meta['soil_types'])
+        self.states = tuple(meta['states'])
+        self.languages = tuple(meta['languages'])
+        self.rainfall_range = tuple(meta['rainfall'])
+        self.top_k = meta['top_k']
+        self._soils = {key: i for i, key in enumerate(self.soil_types)}
+        self._state_index = {key: i for i, key in enumerate(self.states)}
+        self._langs = {key: i for i, key in enumerate(self.languages)}
+        low, high, step = self.rainfall_range
+        self._steps = (high - low) // step + 1
+        self._record = crop_record(self.languages)
+        self._sections = {name: offset for name, (offset, _) in meta['sections'].items()}
+        self._crops = {}
+
+    def __len__(self):
+        """Number of answer slots (soil types x states x rainfall steps)"""
+        return len(self.soil_types) * len(self.states) * self._steps
+
+    def _string(self, index):
+        if index == NO_STRING:
+            return None
+        start, end = struct.unpack_from('<II', self._map, self._sections['string_offsets'] + 4 * index)
+        offset = self._sections['string_data']
+        return self._map[offset + start:offset + end].decode('utf-8')
+
+    def _crop(self, number, lang):
+        crop = self._crops.get((number, lang))
+        if crop is None:
+            values = self._record.unpack_from(self._map, self._sections['crops'] + number * self._record.size)
+            fixed, text = values[:5], values[5:]
+            crop = self._crops[(number, lang)] = KioskCrop(
+                self._string(text[len(TEXT_FIELDS) + lang]), *fixed,
+                *(self._string(index) for index in text[:len(TEXT_FIELDS)]))
+        return crop
+
+    def slot(self, soil_type, rainfall, location):
+        """Index slot of a query, or None for a soil type or state the table does not know"""
+        low, high, step = self.rainfall_range
+        if not low <= rainfall <= high or (rainfall - low) % step:
+            raise ValueError(f"rainfall must be a multiple of {step} between {low} and {high} mm")
+        soil, state = self._soils.get(soil_type), self._state_index.get(location)
+        if soil is None or state is None:
+            return None
+        return (soil * len(self.states) + state) * self._steps + int(rainfall - low) // step
+
+    def answer(self, soil_type, rainfall, location, lang='en', limit=None):
+        """:class:`Answer` for one query; ``limit`` keeps only the best crops"""
+        if lang not in self._langs:
+            raise ValueError(f"unknown language {lang!r}; the table has {', '.join(self.languages)}")
+        slot = self.slot(soil_type, rainfall, location)
+        if slot is None:
+            return Answer(0, ())
+        first, count, matches = SLOT.unpack_from(self._map, self._sections['index'] + slot * SLOT.size)
+        if limit is not None:
+            count = min(count, limit)
+        numbers = struct.unpack_from(f'<{count}I', self._map, self._sections['lists'] + 4 * first)
+        lang = self._langs[lang]
+        return Answer(matches, tuple(self._crop(number, lang) for number in numbers))
+
+    def close(self):
+        self._map.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recommend crops offline from a precompiled answer table")
+    parser.add_argument('table', help="answer table built with 'python answers.py build'")
+    parser.add_argument('soil_type')
+    parser.add_argument('rainfall', type=int, help="annual rainfall in mm, on the slider's steps")
+    parser.add_argument('location', help="state, e.g. karnataka")
+    parser.add_argument('--lang', default='en', help="language for crop names")
+    parser.add_argument('--top-n', type=int, default=5, help="crops to show")
+    args = parser.parse_args(argv)
+
+    table = AnswerTable(args.table)
+    try:
+        answer = table.answer(args.soil_type, args.rainfall, args.location, args.lang, args.top_n)
+    except ValueError as exc:
+        parser.error(str(exc))
+    print(f"Found {answer.matches} suitable crops")
+    for rank, crop in enumerate(answer.crops, 1):
+        print(f"{rank}. {crop.name}: {crop.yield_per_hectare} t/ha, profit ₹{crop.profit_per_hectare:,}/ha, "
+              f"pest risk {crop.pest_risk}, {crop.duration_months} months, {crop.season}")
+    table.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""Versioned schema migrations for agriculture.db.
+
+The schema version is stored in SQLite's ``PRAGMA user_version``. Each
+migration runs in its own transaction and bumps the version, so a database
+that is already current costs a single pragma read, and :func:`migrate` only
+does that once per process. Startup timings are passed to the hooks
+registered with :func:`add_timing_hook`.
+"""
+import logging
+import threading
+import time
+
+import history_store
+
+logger = logging.getLogger(__name__)
+
+# Languages of the name_* columns the crops table was created with
+NAME_LANGUAGES = ('en', 'kn', 'ta', 'te', 'ml', 'hi')
+
+SEED_CROPS = [
+    (1, 'Rice', 'ಅಕ್ಕಿ', 'அரிசி', 'వరి', 'അരി', 'चावल',
+     'clay,loamy,alluvial', 1000, 2500, 'karnataka,tamilnadu,andhra,telangana,kerala',
+     4.5, 45000, 'medium', 'Urea', 35, 'Monsoon', 'High', 5),
+
+    (2, 'Wheat', 'ಗೋಧಿ', 'கோதுமை', 'గోధుమ', 'ഗോതമ്പ്', 'गेहूं',
+     'loamy,black,alluvial', 400, 900, 'punjab,maharashtra,karnataka',
+     3.8, 40000, 'low', 'DAP', 28, 'Winter', 'Medium', 4),
+
+    (3, 'Cotton', 'ಹತ್ತಿ', 'பருத்தி', 'పత్తి', 'പഞ്ഞി', 'कपास',
+     'black,red,alluvial', 500, 1200, 'maharashtra,karnataka,andhra,telangana',
+     2.5, 65000, 'high', 'NPK', 90, 'Kharif', 'Medium', 6),
+
+    (4, 'Sugarcane', 'ಕಬ್ಬು', 'கரும்பு', 'చెరకు', 'കരിമ്പ്', 'गन्ना',
+     'loamy,clay,black', 1000, 2000, 'maharashtra,karnataka,tamilnadu,andhra',
+     70, 120000, 'medium', 'NPK', 3.5, 'Year-round', 'Very High', 12),
+
+    (5, 'Maize', 'ಮೆಕ್ಕೆ ಜೋಳ', 'சோளம்', 'మొక్కజొన్న', 'ചോളം', 'मक्का',
+     'loamy,sandy,alluvial', 500, 1000, 'karnataka,andhra,telangana,maharashtra',
+     5.5, 38000, 'low', 'Urea', 22, 'Kharif', 'Medium', 4),
+
+    (6, 'Groundnut', 'ಕಡಲೆಕಾಯಿ', 'நிலக்கடலை', 'వేరుశెనగ', 'നിലക്കടല', 'मूंगफली',
+     'sandy,red,black', 500, 1250, 'karnataka,tamilnadu,andhra,telangana',
+     1.8, 52000, 'medium', 'Potash', 70, 'Kharif', 'Low', 4),
+
+    (7, 'Tomato', 'ಟೊಮೇಟೊ', 'தக்காளி', 'టమాటో', 'തക്കാളി', 'टमाटर',
+     'loamy,sandy,red', 600, 1300, 'karnataka,maharashtra,andhra,tamilnadu',
+     35, 180000, 'high', 'NPK', 25, 'Winter', 'Medium', 3),
+
+    (8, 'Banana', 'ಬಾಳೆಹಣ್ಣು', 'வாழை', 'అరటి', 'വാഴപ്പഴം', 'केला',
+     'loamy,alluvial,clay', 1000, 2500, 'kerala,tamilnadu,karnataka,maharashtra',
+     40, 250000, 'medium', 'Organic Compost', 30, 'Year-round', 'Very High', 12),
+
+    (9, 'Onion', 'ಈರುಳ್ಳಿ', 'வெங்காயம்', 'ఉల్లిపాయ', 'ഉള്ളി', 'प्याज',
+     'loamy,sandy,black', 600, 1000, 'maharashtra,karnataka,andhra,tamilnadu',
+     25, 95000, 'medium', 'NPK', 35, 'Rabi', 'Medium', 4),
+
+    (10, 'Chilli', 'ಮೆಣಸಿನಕಾಯಿ', 'மிளகாய்', 'మిర్చి', 'മുളക്', 'मिर्च',
+     'loamy,red,black', 600, 1250, 'andhra,telangana,karnataka,tamilnadu',
+     3.5, 85000, 'high', 'NPK', 120, 'Kharif', 'Medium', 5)
+]
+
+# N, P2O5 and K2O kg per hectare of the seed crops on loamy soil; other soils scale them by SEED_SOIL_FACTORS
+SEED_NUTRIENTS = {
+    'Rice': (120, 60, 40),
+    'Wheat': (120, 60, 40),
+    'Cotton': (100, 50, 50),
+    'Sugarcane': (250, 115, 115),
+    'Maize': (150, 75, 40),
+    'Groundnut': (25, 50, 75),
+    'Tomato': (150, 100, 100),
+    'Banana': (275, 90, 825),
+    'Onion': (100, 50, 80),
+    'Chilli': (120, 60, 50),
+}
+# Needs relative to loam: sands leach, black soils hold potash, red soils are short of N and P
+SEED_SOIL_FACTORS = {
+    'clay': (0.9, 1.0, 0.8),
+    'sandy': (1.25, 1.1, 1.25),
+    'loamy': (1.0, 1.0, 1.0),
+    'black': (1.1, 1.15, 0.6),
+    'red': (1.15, 1.2, 1.1),
+    'alluvial': (0.9, 1.0, 0.85),
+}
+
+
+# Trigger statement recording that crop {row}.id changed at the current catalog version
+LOG_CROP_CHANGE = '''INSERT INTO crops_changes (crop_id, version)
+                     VALUES ({crop_id}, (SELECT value FROM catalog_meta WHERE key = 'crops_version'))
+                     ON CONFLICT (crop_id) DO UPDATE SET version = excluded.version;
+'''
+
+
+def _create_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS crops
+                    (id INTEGER PRIMARY KEY,
+                     name_en TEXT, name_kn TEXT, name_ta TEXT, name_te TEXT, name_ml TEXT, name_hi TEXT,
+                     soil_types TEXT, min_rainfall INTEGER, max_rainfall INTEGER,
+                     states TEXT, yield_per_hectare REAL, profit_per_hectare INTEGER,
+                     pest_risk TEXT, fertilizer TEXT, market_price REAL,
+                     season TEXT, water_requirement TEXT, duration_months INTEGER)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS search_history
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     timestamp TEXT, soil_type TEXT, rainfall INTEGER, location TEXT,
+                     farm_size REAL, recommended_crops TEXT)''')
+
+
+def _seed_crops(conn):
+    # Databases created before versioning may already hold crops
+    if conn.execute('SELECT COUNT(*) FROM crops').fetchone()[0] == 0:
+        conn.executemany('INSERT INTO crops VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', SEED_CROPS)
+
+
+def _normalize_history(conn):
+    conn.execute('''CREATE TABLE search_history_crops
+                    (history_id INTEGER NOT NULL REFERENCES search_history (id) ON DELETE CASCADE,
+                     rank INTEGER NOT NULL, crop_id INTEGER NOT NULL,
+                     PRIMARY KEY (history_id, rank)) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX idx_history_crops_crop ON search_history_crops (crop_id)')
+    conn.execute('CREATE INDEX idx_history_timestamp ON search_history (timestamp)')
+    conn.execute('CREATE INDEX idx_history_location ON search_history (location, timestamp)')
+    conn.execute('CREATE INDEX idx_history_soil ON search_history (soil_type, timestamp)')
+    conn.execute('''CREATE TABLE history_daily_state
+                    (day TEXT NOT NULL, location TEXT NOT NULL, searches INTEGER NOT NULL,
+                     PRIMARY KEY (day, location)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE history_soil_crop
+                    (soil_type TEXT NOT NULL, crop_id INTEGER NOT NULL, recommendations INTEGER NOT NULL,
+                     PRIMARY KEY (soil_type, crop_id)) WITHOUT ROWID''')
+
+    # Backfill from the comma-joined names, which may be in any language
+    crop_ids = {}
+    for row in conn.execute('SELECT id, name_en, name_kn, name_ta, name_te, name_ml, name_hi FROM crops'):
+        for name in row[1:]:
+            crop_ids.setdefault(name, row[0])
+    history = conn.execute('SELECT id, recommended_crops FROM search_history')
+    while True:
+        rows = history.fetchmany(10_000)
+        if not rows:
+            break
+        conn.executemany('INSERT INTO search_history_crops VALUES (?, ?, ?)', [
+            (history_id, rank, crop_ids[name])
+            for history_id, names in rows
+            for rank, name in enumerate((names or '').split(', '), start=1)
+            if name in crop_ids])
+    conn.execute('''INSERT INTO history_daily_state
+                    SELECT substr(timestamp, 1, 10), location, COUNT(*) FROM search_history
+                    GROUP BY 1, 2''')
+    conn.execute('''INSERT INTO history_soil_crop
+                    SELECT h.soil_type, c.crop_id, COUNT(*)
+                    FROM search_history_crops c JOIN search_history h ON h.id = c.history_id
+                    GROUP BY 1, 2''')
+
+
+def _catalog_version(conn):
+    # Bumped by triggers on every change to crops; caches compare it to decide when to rebuild
+    conn.execute('''CREATE TABLE catalog_meta
+                    (key TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID''')
+    conn.execute("INSERT INTO catalog_meta VALUES ('crops_version', 1)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''CREATE TRIGGER crops_version_{event.lower()} AFTER {event} ON crops
+                         BEGIN
+                             UPDATE catalog_meta SET value = value + 1 WHERE key = 'crops_version';
+                         END''')
+
+
+def _crop_change_log(conn):
+    # Which crops changed at which catalog version, so caches reload and drop only those.
+    # Bulk loads set 'bulk_load' inside their transaction and log changes set-wise instead.
+    conn.execute('''CREATE TABLE crops_changes
+                    (crop_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)''')
+    conn.execute('CREATE INDEX idx_crops_changes_version ON crops_changes (version)')
+    conn.execute("INSERT INTO catalog_meta VALUES ('bulk_load', 0)")
+    logged = {'INSERT': ['NEW'], 'UPDATE': ['OLD', 'NEW'], 'DELETE': ['OLD']}
+    for event, rows in logged.items():
+        conn.execute(f'DROP TRIGGER crops_version_{event.lower()}')
+        log = ''.join(LOG_CROP_CHANGE.format(crop_id=f'{row}.id') for row in rows)
+        conn.execute(f'''CREATE TRIGGER crops_changed_{event.lower()} AFTER {event} ON crops
+                         WHEN (SELECT value FROM catalog_meta WHERE key = 'bulk_load') = 0
+                         BEGIN
+                             UPDATE catalog_meta SET value = value + 1 WHERE key = 'crops_version';
+                             {log}
+                         END''')
+
+
+def _crop_names(conn):
+    # One row per (crop, language) instead of a name column per language; crops_named
+    # puts them back in the old row shape (same columns, same order) for readers that want every name
+    conn.execute('''CREATE TABLE crop_names
+                    (crop_id INTEGER NOT NULL REFERENCES crops (id) ON DELETE CASCADE,
+                     lang TEXT NOT NULL, name TEXT NOT NULL,
+                     PRIMARY KEY (crop_id, lang)) WITHOUT ROWID''')
+    conn.execute('INSERT INTO crop_names ' + ' UNION ALL '.join(
+        f"SELECT id, '{lang}', name_{lang} FROM crops WHERE name_{lang} IS NOT NULL" for lang in NAME_LANGUAGES))
+    for lang in NAME_LANGUAGES:
+        conn.execute(f'ALTER TABLE crops DROP COLUMN name_{lang}')
+    names = ', '.join(f"(SELECT name FROM crop_names WHERE crop_id = c.id AND lang = '{lang}') AS name_{lang}"
+                      for lang in NAME_LANGUAGES)
+    rest = ', '.join(f'c.{row[1]}' for row in conn.execute('PRAGMA table_info(crops)') if row[1] != 'id')
+    conn.execute(f'CREATE VIEW crops_named AS SELECT c.id, {names}, {rest} FROM crops c')
+    # A renamed crop is a changed crop for catalog reloads
+    logged = {'INSERT': ['NEW'], 'UPDATE': ['OLD', 'NEW'], 'DELETE': ['OLD']}
+    for event, rows in logged.items():
+        log = ''.join(LOG_CROP_CHANGE.format(crop_id=f'{row}.crop_id') for row in rows)
+        conn.execute(f'''CREATE TRIGGER crop_names_changed_{event.lower()} AFTER {event} ON crop_names
+                         WHEN (SELECT value FROM catalog_meta WHERE key = 'bulk_load') = 0
+                         BEGIN
+                             UPDATE catalog_meta SET value = value + 1 WHERE key = 'crops_version';
+                             {log}
+                         END''')
+
+
+def _price_ticks(conn):
+    # Append-only mandi prices; readers follow new rows by id, so rows are never rewritten.
+    # No foreign key: ticks for a crop that is later removed are simply ignored.
+    conn.execute('''CREATE TABLE price_ticks
+                    (id INTEGER PRIMARY KEY, crop_id INTEGER NOT NULL, market TEXT NOT NULL,
+                     date TEXT NOT NULL, price REAL NOT NULL)''')
+    conn.execute('CREATE INDEX idx_price_ticks_date ON price_ticks (date)')
+    conn.execute('''CREATE TRIGGER price_ticks_append_only BEFORE UPDATE ON price_ticks
+                    BEGIN SELECT RAISE(ABORT, 'price_ticks is append-only'); END''')
+
+
+def _crop_nutrients(conn):
+    # N/P2O5/K2O needs per crop and soil type; a change re-ranks the crop like any other catalog change
+    conn.execute('''CREATE TABLE crop_nutrients
+                    (crop_id INTEGER NOT NULL REFERENCES crops (id) ON DELETE CASCADE,
+                     soil_type TEXT NOT NULL, n REAL NOT NULL, p REAL NOT NULL, k REAL NOT NULL,
+                     PRIMARY KEY (crop_id, soil_type)) WITHOUT ROWID''')
+    logged = {'INSERT': ['NEW'], 'UPDATE': ['OLD', 'NEW'], 'DELETE': ['OLD']}
+    for event, rows in logged.items():
+        log = ''.join(LOG_CROP_CHANGE.format(crop_id=f'{row}.crop_id') for row in rows)
+        conn.execute(f'''CREATE TRIGGER crop_nutrients_changed_{event.lower()} AFTER {event} ON crop_nutrients
+                         WHEN (SELECT value FROM catalog_meta WHERE key = 'bulk_load') = 0
+                         BEGIN
+                             UPDATE catalog_meta SET value = value + 1 WHERE key = 'crops_version';
+                             {log}
+                         END''')
+    # Seed crops still in the catalog under their seed name, on the soils they list
+    seeds = conn.execute('''SELECT c.id, n.name, c.soil_types FROM crops c
+                            JOIN crop_names n ON n.crop_id = c.id AND n.lang = 'en' ''').fetchall()
+    conn.executemany('INSERT INTO crop_nutrients VALUES (?, ?, ?, ?, ?)', [
+        (crop_id, soil, *(round(need * factor) for need, factor in zip(SEED_NUTRIENTS[name], SEED_SOIL_FACTORS[soil])))
+        for crop_id, name, soils in seeds if name in SEED_NUTRIENTS
+        for soil in dict.fromkeys(key.strip() for key in (soils or '').split(',')) if soil in SEED_SOIL_FACTORS])
+
+
+def _partition_history(conn):
+    # History moves out of this file into one SQLite file per month (see history_store).
+    # Rows keep their ids within their month's file; copies are idempotent, so if this
+    # transaction fails after some months were written, the retry copies them again harmlessly.
+    path = next(row[2] for row in conn.execute('PRAGMA database_list') if row[1] == 'main')
+    if path:
+        directory = history_store.history_dir(path)
+        months = {}
+        for month, in conn.execute('SELECT DISTINCT substr(timestamp, 1, 7) FROM search_history'):
+            months.setdefault(history_store.month_of(month), []).append(month)
+        for month, prefixes in months.items():
+            where = ' OR '.join(['substr(h.timestamp, 1, 7) IS ?'] * len(prefixes))
+            history = conn.execute(f'SELECT h.* FROM search_history h WHERE {where}', prefixes)
+            crops = conn.execute(f'''SELECT c.* FROM search_history_crops c
+                                     JOIN search_history h ON h.id = c.history_id WHERE {where}''', prefixes)
+            history_store.import_partition(directory, month, history, crops)
+    for table in ('search_history_crops', 'history_daily_state', 'history_soil_crop', 'search_history'):
+        conn.execute(f'DROP TABLE {table}')
+
+
+def _crop_fingerprints(conn):
+    # Hash of each crop's row as last bulk loaded, and the catalog version it was checked at.
+    # Any later change logs a newer version in crops_changes, which makes the hash stale.
+    conn.execute('''CREATE TABLE crops_fingerprints
+                    (crop_id INTEGER PRIMARY KEY, fingerprint INTEGER NOT NULL, version INTEGER NOT NULL)''')
+
+
+def _group_crop_names(conn):
+    # crops_named as one join grouped per crop instead of a correlated lookup per language
+    names = ', '.join(f"max(CASE n.lang WHEN '{lang}' THEN n.name END) AS name_{lang}" for lang in NAME_LANGUAGES)
+    rest = ', '.join(f'c.{row[1]}' for row in conn.execute('PRAGMA table_info(crops)') if row[1] != 'id')
+    conn.execute('DROP VIEW crops_named')
+    conn.execute(f'''CREATE VIEW crops_named AS
+                    SELECT c.id, {names}, {rest} FROM crops c
+                    LEFT JOIN crop_names n ON n.crop_id = c.id GROUP BY c.id''')
+
+
+# (version, description, function); append new migrations, never edit old ones
+MIGRATIONS = [
+    (1, 'create crops and search_history tables', _create_tables),
+    (2, 'seed sample crops', _seed_crops),
+    (3, 'normalize search history and add rollups', _normalize_history),
+    (4, 'track crop catalog version', _catalog_version),
+    (5, 'log changed crops per catalog version', _crop_change_log),
+    (6, 'move crop names to a crop_names side table', _crop_names),
+    (7, 'add append-only price_ticks', _price_ticks),
+    (8, 'move search history to monthly partition files', _partition_history),
+    (9, 'add crop nutrient needs per soil type', _crop_nutrients),
+    (10, 'add bulk load fingerprints per crop', _crop_fingerprints),
+    (11, 'build crops_named from one grouped join', _group_crop_names),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+# What the old init_db cost on every rerun, now saved: the median legacy_init_db_ms
+# measured by benchmarks/bench_startup.py (re-measure there when the schema changes)
+LEGACY_INIT_SECONDS = 0.0006
+
+_timing_hooks = [lambda name, seconds: logger.info("startup %s: %.2f ms", name, seconds * 1000)]
+_migrated = set()
+_lock = threading.Lock()
+
+
+def add_timing_hook(hook):
+    """Register ``hook(name, seconds)`` to receive startup timings"""
+    _timing_hooks.append(hook)
+
+
+def _report(name, seconds):
+    for hook in _timing_hooks:
+        hook(name, seconds)
+
+
+def legacy_init_db(conn):
+    """Run what the old init_db repeated on every rerun: create tables, count crops.
+
+    Only for measuring :data:`LEGACY_INIT_SECONDS`; callers roll it back.
+    """
+    _create_tables(conn)
+    conn.execute('SELECT COUNT(*) FROM crops').fetchone()
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(pool):
+    """Bring the database up to SCHEMA_VERSION; a no-op after the first call per process.
+
+    Returns the schema version of the database.
+    """
+    with _lock:
+        if pool.path in _migrated:
+            return SCHEMA_VERSION
+        start = time.perf_counter()
+        with pool.connection() as conn:
+            version = schema_version(conn)
+            for target, description, step in MIGRATIONS:
+                if target <= version:
+                    continue
+                step_start = time.perf_counter()
+                # Take the write lock first so concurrent processes migrate one at a time
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if schema_version(conn) < target:
+                        step(conn)
+                        conn.execute(f'PRAGMA user_version = {target}')
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                version = target
+                _report(f'migration {target} ({description})', time.perf_counter() - step_start)
+        _migrated.add(pool.path)
+    _report('migrate', time.perf_counter() - start)
+    _report('saved per rerun', LEGACY_INIT_SECONDS)
+    return version
@@ -0,0 +1,215 @@
+"""Fertilizer plans and input costs per crop, soil type and farm.
+
+A crop's ``fertilizer`` column is only a label. What it needs is in
+``crop_nutrients``: kilograms of N, P2O5 and K2O per hectare for each soil
+type it grows on (soils differ in what they already supply). Needs are met
+with straight fertilizers, as in the usual state recommendations:
+
+- DAP (18-46-0) for all the phosphate, which also brings some nitrogen
+- MOP (60% K2O) for the potash
+- urea (46% N) for the nitrogen still missing
+
+Kilograms of each product are a linear map of the need plus a clip at zero,
+so a whole catalog, or a million farm plans, is costed with a few array
+operations. Rankings, cards and exports use the exact cost per hectare:
+``profit_per_hectare`` becomes the catalog profit minus it. A farm buys
+whole bags, so its bill and total profit (:func:`farm_plan`) round each
+product up to bags for the farm's size.
+
+A crop with no row for a soil type has no fertilizer cost on it.
+
+Usage:
+    python nutrients.py load needs.csv --rejects rejected.csv
+    python nutrients.py show 1 4 10 --soil loamy --farm-size 2
+"""
+import argparse
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import db
+import migrations
+
+NUTRIENT_COLUMNS = ('n', 'p', 'k')
+NEED_COLUMNS = ['crop_id', 'soil_type', *NUTRIENT_COLUMNS]
+# Above this many kg of a nutrient per hectare a need is taken to be a typo
+MAX_NEED = 2000
+
+# A straight fertilizer: N, P2O5 and K2O shares by weight, bag size (kg) and price per bag (₹, MRP)
+Fertilizer = namedtuple('Fertilizer', 'key name n p k bag_kg bag_price')
+FERTILIZERS = (
+    Fertilizer('urea', 'Urea', 0.46, 0.0, 0.0, 45, 266.5),
+    Fertilizer('dap', 'DAP', 0.18, 0.46, 0.0, 50, 1350.0),
+    Fertilizer('mop', 'MOP', 0.0, 0.0, 0.60, 50, 1700.0),
+)
+UREA, DAP, MOP = FERTILIZERS
+BAG_KG = np.array([fertilizer.bag_kg for fertilizer in FERTILIZERS], dtype=np.float64)
+BAG_PRICE = np.array([fertilizer.bag_price for fertilizer in FERTILIZERS])
+PRICE_PER_KG = BAG_PRICE / BAG_KG
+
+# Columns added to recommended crops: kg of each fertilizer per hectare and what they cost
+RATE_COLUMNS = [f'{fertilizer.key}_kg_per_hectare' for fertilizer in FERTILIZERS]
+COST_COLUMN = 'fertilizer_cost_per_hectare'
+# Columns of a whole-farm plan in batch results
+BAG_COLUMNS = [f'{fertilizer.key}_bags' for fertilizer in FERTILIZERS]
+
+# Whole-farm purchase for one or many farms: bags of each fertilizer, their cost and the profit left
+FarmPlan = namedtuple('FarmPlan', 'bags cost profit')
+
+
+def rates(needs):
+    """kg per hectare of each of :data:`FERTILIZERS` for ``(..., 3)`` N/P2O5/K2O needs"""
+    needs = np.asarray(needs, dtype=np.float64)
+    dap = needs[..., 1] / DAP.p
+    mop = needs[..., 2] / MOP.k
+    urea = np.maximum(needs[..., 0] - DAP.n * dap, 0.0) / UREA.n
+    return np.stack([urea, dap, mop], axis=-1)
+
+
+def cost_per_hectare(per_hectare):
+    """Cost in whole rupees of ``(..., 3)`` kg per hectare of each fertilizer"""
+    return np.round(per_hectare @ PRICE_PER_KG).astype(np.int64)
+
+
+def net_profit(profit_per_hectare, needs):
+    """Profit per hectare after buying the fertilizer for ``needs`` (one row per crop)"""
+    return np.asarray(profit_per_hectare, dtype=np.int64) - cost_per_hectare(rates(needs))
+
+
+def need_arrays(crop_ids, needs):
+    """Per soil type, a (crops x 3) float32 array of N/P2O5/K2O kg per hectare in ``crop_ids`` order.
+
+    ``needs`` has :data:`NEED_COLUMNS` (``crop_nutrients`` rows); crops
+    without a row for a soil type get zeros, rows for unknown crops are
+    ignored.
+    """
+    arrays = {}
+    if needs is None or not len(needs):
+        return arrays
+    rows = pd.Index(crop_ids).get_indexer(needs['crop_id'])
+    values = needs[list(NUTRIENT_COLUMNS)].to_numpy(dtype=np.float32)
+    codes, soils = pd.factorize(needs['soil_type'])
+    for code, soil_type in enumerate(soils):
+        picked = (codes == code) & (rows >= 0)
+        array = np.zeros((len(crop_ids), len(NUTRIENT_COLUMNS)), dtype=np.float32)
+        array[rows[picked]] = values[picked]
+        arrays[soil_type] = array
+    return arrays
+
+
+def with_fertilizer(crops, needs):
+    """Copy of ``crops`` net of fertilizer.
+
+    Adds kg per hectare of each fertilizer (:data:`RATE_COLUMNS`) and their
+    cost (:data:`COST_COLUMN`) for ``needs``, one N/P2O5/K2O row per crop,
+    and takes that cost off ``profit_per_hectare``.
+    """
+    crops = crops.copy()
+    per_hectare = rates(needs)
+    cost = cost_per_hectare(per_hectare)
+    for col, values in zip(RATE_COLUMNS, per_hectare.T):
+        crops[col] = values
+    crops[COST_COLUMN] = cost
+    crops['profit_per_hectare'] = crops['profit_per_hectare'].to_numpy(dtype=np.int64) - cost
+    return crops
+
+
+def farm_plan(per_hectare, profit_per_hectare, farm_size):
+    """:class:`FarmPlan` buying whole bags for farms of ``farm_size`` hectares.
+
+    ``per_hectare`` is ``(n, 3)`` kg per hectare of each fertilizer and
+    ``profit_per_hectare`` the profit after their exact cost, as
+    :func:`with_fertilizer` leaves them; ``farm_size`` is one size or one per
+    row. The profit is the farm's revenue less the other costs and the bags.
+    """
+    per_hectare = np.asarray(per_hectare, dtype=np.float64)
+    size = np.asarray(farm_size, dtype=np.float64)
+    # Rounded first so that an exact number of bags does not buy one more
+    bags = np.ceil(np.round(per_hectare * size[..., None] / BAG_KG, 6)).astype(np.int64)
+    cost = bags @ BAG_PRICE
+    gross = np.asarray(profit_per_hectare, dtype=np.float64) + cost_per_hectare(per_hectare)
+    return FarmPlan(bags, cost, gross * size - cost)
+
+
+def describe(bags):
+    """Bags of each fertilizer as text, e.g. ``3 × Urea (45 kg), 2 × DAP (50 kg)``"""
+    return ', '.join(f"{count} × {fertilizer.name} ({fertilizer.bag_kg} kg)"
+                     for count, fertilizer in zip(bags, FERTILIZERS) if count)
+
+
+def validate(needs, crop_soils, first_row=1):
+    """Split ``crop_nutrients`` rows into valid and rejected ones (with the 1-based ``row`` and ``reason``).
+
+    ``crop_soils`` maps crop id to the soil types it lists; a need for a
+    soil type the crop does not grow on is rejected.
+    """
+    missing = [col for col in NEED_COLUMNS if col not in needs.columns]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    needs = needs.reset_index(drop=True)
+    crop_id = pd.to_numeric(needs['crop_id'], errors='coerce')
+    soil_type = needs['soil_type'].fillna('').astype(str).str.strip().str.lower()
+    values = {col: pd.to_numeric(needs[col], errors='coerce') for col in NUTRIENT_COLUMNS}
+    listed = [soil in crop_soils.get(crop, ()) for crop, soil in zip(crop_id.tolist(), soil_type.tolist())]
+    checks = [((crop_id.isna() | (crop_id % 1 != 0)).to_numpy(), "crop_id is not a whole number"),
+              (~crop_id.isin(list(crop_soils)).to_numpy(), "no crop with this id")]
+    for col, column in values.items():
+        checks.append((column.isna().to_numpy(), f"{col} is not a number"))
+        checks.append((~column.between(0, MAX_NEED).to_numpy(), f"{col} is outside 0-{MAX_NEED} kg/ha"))
+    checks.append((~np.array(listed, dtype=bool), "the crop does not list this soil type"))
+
+    reasons = np.select([mask for mask, _ in checks], [reason for _, reason in checks], default='')
+    bad = reasons != ''
+    rejected = pd.DataFrame({'row': np.flatnonzero(bad) + first_row, 'crop_id': needs['crop_id'][bad].to_numpy(),
+                             'reason': reasons[bad]})
+    valid = pd.DataFrame({'crop_id': crop_id, 'soil_type': soil_type, **values})[~bad]
+    valid['crop_id'] = valid['crop_id'].astype(np.int64)
+    return valid.drop_duplicates(['crop_id', 'soil_type'], keep='last'), rejected
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load and inspect per-soil N/P/K needs and fertilizer costs")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database")
+    commands = parser.add_subparsers(dest='command', required=True)
+    load_parser = commands.add_parser('load', help="upsert crop_id, soil_type, n, p, k rows (kg/ha)")
+    load_parser.add_argument('path', help="needs file (.csv)")
+    load_parser.add_argument('--rejects', help="write rejected rows and reasons to this CSV")
+    show_parser = commands.add_parser('show', help="fertilizer plan of some crops")
+    show_parser.add_argument('crop_ids', type=int, nargs='+')
+    show_parser.add_argument('--soil', help="only this soil type")
+    show_parser.add_argument('--farm-size', type=float, default=1.0, help="hectares to buy bags for")
+    args = parser.parse_args(argv)
+
+    pool = db.ConnectionPool(args.db)
+    migrations.migrate(pool)
+    try:
+        crops = db.fetch_crops(pool)
+        if args.command == 'load':
+            crop_soils = {crop_id: {soil.strip() for soil in soils.split(',')}
+                          for crop_id, soils in zip(crops['id'].tolist(), crops['soil_types'].fillna('').tolist())}
+            valid, rejected = validate(pd.read_csv(args.path, dtype=str, keep_default_na=False), crop_soils)
+            db.upsert_crop_nutrients(pool, valid[NEED_COLUMNS].itertuples(index=False, name=None))
+            if args.rejects:
+                rejected.to_csv(args.rejects, index=False)
+            print(f"Loaded {len(valid)} needs, rejected {len(rejected)}")
+            return
+        needs = db.fetch_crop_nutrients(pool)
+        needs = needs[needs['crop_id'].isin(args.crop_ids)]
+        if args.soil:
+            needs = needs[needs['soil_type'] == args.soil.strip().lower()]
+        needs = needs.merge(crops[['id', 'name_en', 'profit_per_hectare']], left_on='crop_id', right_on='id')
+        per_hectare = rates(needs[list(NUTRIENT_COLUMNS)].to_numpy())
+        profit = net_profit(needs['profit_per_hectare'], needs[list(NUTRIENT_COLUMNS)].to_numpy())
+        plan = farm_plan(per_hectare, profit, args.farm_size)
+        for i, row in enumerate(needs.itertuples(index=False)):
+            print(f"{row.name_en} on {row.soil_type} soil: N {row.n:g}, P2O5 {row.p:g}, K2O {row.k:g} kg/ha -> "
+                  f"₹{int(cost_per_hectare(per_hectare[i])):,}/ha, profit ₹{int(profit[i]):,}/ha; "
+                  f"for {args.farm_size:g} ha buy {describe(plan.bags[i]) or 'nothing'} "
+                  f"(₹{plan.cost[i]:,.0f}), profit ₹{plan.profit[i]:,.0f}")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
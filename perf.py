@@ -0,0 +1,153 @@
+"""Lightweight timing spans and counters for the hot paths.
+
+Wrap a stage in ``with perf.span('load_crops'):`` and its wall time is
+recorded per process, so stats aggregate across every Streamlit session and
+service request. Recording is off unless ``PERF_TIMING=1`` is set (or
+:func:`enable` is called); while off, ``span`` hands back a shared no-op
+context manager and ``count`` returns immediately.
+
+Each stage keeps its call count, total and maximum, plus the most recent
+``WINDOW`` durations for the p50/p95 shown by :func:`snapshot`. The
+aggregate can be dumped as JSON (:func:`to_json`) or in the Prometheus text
+exposition format (:func:`to_prometheus`).
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+WINDOW = 2048
+METRIC_PREFIX = 'crop_planner'
+
+_enabled = os.environ.get('PERF_TIMING') == '1'
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+_NULL_SPAN = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('count', 'total', 'max', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    """Turn recording on (or off) for this process"""
+    global _enabled
+    _enabled = on
+
+
+def span(name):
+    """Context manager timing one run of stage ``name``"""
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def record(name, seconds):
+    """Add one duration for stage ``name``"""
+    if not _enabled:
+        return
+    with _lock:
+        stage = _stages.get(name)
+        if stage is None:
+            stage = _stages[name] = _Stage()
+        stage.count += 1
+        stage.total += seconds
+        stage.max = max(stage.max, seconds)
+        stage.recent.append(seconds)
+
+
+def count(name, value=1):
+    """Increment counter ``name``"""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def snapshot():
+    """Aggregated stats: ``{'stages': {name: {...}}, 'counters': {name: value}}``
+
+    Stage durations are in milliseconds; p50/p95 cover the last ``WINDOW`` runs.
+    """
+    with _lock:
+        stages = {name: (stage.count, stage.total, stage.max, sorted(stage.recent))
+                  for name, stage in _stages.items()}
+        counters = dict(_counters)
+    return {
+        'stages': {
+            name: {
+                'count': calls,
+                'total_ms': round(total * 1000, 3),
+                'mean_ms': round(total * 1000 / calls, 3),
+                'p50_ms': round(_percentile(recent, 0.5) * 1000, 3),
+                'p95_ms': round(_percentile(recent, 0.95) * 1000, 3),
+                'max_ms': round(peak * 1000, 3),
+            }
+            for name, (calls, total, peak, recent) in sorted(stages.items())
+        },
+        'counters': dict(sorted(counters.items())),
+    }
+
+
+def to_json():
+    return json.dumps(snapshot(), indent=2)
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def to_prometheus():
+    """Stats in the Prometheus text exposition format"""
+    stats = snapshot()
+    seconds = f'{METRIC_PREFIX}_stage_seconds'
+    lines = [f'# HELP {seconds} Wall time per planner stage (quantiles over the last {WINDOW} runs).',
+             f'# TYPE {seconds} summary']
+    for name, stage in stats['stages'].items():
+        label = f'stage="{_label(name)}"'
+        for quantile, key in (('0.5', 'p50_ms'), ('0.95', 'p95_ms')):
+            lines.append(f'{seconds}{{{label},quantile="{quantile}"}} {stage[key] / 1000:.6f}')
+        lines.append(f'{seconds}_sum{{{label}}} {stage["total_ms"] / 1000:.6f}')
+        lines.append(f'{seconds}_count{{{label}}} {stage["count"]}')
+    if stats['counters']:
+        events = f'{METRIC_PREFIX}_events_total'
+        lines += [f'# HELP {events} Planner event counters.', f'# TYPE {events} counter']
+        for name, value in stats['counters'].items():
+            lines.append(f'{events}{{event="{_label(name)}"}} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,385 @@
+"""Live mandi prices: append-only tick store and rolling-window aggregates.
+
+Ticks (crop, market, date, price) are appended to ``price_ticks`` and never
+rewritten. :class:`RollingPrices` keeps, per crop, the 7/30/90-day mean and
+volatility (standard deviation over mean) of the daily price, the mean over
+all markets' ticks that day. It holds a ring of the last 90 days of price
+sums and tick counts per crop, plus running sums of the daily price, its
+square and the number of priced days per window. New ticks adjust only the
+days they fall on, and a new date only subtracts the days that leave each
+window, so the store is never re-queried; reading a crop's figures is a few
+array lookups.
+
+Windows end at the newest date any crop has a tick for. A crop with no
+tick in a window has no figure for it, and recommendations fall back to its
+catalog ``market_price``.
+
+Recommendations use the 7-day mean as the crop's market price, and move
+``profit_per_hectare`` by the revenue that changes (see :func:`live_crops`).
+
+Usage:
+    python prices.py ingest ticks.csv --rejects rejected.csv
+    python prices.py ingest ticks.parquet --chunk-size 1000000
+    python prices.py show 1 4 10
+"""
+import argparse
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import db
+import migrations
+from ingest import read_chunks
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = (7, 30, 90)
+HORIZON = max(WINDOWS)
+# Window whose mean is the price recommendations use
+LIVE_WINDOW = 7
+KG_PER_TONNE = 1000
+TICK_COLUMNS = ['crop_id', 'market', 'date', 'price']
+
+# One window's figures for a crop: mean daily price, standard deviation over mean, days with a price
+PriceWindow = namedtuple('PriceWindow', 'mean volatility days')
+# Totals for one tick ingestion run
+TickStats = namedtuple('TickStats', 'rows loaded rejected seconds')
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def day_numbers(dates):
+    """ISO dates as integer days since 1970-01-01"""
+    return (pd.to_datetime(pd.Series(dates), format='%Y-%m-%d').to_numpy().astype('datetime64[D]')
+            - _EPOCH).astype(np.int64)
+
+
+def iso_date(day):
+    return str(_EPOCH + np.timedelta64(int(day), 'D'))
+
+
+class RollingPrices:
+    """Rolling 7/30/90-day price mean and volatility per crop, updated tick by tick"""
+
+    def __init__(self):
+        self.today = None
+        # Held by updates, and by readers that need several figures from one version
+        self.lock = threading.RLock()
+        # Bumped by every update, so results built from these prices can be keyed on it
+        self.version = 0
+        self._rows = {}
+        # Crop ids in row order, for looking many up at once; rebuilt when crops are added
+        self._index = pd.Index([], dtype=np.int64)
+        capacity = 64
+        self._sum = np.zeros((capacity, HORIZON))
+        self._count = np.zeros((capacity, HORIZON), dtype=np.int64)
+        self._day = np.full((capacity, HORIZON), np.iinfo(np.int64).min, dtype=np.int64)
+        # Running sums per crop and window of the daily price, its square and the days with a price
+        self._s = np.zeros((capacity, len(WINDOWS)))
+        self._q = np.zeros((capacity, len(WINDOWS)))
+        self._n = np.zeros((capacity, len(WINDOWS)), dtype=np.int64)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _row_indexes(self, crop_ids):
+        """Ring rows for ``crop_ids``, adding rows for crops seen for the first time"""
+        crop_ids = np.asarray(crop_ids, dtype=np.int64)
+        unique, inverse = np.unique(crop_ids, return_inverse=True)
+        rows = self._rows
+        for crop_id in unique.tolist():
+            if crop_id not in rows:
+                rows[crop_id] = len(rows)
+        if len(rows) > len(self._sum):
+            self._grow(max(len(rows), 2 * len(self._sum)))
+        return np.array([rows[crop_id] for crop_id in unique.tolist()], dtype=np.intp)[inverse.reshape(-1)]
+
+    def _grow(self, capacity):
+        def grown(array, fill):
+            out = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            out[:len(array)] = array
+            return out
+
+        self._sum, self._count = grown(self._sum, 0), grown(self._count, 0)
+        self._day = grown(self._day, np.iinfo(np.int64).min)
+        self._s, self._q, self._n = grown(self._s, 0), grown(self._q, 0), grown(self._n, 0)
+
+    def _advance(self, today):
+        """Move the windows' end to ``today``, dropping the days that leave each window"""
+        if self.today is not None:
+            for w, span in enumerate(WINDOWS):
+                # Days in the window before, up to the new start of the window
+                for day in range(self.today - span + 1, min(self.today, today - span) + 1):
+                    col = day % HORIZON
+                    rows = np.flatnonzero((self._day[:, col] == day) & (self._count[:, col] > 0))
+                    if len(rows):
+                        price = self._sum[rows, col] / self._count[rows, col]
+                        self._s[rows, w] -= price
+                        self._q[rows, w] -= price * price
+                        self._n[rows, w] -= 1
+        self.today = today
+
+    def add(self, crop_ids, days, price_sums, counts):
+        """Fold in ticks, given per (crop id, day) as the sum of their prices and their number.
+
+        Days must be integer days (:func:`day_numbers`); ticks more than
+        :data:`HORIZON` days older than the newest day are outside every
+        window and ignored.
+        """
+        days = np.asarray(days, dtype=np.int64)
+        if not len(days):
+            return
+        with self.lock:
+            self._add(crop_ids, days, price_sums, counts)
+
+    def _add(self, crop_ids, days, price_sums, counts):
+        newest = int(days.max())
+        if self.today is None or newest > self.today:
+            self._advance(newest)
+        keep = days > self.today - HORIZON
+        rows = self._row_indexes(np.asarray(crop_ids)[keep])
+        days = days[keep]
+        # One update per (crop, day) even when the same day comes in several pieces
+        cells, inverse = np.unique(rows * HORIZON + days % HORIZON, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        rows, cols = np.divmod(cells, HORIZON)
+        day = np.zeros(len(cells), dtype=np.int64)
+        day[inverse] = days
+        added_sum = np.bincount(inverse, weights=np.asarray(price_sums, dtype=np.float64)[keep])
+        added_count = np.bincount(inverse, weights=np.asarray(counts, dtype=np.float64)[keep]).astype(np.int64)
+
+        # A ring cell still holding an older day is reused for this one
+        stale = self._day[rows, cols] != day
+        self._sum[rows[stale], cols[stale]] = 0
+        self._count[rows[stale], cols[stale]] = 0
+        self._day[rows, cols] = day
+        had = self._count[rows, cols] > 0
+        old = np.where(had, self._sum[rows, cols] / np.maximum(self._count[rows, cols], 1), 0.0)
+        self._sum[rows, cols] += added_sum
+        self._count[rows, cols] += added_count
+        new = self._sum[rows, cols] / self._count[rows, cols]
+
+        for w, span in enumerate(WINDOWS):
+            inside = day > self.today - span
+            np.add.at(self._s[:, w], rows[inside], (new - old)[inside])
+            np.add.at(self._q[:, w], rows[inside], (new * new - old * old)[inside])
+            np.add.at(self._n[:, w], rows[inside], (~had[inside]).astype(np.int64))
+        self.version += 1
+
+    def add_ticks(self, crop_ids, dates, prices):
+        """Fold in individual ticks with ISO ``dates``"""
+        prices = np.asarray(prices, dtype=np.float64)
+        self.add(crop_ids, day_numbers(dates), prices, np.ones(len(prices), dtype=np.int64))
+
+    def window(self, crop_id, span=LIVE_WINDOW):
+        """:class:`PriceWindow` of one crop over the last ``span`` days, None without a price in it"""
+        row = self._rows.get(int(crop_id))
+        if row is None:
+            return None
+        w = WINDOWS.index(span)
+        days = int(self._n[row, w])
+        if days <= 0:
+            return None
+        mean = self._s[row, w] / days
+        spread = np.sqrt(max(self._q[row, w] / days - mean * mean, 0.0))
+        return PriceWindow(float(mean), float(spread / mean) if mean else 0.0, days)
+
+    def summary(self, crop_id):
+        """``{span: PriceWindow or None}`` for every window"""
+        return {span: self.window(crop_id, span) for span in WINDOWS}
+
+    def columns(self, crop_ids, span=LIVE_WINDOW):
+        """Mean daily price and volatility over the last ``span`` days for each crop, NaN without a price"""
+        w = WINDOWS.index(span)
+        if len(self._index) != len(self._rows):
+            self._index = pd.Index(np.fromiter(self._rows, dtype=np.int64, count=len(self._rows)))
+        rows = self._index.get_indexer(np.asarray(crop_ids, dtype=np.int64))
+        rows = np.where(rows >= 0, rows, len(self._n))
+        # A row past the end stands for crops without ticks
+        s, q, n = (np.append(array[:, w], 0) for array in (self._s, self._q, self._n))
+        days = n[rows].astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(days > 0, s[rows] / days, np.nan)
+            spread = np.sqrt(np.maximum(q[rows] / days - mean * mean, 0.0))
+            return mean, np.where(mean > 0, spread / mean, 0.0)
+
+
+def _live_change(live, market_price, yield_per_hectare):
+    """Whether each crop has a live price, its price and the profit change per hectare"""
+    priced = ~np.isnan(live)
+    change = np.where(priced, live - market_price, 0.0) * yield_per_hectare * KG_PER_TONNE
+    return priced, np.where(priced, np.round(live, 2), market_price), np.round(change)
+
+
+def live_profit_change(prices, crop_ids, market_price, yield_per_hectare):
+    """Market price at live prices and the change in profit per hectare it makes, per crop.
+
+    The figures :func:`live_crops` gives, for ranking whole match sets
+    without building their rows.
+    """
+    with prices.lock:
+        live, _ = prices.columns(crop_ids)
+    _, price, change = _live_change(live, np.asarray(market_price, dtype=np.float64), yield_per_hectare)
+    return price, change
+
+
+def live_crops(crops, prices):
+    """Copy of ``crops`` at live prices.
+
+    ``market_price`` becomes the 7-day mean where there is one, and
+    ``profit_per_hectare`` moves by the revenue that price changes
+    (yield x 1000 kg x the difference); crops without recent ticks keep
+    their catalog figures. Adds ``price_30d``, ``price_90d``, the 30-day
+    ``price_volatility`` and whether the price is ``live_price``.
+    """
+    crops = crops.copy()
+    ids = crops['id'].to_numpy()
+    with prices.lock:
+        live, _ = prices.columns(ids)
+        month, volatility = prices.columns(ids, 30)
+        quarter, _ = prices.columns(ids, 90)
+    priced, price, change = _live_change(live, crops['market_price'].to_numpy(dtype=np.float64),
+                                         crops['yield_per_hectare'].to_numpy())
+    crops['market_price'] = price
+    crops['profit_per_hectare'] = (crops['profit_per_hectare'].to_numpy() + change).astype(np.int64)
+    crops['price_30d'] = np.round(month, 2)
+    crops['price_90d'] = np.round(quarter, 2)
+    crops['price_volatility'] = np.round(volatility, 4)
+    crops['live_price'] = priced
+    return crops
+
+
+def current_crops(pool):
+    """The crop catalog at live prices, read from ``price_ticks`` once (for batch runs)"""
+    feed = PriceFeed(pool)
+    feed.poll()
+    return live_crops(db.fetch_crops(pool), feed.prices)
+
+
+class PriceFeed:
+    """:class:`RollingPrices` kept in step with ``price_ticks``.
+
+    Starts from the last 90 days of ticks and then, on each :meth:`poll`,
+    folds in only the rows appended since (rows are read by id, summed per
+    crop and day in SQL).
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.prices = RollingPrices()
+        self.last_id = 0
+
+    def poll(self):
+        """Fold in ticks appended since the last poll; returns how many (crop, day) cells changed"""
+        last_id, last_date = db.fetch_last_tick(self.pool)
+        if last_id <= self.last_id:
+            return 0
+        since = iso_date(day_numbers([last_date])[0] - HORIZON + 1)
+        if self.prices.today is not None:
+            since = max(since, iso_date(self.prices.today - HORIZON + 1))
+        days = db.fetch_tick_days(self.pool, self.last_id, last_id, since)
+        self.prices.add(days['crop_id'].to_numpy(), day_numbers(days['date']), days['price_sum'].to_numpy(),
+                        days['ticks'].to_numpy())
+        self.last_id = last_id
+        return len(days)
+
+
+def _numbers(column):
+    """Column as float64, NaN where a value is not a number"""
+    try:
+        # Clean feeds parse in one pass; to_numeric's coercion is several times slower
+        return column.astype(np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(column, errors='coerce').astype(np.float64)
+
+
+def validate_ticks(chunk, crop_ids, first_row=1):
+    """Split a chunk into ticks ready for ``price_ticks`` and rejected rows (``row``, ``reason``)"""
+    missing = [col for col in TICK_COLUMNS if col not in chunk.columns]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    chunk = chunk.reset_index(drop=True)
+    crop, price = _numbers(chunk['crop_id']), _numbers(chunk['price'])
+    date = pd.to_datetime(chunk['date'], format='%Y-%m-%d', errors='coerce')
+    market = chunk['market'].fillna('').astype(str).str.strip()
+    checks = [
+        (crop.isna().to_numpy(), "crop_id is not a number"),
+        (~crop.isin(crop_ids).to_numpy(), "crop_id is not in the catalog"),
+        (market.eq('').to_numpy(), "market is empty"),
+        (date.isna().to_numpy(), "date is not YYYY-MM-DD"),
+        (~(price > 0).to_numpy(), "price is not a positive number"),
+    ]
+    reasons = np.select([mask for mask, _ in checks], [reason for _, reason in checks], default='')
+    bad = reasons != ''
+    rejected = pd.DataFrame({'row': np.flatnonzero(bad) + first_row, 'reason': reasons[bad]})
+    valid = pd.DataFrame({'crop_id': crop[~bad].astype(np.int64), 'market': market[~bad],
+                          'date': date[~bad].dt.strftime('%Y-%m-%d'), 'price': price[~bad]})
+    return valid, rejected
+
+
+def ingest_ticks(pool, chunks, rejects=None):
+    """Validate and append every chunk of ticks, one transaction per chunk; returns :class:`TickStats`"""
+    start = time.perf_counter()
+    rows = loaded = rejected = 0
+    crop_ids = db.fetch_crops(pool)['id'].to_numpy()
+    for chunk in chunks:
+        valid, bad = validate_ticks(chunk, crop_ids, first_row=rows + 1)
+        rows += len(chunk)
+        if len(bad):
+            rejected += len(bad)
+            if rejects is not None:
+                rejects.write(bad.to_csv(index=False, header=(rejected == len(bad))).encode('utf-8'))
+        if len(valid):
+            with pool.transaction() as conn:
+                conn.executemany(db.INSERT_TICK, zip(*(valid[col].tolist() for col in TICK_COLUMNS)))
+            loaded += len(valid)
+    return TickStats(rows, loaded, rejected, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load mandi price ticks and show rolling prices")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help="append ticks from a CSV, Excel or Parquet file")
+    ingest_parser.add_argument('path', help="ticks file with crop_id, market, date (YYYY-MM-DD), price columns")
+    ingest_parser.add_argument('--chunk-size', type=int, default=500_000, help="rows validated and appended per transaction")
+    ingest_parser.add_argument('--rejects', help="write rejected rows and reasons to this CSV")
+    show_parser = commands.add_parser('show', help="rolling prices for some crops")
+    show_parser.add_argument('crop_ids', type=int, nargs='+')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    pool = db.ConnectionPool(args.db)
+    migrations.migrate(pool)
+    try:
+        if args.command == 'ingest':
+            chunks = read_chunks(args.path, args.chunk_size)
+            if args.rejects:
+                with open(args.rejects, 'wb') as rejects:
+                    stats = ingest_ticks(pool, chunks, rejects)
+            else:
+                stats = ingest_ticks(pool, chunks)
+            rate = stats.rows / stats.seconds if stats.seconds else 0.0
+            print(f"Read {stats.rows} ticks in {stats.seconds:.2f}s ({rate:,.0f} rows/s): "
+                  f"{stats.loaded} appended, {stats.rejected} rejected")
+            return
+        feed = PriceFeed(pool)
+        feed.poll()
+        today = iso_date(feed.prices.today) if feed.prices.today is not None else "no ticks"
+        print(f"Prices up to {today}")
+        for crop_id in args.crop_ids:
+            figures = []
+            for span, window in feed.prices.summary(crop_id).items():
+                figures.append(f"{span}d " + (f"{window.mean:.2f} ±{window.volatility:.1%} ({window.days} days)"
+                                              if window else "-"))
+            print(f"{crop_id}: " + ", ".join(figures))
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Multi-objective crop ranking.
+
+A crop's score is a weighted sum of five objectives, each scaled to roughly
+0..1 over the whole catalog so the weights are comparable:
+
+- ``profit``: profit per hectare after fertilizer on the query's soil type
+  (see :mod:`nutrients`) x farm size, in units of the catalog's best profit
+  per hectare (so on a bigger farm profit counts for more)
+- ``market_price``: market price over the catalog's highest
+- ``pest_risk``: low 0, medium 0.5, high 1 (a cost)
+- ``water``: water requirement Low 0 ... Very High 1 (a cost)
+- ``duration``: season length in years (a cost)
+
+Weights are given per state, with a default for the rest; the default ranks
+by net profit alone, which is the order the engine already keeps its
+candidates in, so that case takes the first ``k`` matches without scoring. Otherwise
+the matches are scored in one matrix product and the best ``k`` picked with
+``np.argpartition`` before only those are sorted.
+
+Weights can be read from a JSON file (``RANKING_WEIGHTS=weights.json`` for
+the app, ``--weights`` for the CLIs)::
+
+    {"default": {"profit": 1.0, "pest_risk": 0.2},
+     "punjab": {"profit": 1.0, "water": 0.5}}
+"""
+import copy
+import json
+
+import numpy as np
+
+OBJECTIVES = ('profit', 'market_price', 'pest_risk', 'water', 'duration')
+DEFAULT_WEIGHTS = {'profit': 1.0}
+# Categorical objectives: value -> cost in 0..1; unknown values cost nothing
+RISK_COST = {'low': 0.0, 'medium': 0.5, 'high': 1.0}
+WATER_COST = {'low': 0.0, 'medium': 1 / 3, 'high': 2 / 3, 'very high': 1.0}
+
+
+def _top(values):
+    top = np.abs(values).max() if len(values) else 0.0
+    return top if top > 0 else 1.0
+
+
+def _scale(values):
+    values = np.asarray(values, dtype=np.float64)
+    return values / _top(values)
+
+
+def _costs(values, costs):
+    return np.array([costs.get(str(value).strip().lower(), 0.0) for value in values], dtype=np.float64)
+
+
+def objectives(profit, market_price, pest_risk, water_requirement, duration_months):
+    """(crops x objectives) matrix, signed so that higher is always better.
+
+    ``pest_risk`` and ``water_requirement`` may be full columns or, with many
+    rows, categories: pass ``(categories, codes)`` to cost each category once.
+    """
+    def cost(column, costs):
+        if isinstance(column, tuple):
+            categories, codes = column
+            table = np.append(_costs(categories, costs), 0.0)
+            return table[np.where(codes >= 0, codes, len(categories))]
+        return _costs(column, costs)
+
+    return np.column_stack([
+        _scale(profit),
+        _scale(market_price),
+        -cost(pest_risk, RISK_COST),
+        -cost(water_requirement, WATER_COST),
+        -np.asarray(duration_months, dtype=np.float64) / 12,
+    ])
+
+
+def weight_vector(weights):
+    """Weights dict as a vector in :data:`OBJECTIVES` order"""
+    unknown = set(weights) - set(OBJECTIVES)
+    if unknown:
+        raise ValueError(f"unknown ranking objectives: {', '.join(sorted(unknown))}")
+    return np.array([float(weights.get(name, 0.0)) for name in OBJECTIVES])
+
+
+def load_weights(path):
+    """Per-state weights from a JSON file; the ``default`` entry applies to other states"""
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    for weights in config.values():
+        weight_vector(weights)
+    return config
+
+
+def top_k(scores, k):
+    """Indexes of the ``k`` highest scores along the last axis, best first; ties keep index order"""
+    n = scores.shape[-1]
+    if k < n:
+        # argpartition finds the k-th best score; which of the crops tied with it
+        # it keeps is arbitrary, so take everything better plus the first ties
+        kth = np.take_along_axis(scores, np.argpartition(-scores, k - 1, axis=-1)[..., k - 1:k], axis=-1)
+        tied = scores == kth
+        keep = (scores > kth) | (tied & (np.cumsum(tied, axis=-1) <= k - (scores > kth).sum(-1, keepdims=True)))
+        picked = np.nonzero(keep)[-1].reshape(scores.shape[:-1] + (k,))
+    else:
+        picked = np.broadcast_to(np.arange(n), scores.shape)
+    order = np.lexsort((picked, -np.take_along_axis(scores, picked, axis=-1)), axis=-1)
+    return np.take_along_axis(picked, order, axis=-1)
+
+
+class CropScorer:
+    """Region-weighted scores over one engine's ranked candidates.
+
+    ``weights`` maps a state (or ``default``) to a dict of objective weights.
+    Rows of :attr:`features` follow ``engine.order``, so the positions
+    :meth:`engine.RecommendationEngine.match` returns index them directly.
+    Their profit column is the catalog's; queries swap in the profit after
+    fertilizer on their soil type.
+    """
+
+    def __init__(self, engine, weights=None):
+        self.engine = engine
+        catalog, order = engine.catalog, engine.order
+        self.features = objectives(
+            catalog['profit_per_hectare'][order], catalog['market_price'][order],
+            (catalog.categories['pest_risk'], catalog.codes['pest_risk'][order]),
+            (catalog.categories['water_requirement'], catalog.codes['water_requirement'][order]),
+            catalog['duration_months'][order])
+        self.profit_scale = _top(catalog['profit_per_hectare'].astype(np.float64))
+        self.price_scale = _top(catalog['market_price'].astype(np.float64))
+        weights = dict(weights or {})
+        self.default = weight_vector(weights.pop('default', DEFAULT_WEIGHTS))
+        self.regions = {state.strip().lower(): weight_vector(w) for state, w in weights.items()}
+        # (key, copy) last built by rescaled()
+        self._rescaled = (None, None)
+
+    def rescaled(self, key, columns):
+        """Copy that scales profit and market price to other catalog-wide figures.
+
+        ``columns()`` gives (profit per hectare, market price) for every crop,
+        e.g. at live prices; it is only called when ``key`` differs from the
+        last call's, otherwise the copy built then is returned.
+        """
+        last, scorer = self._rescaled
+        if scorer is None or last != key:
+            profit, market_price = columns()
+            scorer = copy.copy(self)
+            scorer.profit_scale = _top(np.asarray(profit, dtype=np.float64))
+            scorer.price_scale = _top(np.asarray(market_price, dtype=np.float64))
+            self._rescaled = (key, scorer)
+        return scorer
+
+    def same_scales(self, other):
+        """Whether every state ranks the same under ``other``'s catalog-wide scales.
+
+        The scales only matter where profit or market price is weighed
+        against another objective.
+        """
+        if self.profit_scale == other.profit_scale and self.price_scale == other.price_scale:
+            return True
+        return not any(w[:2].any() and np.count_nonzero(w) > 1
+                       for w in [self.default, *self.regions.values()])
+
+    def weights(self, location, farm_size=1.0):
+        """Weight vector for a state, with the profit weight scaled by the farm size"""
+        weights = self.regions.get(location, self.default).copy()
+        weights[0] *= farm_size
+        return weights
+
+    def profit_only(self, location):
+        """Whether the state ranks by profit alone (the engine's own order)"""
+        weights = self.regions.get(location, self.default)
+        return weights[0] > 0 and not weights[1:].any()
+
+    def farm_size_key(self, location, farm_size):
+        """Farm size if it can change the ranking in this state, else None (for result keys)"""
+        weights = self.regions.get(location, self.default)
+        return None if not weights[0] or not weights[1:].any() else float(farm_size)
+
+    def top_k(self, positions, soil_type, location, farm_size=1.0, k=10, profit=None, market_price=None):
+        """Best ``k`` of the engine rank ``positions`` for a query on ``soil_type``, best first.
+
+        ``profit`` (net of fertilizer) and ``market_price``, one value per
+        position, replace the catalog's figures when given (live prices).
+        """
+        if self.profit_only(location):
+            return positions[:k] if profit is None else positions[top_k(np.asarray(profit, dtype=np.float64), k)]
+        features = self.features[positions]
+        if profit is None:
+            profit = self.engine.net_profit(soil_type)[positions]
+        features[:, 0] = profit / self.profit_scale
+        if market_price is not None:
+            features[:, 1] = market_price / self.price_scale
+        scores = features @ self.weights(location, farm_size)
+        return positions[top_k(scores, k)]
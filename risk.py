@@ -0,0 +1,135 @@
+"""Monte Carlo profit risk per crop.
+
+``profit_per_hectare`` is a point estimate; this samples what a season can
+actually return. Revenue per hectare is ``yield_per_hectare`` (t/ha) x 1000
+x ``market_price`` (per kg) and the rest of it is the fixed cost. Each
+sample scales the revenue by a yield factor and a price factor, both
+lognormal with mean 1, and by the share of the crop left after pests: an
+outbreak happens with a chance set by ``pest_risk`` and then takes a uniform
+share of the harvest. Profit = revenue x yield x price x (1 - pest loss) -
+cost, reported as P10/P50/P90 per hectare.
+
+The yield and price factors only enter as a product, which is again
+lognormal, so a sample costs one normal and one uniform draw (float32, in
+one vectorized pass); 10^6 samples take a few tens of milliseconds per
+crop. With a ``seed`` each crop draws from its own stream seeded by
+``(seed, crop id)``, so results are reproducible whatever the order, batch
+or worker the crop is simulated in. District runs spread the crops over a
+process pool.
+
+Usage:
+    python risk.py --samples 1000000 --seed 42
+"""
+import argparse
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import db
+import migrations
+
+SAMPLES = 1_000_000
+QUANTILES = (10, 50, 90)
+YIELD_CV = 0.2
+PRICE_CV = 0.25
+# Chance of a pest outbreak in a season, and the share of the harvest an outbreak takes
+OUTBREAK_CHANCE = {'low': 0.05, 'medium': 0.15, 'high': 0.3}
+OUTBREAK_LOSS = (0.1, 0.5)
+KG_PER_TONNE = 1000
+
+# Profit per hectare: P10/P50/P90 and the chance of losing money
+ProfitRisk = namedtuple('ProfitRisk', 'p10 p50 p90 loss_chance')
+RISK_COLUMNS = ['id', 'profit_p10', 'profit_p50', 'profit_p90', 'loss_chance']
+
+
+def _rng(seed, crop_id):
+    return np.random.default_rng(None if seed is None else [int(seed), int(crop_id)])
+
+
+def simulate(yield_per_hectare, market_price, profit_per_hectare, pest_risk, samples=SAMPLES, rng=None):
+    """``samples`` simulated profits per hectare for one crop (float32)"""
+    rng = rng or np.random.default_rng()
+    revenue = float(yield_per_hectare) * KG_PER_TONNE * float(market_price)
+    cost = revenue - float(profit_per_hectare)
+    # Product of the two mean-1 lognormal factors
+    sigma = np.sqrt(np.log1p(YIELD_CV ** 2) + np.log1p(PRICE_CV ** 2))
+    factor = rng.standard_normal(samples, dtype=np.float32)
+    factor *= sigma
+    factor -= sigma ** 2 / 2
+    np.exp(factor, out=factor)
+    # One uniform per sample: below the outbreak chance it is an outbreak, and
+    # rescaled over that range it is the share lost
+    chance = OUTBREAK_CHANCE.get(str(pest_risk).strip().lower(), 0.0)
+    if chance > 0:
+        low, high = OUTBREAK_LOSS
+        u = rng.random(samples, dtype=np.float32)
+        kept = np.where(u < chance, 1 - (low + (high - low) * (u / chance)), 1).astype(np.float32)
+        factor *= kept
+    factor *= revenue
+    factor -= cost
+    return factor
+
+
+def profit_risk(yield_per_hectare, market_price, profit_per_hectare, pest_risk, samples=SAMPLES, seed=None,
+                crop_id=0):
+    """:class:`ProfitRisk` per hectare for one crop"""
+    profits = simulate(yield_per_hectare, market_price, profit_per_hectare, pest_risk, samples,
+                       _rng(seed, crop_id))
+    p10, p50, p90 = np.percentile(profits, QUANTILES)
+    return ProfitRisk(float(p10), float(p50), float(p90), float(np.count_nonzero(profits < 0) / samples))
+
+
+def _simulate_rows(rows, samples, seed):
+    return [(crop_id, *profit_risk(y, price, profit, pest, samples, seed, crop_id))
+            for crop_id, y, price, profit, pest in rows]
+
+
+def risk_table(crops, samples=SAMPLES, seed=None, workers=1):
+    """P10/P50/P90 profit per hectare and loss chance for every row of ``crops``, in order.
+
+    With ``workers`` > 1 the crops are split across a process pool; with a
+    ``seed`` the numbers do not depend on ``workers``. A crop may appear more
+    than once, e.g. with its profit after different fertilizer costs.
+    """
+    rows = list(zip(*(crops[col].tolist() for col in
+                      ('id', 'yield_per_hectare', 'market_price', 'profit_per_hectare', 'pest_risk'))))
+    workers = min(workers or os.cpu_count() or 1, len(rows))
+    if workers <= 1:
+        results = _simulate_rows(rows, samples, seed)
+    else:
+        chunks = [rows[i::workers] for i in range(workers)]
+        results = [None] * len(rows)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, part in enumerate(pool.map(_simulate_rows, chunks, [samples] * workers, [seed] * workers)):
+                results[i::workers] = part
+    return pd.DataFrame(results, columns=RISK_COLUMNS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate profit risk for every crop in the catalog")
+    parser.add_argument('-o', '--output', help="write the table to this CSV instead of printing it")
+    parser.add_argument('--samples', type=int, default=SAMPLES, help="samples per crop")
+    parser.add_argument('--seed', type=int, help="seed for reproducible results")
+    parser.add_argument('--workers', type=int, default=0, help="processes (default: one per CPU)")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database")
+    args = parser.parse_args(argv)
+
+    pool = db.ConnectionPool(args.db)
+    migrations.migrate(pool)
+    crops = db.fetch_crops(pool)
+    pool.close()
+    table = risk_table(crops, args.samples, args.seed, args.workers)
+    table.insert(1, 'crop', crops['name_en'].to_numpy())
+    table = table.round({'profit_p10': 0, 'profit_p50': 0, 'profit_p90': 0, 'loss_chance': 4})
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f"Simulated {len(table)} crops x {args.samples} samples -> {args.output}")
+    else:
+        print(table.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Multi-season crop rotation planning.
+
+Finds the most profitable sequence of crops for one field over a 12-36
+month horizon. A crop can only be sown in the calendar months of its
+season (:data:`SEASON_MONTHS`), must be harvested before the horizon ends,
+and may not directly follow itself; months can be left fallow. Only crops
+eligible for the farm's soil, state and rainfall are considered.
+
+The solver is a dynamic program over (month, last crop) states, run
+backwards from the end of the horizon. ``F[t, c]`` is the best profit from
+month ``t`` on when the previous crop was ``c``: either leave month ``t``
+fallow (``F[t + 1, c]``), or sow the best crop other than ``c`` that can
+start in month ``t``. Only the best and second best crop per month are
+needed for the "other than ``c``" part, so each month is one vectorized
+pass over the candidates and a whole plan is ``O(horizon x crops)``.
+
+Crops earn their profit per hectare after the fertilizer they need on the
+field's soil type (see :mod:`nutrients`).
+
+Profit scales linearly with farm size, so the plan per hectare depends only
+on (soil, state, rainfall band, horizon, start month); callers memoize on
+that key and every farm with the same inputs shares one solve.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# Calendar months (1-12) in which crops of each season are sown; unknown seasons can start any month
+SEASON_MONTHS = {
+    'kharif': (6, 7),
+    'monsoon': (6, 7),
+    'rabi': (10, 11, 12),
+    'winter': (10, 11, 12),
+    'zaid': (3, 4, 5),
+    'summer': (3, 4, 5),
+    'year-round': tuple(range(1, 13)),
+}
+HORIZON_RANGE = (12, 36)
+MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# Plan for one field: catalog positions in sowing order, months from the start each is sown,
+# and the profit per hectare of the whole plan
+Rotation = namedtuple('Rotation', 'positions sow profit')
+
+_NONE = np.iinfo(np.int64).min // 4
+
+
+def sowing_months(season):
+    """Boolean mask over the 12 calendar months in which ``season`` crops are sown"""
+    mask = np.zeros(12, dtype=bool)
+    months = SEASON_MONTHS.get(str(season).strip().lower(), SEASON_MONTHS['year-round'])
+    mask[[month - 1 for month in months]] = True
+    return mask
+
+
+def best_rotation(profit, duration, sowable, horizon, start_month=6):
+    """Most profitable plan over ``horizon`` months starting in calendar ``start_month``.
+
+    ``profit`` (integers), ``duration`` (months) and ``sowable`` (crops x 12
+    calendar months) describe the candidate crops. Returns ``(indexes, sow
+    offsets, total profit)`` with the indexes into the candidates.
+    """
+    n = len(profit)
+    profit = np.asarray(profit, dtype=np.int64)
+    duration = np.maximum(np.asarray(duration, dtype=np.intp), 1)
+    crops = np.arange(n)
+    # F[t, c]: best profit from month t on after crop c; column n means no crop yet
+    F = np.zeros((horizon + 1, n + 1), dtype=np.int64)
+    best = np.full((horizon, 2), -1, dtype=np.intp)
+    best_value = np.full((horizon, 2), _NONE, dtype=np.int64)
+    for t in range(horizon - 1, -1, -1):
+        F[t] = F[t + 1]
+        if n == 0:
+            continue
+        ok = sowable[:, (start_month - 1 + t) % 12] & (t + duration <= horizon)
+        if not ok.any():
+            continue
+        value = np.where(ok, profit + F[np.minimum(t + duration, horizon), crops], _NONE)
+        top = np.argpartition(-value, 1)[:2] if n > 1 else np.array([0, -1])
+        if n > 1 and value[top[1]] > value[top[0]]:
+            top = top[::-1]
+        first = top[0]
+        second = top[1] if top[1] >= 0 and value[top[1]] > _NONE else -1
+        best[t] = first, second
+        best_value[t] = value[first], value[second] if second >= 0 else _NONE
+        # Sowing the best crop, or the runner-up after a field that just grew the best one
+        sow = np.full(n + 1, value[first])
+        sow[first] = value[second] if second >= 0 else _NONE
+        np.maximum(F[t], sow, out=F[t])
+
+    indexes, offsets = [], []
+    t, last = 0, n
+    while t < horizon:
+        # Sow as early as the best total allows
+        slot = 0 if best[t, 0] != last else 1
+        if best[t, slot] < 0 or best_value[t, slot] != F[t, last]:
+            t += 1
+            continue
+        crop = best[t, slot]
+        indexes.append(crop)
+        offsets.append(t)
+        t += int(duration[crop])
+        last = crop
+    return np.array(indexes, dtype=np.intp), np.array(offsets, dtype=np.intp), int(F[0, n])
+
+
+class RotationSolver:
+    """Rotation plans over one engine's catalog.
+
+    Crop arrays are kept in ``engine.order`` so the positions
+    :meth:`engine.RecommendationEngine.match` returns index them directly.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        catalog, order = engine.catalog, engine.order
+        self.duration = catalog['duration_months'][order]
+        seasons = catalog.categories['season']
+        months = np.vstack([sowing_months(season) for season in seasons] + [sowing_months(None)])
+        codes = catalog.codes['season'][order]
+        self.sowable = months[np.where(codes >= 0, codes, len(seasons))]
+
+    def key(self, soil_type, rainfall, location, horizon, start_month):
+        """Memo key shared by every farm with the same plan per hectare"""
+        return (soil_type, self.engine.rainfall_band(soil_type, location, rainfall), location,
+                int(horizon), int(start_month))
+
+    def solve(self, soil_type, rainfall, location, horizon=12, start_month=6):
+        """Best :class:`Rotation` for a field with these inputs"""
+        low, high = HORIZON_RANGE
+        if not low <= horizon <= high:
+            raise ValueError(f"horizon must be {low}-{high} months")
+        if not 1 <= start_month <= 12:
+            raise ValueError("start_month must be 1-12")
+        positions = self.engine.match(soil_type, rainfall, location)
+        profit = self.engine.net_profit(soil_type)[positions]
+        indexes, sow, profit = best_rotation(profit, self.duration[positions],
+                                             self.sowable[positions], horizon, start_month)
+        return Rotation(self.engine.order[positions[indexes]], sow, profit)
@@ -0,0 +1,263 @@
+"""HTTP/JSON recommendation service for the SMS/IVR channel.
+
+Usage:
+    python service.py --host 127.0.0.1 --port 8080 --workers 8
+
+Endpoints:
+    GET  /health
+    GET  /metrics           stage timings, Prometheus text (/metrics.json for JSON)
+    POST /recommend         {"soil_type": "loamy", "rainfall": 1500, "location": "karnataka",
+                             "farm_size": 2, "lang": "en", "top_n": 4}
+                            rainfall may be left out when the service has a --climate grid;
+                            each crop carries the fertilizer bags the farm needs and
+                            the total profit after them
+    POST /recommend/batch   {"queries": [{...}, {...}]}
+
+Connections are handled on an asyncio event loop (HTTP/1.1 with
+keep-alive); queries run on a thread pool against one shared
+:class:`core.CropPlanner`, so every request reuses the same in-memory
+catalog, engine and result cache. Stage timings are only recorded when the
+service is started with ``--timing`` (or ``PERF_TIMING=1``).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import db
+import nutrients
+import perf
+from cache import ResultCache
+from catalog import LANGUAGES
+from climate import Climatology
+from core import RAINFALL_RANGE, TOP_K, CropPlanner
+from ranking import load_weights
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = ['id', 'yield_per_hectare', 'profit_per_hectare', 'pest_risk', 'fertilizer',
+                 'market_price', 'season', 'water_requirement', 'duration_months',
+                 *nutrients.RATE_COLUMNS, nutrients.COST_COLUMN]
+# Added by live mandi prices (see prices.live_crops)
+LIVE_PRICE_FIELDS = ['price_30d', 'price_90d', 'price_volatility', 'live_price']
+MAX_BODY = 8 * 1024 * 1024
+MAX_BATCH = 10_000
+MAX_TOP_N = TOP_K
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _records(crops, lang):
+    """Recommended crops as plain JSON-ready dicts"""
+    names = crops[f'name_{lang}'].tolist()
+    fields = RECORD_FIELDS + [field for field in LIVE_PRICE_FIELDS if field in crops.columns]
+    columns = {field: crops[field].tolist() for field in fields}
+    # Crops without recent ticks have no rolling prices: null, not NaN
+    for field in LIVE_PRICE_FIELDS[:2]:
+        if field in columns:
+            columns[field] = [None if value != value else value for value in columns[field]]
+    return [dict(name=names[i], **{field: columns[field][i] for field in fields})
+            for i in range(len(names))]
+
+
+class RecommendationService:
+    """Request handling, independent of the transport"""
+
+    def __init__(self, planner, save_history=True):
+        self.planner = planner
+        self.save_history = save_history
+        # (matches, serialized top crops) per planner result key
+        self.records = ResultCache(lambda entry: 512 * len(entry[1]) + 64, max_bytes=32 * 1024 * 1024)
+
+    def answer(self, query):
+        """Answer one query dict"""
+        if not isinstance(query, dict):
+            raise BadRequest("each query must be a JSON object")
+        try:
+            soil_type = str(query['soil_type']).strip().lower()
+            location = str(query['location']).strip().lower()
+            rainfall = float(query['rainfall']) if query.get('rainfall') is not None else None
+            farm_size = float(query.get('farm_size', 1.0))
+            top_n = int(query.get('top_n', 4))
+        except KeyError as exc:
+            raise BadRequest(f"missing field {exc.args[0]!r}") from None
+        except (TypeError, ValueError) as exc:
+            raise BadRequest(str(exc)) from None
+        lang = query.get('lang', 'en')
+        if lang not in LANGUAGES:
+            raise BadRequest(f"unknown lang {lang!r}")
+        if not 0 < top_n <= MAX_TOP_N:
+            raise BadRequest(f"top_n must be between 1 and {MAX_TOP_N}")
+        if not (math.isfinite(farm_size) and farm_size > 0):
+            raise BadRequest("farm_size must be a positive number")
+        low, high, _ = RAINFALL_RANGE
+        if rainfall is not None and not (math.isfinite(rainfall) and low <= rainfall <= high):
+            raise BadRequest(f"rainfall must be between {low} and {high}")
+
+        planner = self.planner
+        if rainfall is None:
+            try:
+                rainfall = planner.expected_rainfall(location, query.get('district'))
+            except ValueError as exc:
+                raise BadRequest(str(exc)) from None
+
+        snapshot = planner.snapshot()
+
+        def build():
+            result = planner.recommend(soil_type, rainfall, location, lang, farm_size, snapshot)
+            return result.matches, _records(result.crops, lang)
+
+        planner.refresh_cache(self.records)
+        with planner.prices_held():
+            matches, records = self.records.get_or_compute(
+                planner.result_key(soil_type, rainfall, location, lang, farm_size, snapshot), build, snapshot.version)
+
+        if self.save_history and records:
+            planner.save_history(soil_type, rainfall, location, farm_size,
+                                 [r['name'] for r in records], [r['id'] for r in records])
+        records = records[:top_n]
+        plan = nutrients.farm_plan(np.reshape([[r[col] for col in nutrients.RATE_COLUMNS] for r in records], (-1, 3)),
+                                   [r['profit_per_hectare'] for r in records], farm_size)
+        crops = [dict(record, fertilizer_bags=dict(zip((f.key for f in nutrients.FERTILIZERS), bags)),
+                      fertilizer_cost=cost, total_profit=profit)
+                 for record, bags, cost, profit in zip(records, plan.bags.tolist(), plan.cost.tolist(),
+                                                       plan.profit.tolist())]
+        return {'soil_type': soil_type, 'rainfall': rainfall, 'location': location,
+                'farm_size': farm_size, 'matches': matches, 'crops': crops}
+
+    def handle(self, method, path, body):
+        """(status, payload) for one HTTP request"""
+        if path == '/health':
+            return 200, {'status': 'ok', 'catalog_version': self.planner.catalog_version()}
+        if path == '/metrics':
+            return 200, perf.to_prometheus()
+        if path == '/metrics.json':
+            return 200, perf.snapshot()
+        if path not in ('/recommend', '/recommend/batch'):
+            return 404, {'error': f"no such endpoint {path}"}
+        if method != 'POST':
+            return 405, {'error': "use POST"}
+        try:
+            payload = json.loads(body or b'null')
+            if path == '/recommend':
+                with perf.span('request.recommend'):
+                    return 200, self.answer(payload)
+            queries = payload.get('queries') if isinstance(payload, dict) else None
+            if not isinstance(queries, list):
+                raise BadRequest("batch body must be {\"queries\": [...]}")
+            if len(queries) > MAX_BATCH:
+                raise BadRequest(f"at most {MAX_BATCH} queries per batch")
+            with perf.span('request.batch'):
+                return 200, {'results': [self.answer(query) for query in queries]}
+        except (BadRequest, json.JSONDecodeError) as exc:
+            return 400, {'error': str(exc)}
+        except Exception:
+            logger.exception("failed to answer %s", path)
+            return 500, {'error': "internal error"}
+
+
+async def _serve_connection(service, executor, reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                return
+            lines = head.decode('latin-1').split('\r\n')
+            try:
+                method, target, version = lines[0].split(' ', 2)
+            except ValueError:
+                return
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                if name:
+                    headers[name.strip().lower()] = value.strip()
+            keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                          or headers.get('connection', '').lower() == 'keep-alive')
+
+            try:
+                length = int(headers.get('content-length', 0) or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                status, payload, keep_alive = 400, {'error': "invalid Content-Length"}, False
+            elif length > MAX_BODY:
+                status, payload, keep_alive = 413, {'error': "request body too large"}, False
+            else:
+                body = await reader.readexactly(length) if length else b''
+                path = target.split('?', 1)[0]
+                status, payload = await loop.run_in_executor(
+                    executor, service.handle, method.upper(), path, body)
+
+            if isinstance(payload, str):
+                data, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+            else:
+                data, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json'
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=8080, workers=8, db_path=db.DB_PATH, save_history=True, weights=None,
+                climate=None):
+    """Run the service until cancelled"""
+    planner = CropPlanner(db_path, weights=weights, climate=climate)
+    service = RecommendationService(planner, save_history=save_history)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recommend')
+    server = await asyncio.start_server(
+        lambda reader, writer: _serve_connection(service, executor, reader, writer),
+        host, port, backlog=1024)
+    logger.info("serving on http://%s:%d with %d workers", host, port, workers)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=True)
+        planner.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless crop recommendation service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=8, help="threads answering queries")
+    parser.add_argument('--db', default=db.DB_PATH, help="SQLite crop database")
+    parser.add_argument('--no-history', action='store_true', help="do not record queries in search_history")
+    parser.add_argument('--timing', action='store_true', help="record stage timings for /metrics")
+    parser.add_argument('--weights', help="JSON file of per-state ranking weights")
+    parser.add_argument('--climate', help="rainfall grid (.npy from climate.py) for queries without rainfall")
+    args = parser.parse_args(argv)
+    if args.timing:
+        perf.enable()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    try:
+        weights = load_weights(args.weights) if args.weights else None
+        climatology = Climatology(args.climate) if args.climate else None
+        asyncio.run(serve(args.host, args.port, args.workers, args.db, save_history=not args.no_history,
+                          weights=weights, climate=climatology))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()